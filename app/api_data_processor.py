@@ -1,8 +1,174 @@
+from __future__ import annotations
+
+import re
 import datetime
 
-import pandas as pd
+from typing import TYPE_CHECKING
+
+from app.db import codecs
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from app.dto import DeliveryType, TimePeriod
+
+# pandas takes a good part of a second to import and worker processes import
+# this module on start, so it is only imported by the methods that use it.
+
+
+SERVICE_CENTER_PREFIX = re.compile(r'^СЦ\s+')
+
+
+def warehouse_sort_key(name: str) -> str:
+    return SERVICE_CENTER_PREFIX.sub('', name)
+
+
+# Module-level functions below run in the worker pool, they take the raw cached
+# snapshot and return small results so little has to travel back to the loop.
+
+def decode_snapshot(raw: str | bytes) -> list[dict]:
+    return codecs.decode(raw)
+
+
+def summarize_snapshot(raw: str | bytes) -> tuple[int, list[tuple[int, str]], dict[str, int | None]]:
+    """Row count, warehouses and box types of a snapshot, the latter two feed the catalog"""
+    snapshot = decode_snapshot(raw)
+    if not isinstance(snapshot, list):
+        raise ValueError(f"Expected a list of coefficients, got {type(snapshot).__name__}")
+    warehouses = {wh["warehouseID"]: wh["warehouseName"] for wh in snapshot}
+    box_types = {wh["boxTypeName"]: wh.get("boxTypeID") for wh in snapshot}
+    return len(snapshot), list(warehouses.items()), box_types
+
+
+def unique_warehouses(raw: str | bytes) -> list[tuple[int, str]]:
+    warehouses = {wh["warehouseID"]: wh["warehouseName"] for wh in decode_snapshot(raw)}
+    return sorted(warehouses.items(), key=lambda item: warehouse_sort_key(item[1]))
+
+
+def unique_box_types(raw: str | bytes) -> list[str]:
+    box_types = {wh["boxTypeName"] for wh in decode_snapshot(raw)}
+    return sorted(box_types, key=warehouse_sort_key)
+
+
+MATRIX_DAYS = 14
+
+
+def coefficient_matrix(raw: str | bytes, days: int = MATRIX_DAYS) -> dict:
+    """Coefficients pivoted to warehouse rows and date columns, one table per box type.
+
+    Covers the first days dates of the snapshot. A cell is -1 where acceptance
+    is closed and None where the snapshot has no slot.
+    """
+    import pandas as pd
 
-from app.dto import DeliveryType, TimePeriod
+    slots = pd.DataFrame(decode_snapshot(raw))
+    if slots.empty:
+        return {"dates": [], "tables": []}
+
+    slots["date"] = slots["date"].str[:10]
+    slots["coefficient"] = pd.to_numeric(slots["coefficient"], errors="coerce")
+    dates = sorted(slots["date"].unique())[:days]
+    matrix = (
+        slots[slots["date"].isin(dates)]
+        .pivot_table(index=["boxTypeName", "warehouseName"], columns="date", values="coefficient", aggfunc="first")
+        .reindex(columns=dates)
+        .sort_index(key=lambda index: index.map(warehouse_sort_key))
+    )
+    tables = []
+    for box_type, table in matrix.groupby(level="boxTypeName", sort=False):
+        rows = [[None if pd.isna(value) else int(value) for value in row] for row in table.to_numpy().tolist()]
+        tables.append((box_type, table.index.get_level_values("warehouseName").tolist(), rows))
+    return {"dates": dates, "tables": tables}
+
+
+def coefficient_matrix_pages(raw: str | bytes) -> list[tuple[str, list[str]]]:
+    """The matrix of a snapshot rendered to /supply pages per box type"""
+    from app.utils.matrix import render_pages
+
+    return render_pages(coefficient_matrix(raw))
+
+
+SLOT_COLUMNS = ["warehouseID", "boxTypeName", "date"]
+# one row per rule, see app.rules.decision_table
+RULE_COLUMNS = [
+    "rule_id", "warehouseID", "boxTypeName", "coefficient_less", "free_only", "drop_by", "book", "tracked_dates",
+]
+
+
+def evaluate_rules(
+    raw: str | bytes,
+    rules: list[tuple],
+    dates: list[str],
+    previous_raw: str | bytes | None = None,
+) -> list[dict]:
+    """Available slots matching any of the rules, one entry per slot.
+
+    A slot reports the first matching rule by id, preferring rules that book.
+    dates only limit the rules with tracked_dates, i.e. the tracking menus.
+
+    Rules are joined to the slots by their warehouse and box type (one hash
+    join per wildcard combination) and the conditions are evaluated as
+    column masks, so the cost grows with matches rather than rules x rows.
+    """
+    import pandas as pd
+
+    slots = pd.DataFrame(decode_snapshot(raw))
+    if slots.empty or not rules:
+        return []
+
+    slots["coefficient"] = pd.to_numeric(slots["coefficient"], errors="coerce")
+    slots = slots[slots["coefficient"].notna() & (slots["coefficient"] != -1)]
+
+    if previous_raw is not None:
+        previous = pd.DataFrame(decode_snapshot(previous_raw))
+        previous = previous[SLOT_COLUMNS + ["coefficient"]].rename(columns={"coefficient": "previous_coefficient"})
+        previous["previous_coefficient"] = pd.to_numeric(previous["previous_coefficient"], errors="coerce")
+        slots = slots.merge(previous.drop_duplicates(SLOT_COLUMNS), on=SLOT_COLUMNS, how="left")
+    else:
+        slots = slots.assign(previous_coefficient=float("nan"))
+
+    table = pd.DataFrame(rules, columns=RULE_COLUMNS).astype(
+        {"rule_id": float, "coefficient_less": float, "drop_by": float, "free_only": bool, "book": bool, "tracked_dates": bool}
+    )
+    any_warehouse = table["warehouseID"].isna()
+    any_box_type = table["boxTypeName"].isna()
+    joined = []
+    for keys, selected in (
+        (["warehouseID", "boxTypeName"], ~any_warehouse & ~any_box_type),
+        (["warehouseID"], ~any_warehouse & any_box_type),
+        (["boxTypeName"], any_warehouse & ~any_box_type),
+        ([], any_warehouse & any_box_type),
+    ):
+        group = table[selected].drop(columns=[column for column in ("warehouseID", "boxTypeName") if column not in keys])
+        if group.empty:
+            continue
+        if "warehouseID" in keys:
+            group = group.astype({"warehouseID": slots["warehouseID"].dtype})
+        joined.append(slots.merge(group, on=keys) if keys else slots.merge(group, how="cross"))
+    if not joined:
+        return []
+    candidates = pd.concat(joined, ignore_index=True)
+
+    coefficient = candidates["coefficient"]
+    previous_coefficient = candidates["previous_coefficient"]
+    below = candidates["coefficient_less"].isna() | (coefficient < candidates["coefficient_less"])
+    free = ~candidates["free_only"] | (coefficient == 0)
+    dropped = candidates["drop_by"].isna() | (
+        (previous_coefficient != -1) & (previous_coefficient - coefficient >= candidates["drop_by"])
+    )
+
+    dated = ~candidates["tracked_dates"] | candidates["date"].isin(dates)
+
+    matched = candidates[below & free & dropped & dated].sort_values(
+        ["book", "rule_id"], ascending=[False, True], na_position="first"
+    )
+    matched = matched.drop_duplicates(SLOT_COLUMNS)
+    matched = matched.astype({"coefficient": int}).sort_values(["warehouseName", "date", "boxTypeName"])
+    columns = ["date", "coefficient", "warehouseID", "warehouseName", "boxTypeName", "rule_id", "book"]
+    return [
+        {**row, "rule_id": None if pd.isna(row["rule_id"]) else int(row["rule_id"])}
+        for row in matched[columns].to_dict("records")
+    ]
 
 
 class WildberriesSupplyDataProcessor:
@@ -10,15 +176,19 @@ class WildberriesSupplyDataProcessor:
     def __init__(self):
         ...
 
-    async def coef_list2pdDF(coefs: list) -> pd.DataFrame:
+    @staticmethod
+    def coef_list2pdDF(coefs: list) -> pd.DataFrame:
+        import pandas as pd
+
         df = pd.DataFrame(coefs)
-        
+
         df["date"] = pd.to_datetime(df["date"])
 
         return df
 
-    async def apply_filters(self,
-        df: pd,DataFrame,
+    @staticmethod
+    def apply_filters(
+        df: pd.DataFrame,
         dates: list[datetime.datetime] | TimePeriod | None,
         warehouse_names: list[str] | None,
         box_type_names: list[DeliveryType] | None,
@@ -29,18 +199,18 @@ class WildberriesSupplyDataProcessor:
             if isinstance(dates, list):
                 df = df[df['date'].isin(dates)]
             else:
-                df = df[(df['date'] >= dates[0]) & (df['date'] <= dates[-1])]
+                df = df[(df['date'] >= dates.start_date) & (df['date'] <= dates.end_date)]
 
         if warehouse_names is not None:
-            df = df[df['warehouse_name'].isin(warehouse_names)]
-        
+            df = df[df['warehouseName'].isin(warehouse_names)]
+
         if box_type_names is not None:
-            df = df[df['box_type'].isin([bt.value for bt in box_type_names])]
-        
+            df = df[df['boxTypeName'].isin([bt.value for bt in box_type_names])]
+
         if coefficient_less is not None:
             df = df[df['coefficient'] < coefficient_less]
-        
+
         if remove_unavailable is True:
-            df = df[df["coefficient"] != -1]  
+            df = df[df["coefficient"] != -1]
 
         return df
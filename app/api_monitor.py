@@ -1,21 +1,32 @@
 import os
+import time
 import asyncio
+import datetime
 import aiohttp
 import logging
 
 from dotenv import load_dotenv
 
-from aiolimiter import AsyncLimiter
 from app.db.db import (
     WildberriesCacheManager,
     TrackedWarehouseManager,
     BoxTypeManager,
     DateManager,
 )
-from app.config import Config
+from app.broker import Broker, TOPIC_SNAPSHOTS
+from app.cluster import LeaderElection
+from app.api_data_processor import decode_snapshot, summarize_snapshot
+from app.catalog import Catalog
+from app.recording import SnapshotRecorder
+from app.config import Config, configure_logging
+from app.lifecycle import cancel_tasks
+from app import metrics
+from app.profiling import profiled
+from app.scheduler import FIXED_DELAY, Job, Scheduler, parse_windows
+from app.wb_api import ENDPOINT_COEFFICIENTS, ENDPOINT_TARIFFS, Endpoint, WildberriesAPIClient
+from app.workers import pool
 
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class WildberriesSupplyAPIMonitor:
@@ -25,82 +36,156 @@ class WildberriesSupplyAPIMonitor:
         api_url: str,
         db_path: str,
         requests_per_minute: int = 6,
+        broker: Broker | None = None,
+        leader: LeaderElection | None = None,
+        catalog: Catalog | None = None,
+        recorder: SnapshotRecorder | None = None,
+        api: WildberriesAPIClient | None = None,
     ):
         self.token = token
         self.api_url = api_url
         self.requests_per_minute = requests_per_minute
-        self.rate_limiter = AsyncLimiter(requests_per_minute, 60)
+        self.api = api or WildberriesAPIClient(token, {ENDPOINT_COEFFICIENTS: Endpoint(api_url, requests_per_minute)})
 
         self.cache_manager = WildberriesCacheManager(db_path)
         self.tracked_warehouse_manager = TrackedWarehouseManager(db_path)
         self.box_type_manager = BoxTypeManager(db_path)
         self.date_manager = DateManager(db_path)
 
+        self.broker = broker
+        self.leader = leader
+        self.catalog = catalog
+        self.recorder = recorder
+
         self.cache_refresh_interval = 60 // requests_per_minute  # Calculate refresh interval in seconds
+        self.poll_windows = parse_windows(Config.poll_windows)
+        self.scheduler = Scheduler("monitor")
         self.is_running = False
+        self._stopping = asyncio.Event()
 
     async def initialize(self):
         await self.cache_manager.initialize()
+        if self.broker is not None:
+            self.cache_manager.memory.attach(self.broker)
         await self.tracked_warehouse_manager.initialize()
         await self.box_type_manager.initialize()
         await self.date_manager.initialize()
-
-    async def make_request(self) -> list:
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json"
-        }
-        
-        async with self.rate_limiter:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.api_url, headers=headers) as response:
-                    response.raise_for_status()
-                    return await response.json()
+        if self.catalog is not None:
+            await self.catalog.initialize()
+
+    async def make_request(self) -> bytes:
+        response = await self.api.coefficients()
+        if self.recorder is not None:
+            self.recorder.record(time.time(), response.status, response.body if response.status < 400 else None)
+        response.raise_for_status()
+        return response.body
+
+    @profiled("monitor.refresh_supply_data")
+    async def refresh_supply_data(self) -> int:
+        """Fetches a fresh snapshot and caches the response body as is, returns its row count"""
+        body = await self.make_request()
+        # Decoding a multi-megabyte body would block the loop, validate it in the worker pool
+        codec = self.cache_manager.codec('supply_data')
+        with metrics.WB_API_PARSE_SECONDS.time(endpoint="coefficients"):
+            # compressing the body for the cache is CPU-bound too, it runs next to the validation
+            (rows, warehouses, box_types), encoded = await asyncio.gather(
+                pool.run(summarize_snapshot, body),
+                pool.run(codec.encode_json, body),
+            )
+        metrics.SNAPSHOT_ROWS.set(rows)
+        fetched_at = time.time()
+        # drop rules compare against the snapshot before
+        await self.cache_manager.copy('supply_data', 'supply_data_previous')
+        await self.cache_manager.set_encoded('supply_data', encoded)
+        await self.cache_manager.set('supply_data_fetched_at', fetched_at)
+        if self.catalog is not None:
+            await self.catalog.merge_snapshot(warehouses, box_types)
+        if self.broker is not None:
+            await self.broker.publish(TOPIC_SNAPSHOTS, {"fetched_at": fetched_at, "rows": rows})
+        return rows
+
+    async def refresh_tariffs(self) -> None:
+        """Caches box tariffs of the tracked dates by date and warehouse name, alerts show them"""
+        today = datetime.date.today()
+        dates = sorted({
+            date for date in (datetime.date.fromisoformat(tracked[:10]) for tracked in await self.date_manager.get_all())
+            if date >= today
+        }) or [today]
+        # one request per date, they share the tariffs quota and not the one of the poll
+        tariffs = await self.api.gather(*(self.api.box_tariffs(date) for date in dates))
+        await self.cache_manager.set('box_tariffs', {
+            date.isoformat(): {tariff.warehouse_name: tariff.model_dump() for tariff in date_tariffs}
+            for date, date_tariffs in zip(dates, tariffs)
+        })
+        logger.info(f"Box tariffs of {len(dates)} dates refreshed")
 
     async def get_supply_data(self) -> list:
-        cached_data = await self.cache_manager.get('supply_data')
-        if cached_data is not None:
-            return cached_data
-        
-        try:
-            fresh_data = await self.make_request()
-            await self.cache_manager.set('supply_data', fresh_data)
-            return fresh_data
-        except aiohttp.ClientError as e:
-            logger.error(f"An error occurred while fetching supply data: {e}")
-            return []
-
-    async def start_cache_refresh(self):
-        while self.is_running:
+        cached_data = await self.cache_manager.get_raw('supply_data')
+        if cached_data is None:
             try:
-                await self.get_supply_data()
-                logger.info("Cache refreshed successfully")
-            except Exception as e:
-                logger.error(f"Error refreshing cache: {e}")
-            await asyncio.sleep(self.cache_refresh_interval)
+                await self.refresh_supply_data()
+            except aiohttp.ClientError as e:
+                logger.error(f"An error occurred while fetching supply data: {e}")
+                return []
+            cached_data = await self.cache_manager.get_raw('supply_data')
+
+        return await pool.run(decode_snapshot, cached_data)
+
+    async def poll(self) -> None:
+        await self.refresh_supply_data()
+        logger.info("Cache refreshed successfully")
+
+    def schedule_jobs(self) -> None:
+        # only the leader polls, a new leader polls as soon as it took the lease
+        gate = self.leader.wait_until_leader if self.leader is not None else None
+        self.scheduler.add(Job(
+            "poll", self.poll, self.cache_refresh_interval, windows=self.poll_windows, gate=gate,
+        ))
+        if self.catalog is not None and self.catalog.api is not None:
+            self.scheduler.add(Job(
+                "catalog", self.catalog.refresh, self.catalog.refresh_interval,
+                mode=FIXED_DELAY, jitter=self.catalog.refresh_interval / 10, gate=gate,
+            ))
+        if self.api.has(ENDPOINT_TARIFFS) and Config.tariffs_refresh_interval > 0:
+            self.scheduler.add(Job(
+                "tariffs", self.refresh_tariffs, Config.tariffs_refresh_interval,
+                mode=FIXED_DELAY, jitter=Config.tariffs_refresh_interval / 10, gate=gate,
+            ))
+        if self.broker is not None and self.broker.compaction_interval:
+            self.scheduler.add(Job(
+                "compaction", self.broker.compact, self.broker.compaction_interval,
+                mode=FIXED_DELAY, gate=gate,
+            ))
 
     async def run(self):
         logger.info("Starting WildberriesSupplyAPIMonitor")
         await self.initialize()
         self.is_running = True
-        refresh_task = asyncio.create_task(self.start_cache_refresh())
+        self.schedule_jobs()
+        scheduler_task = asyncio.create_task(self.scheduler.run())
+        leader_task = asyncio.create_task(self.leader.run()) if self.leader is not None else None
         try:
             # Keep the monitor running until stopped
-            while self.is_running:
-                await asyncio.sleep(1)
+            await self._stopping.wait()
         except asyncio.CancelledError:
-            logger.info("WildberriesSupplyAPIMonitor stopping...")
+            logger.info("WildberriesSupplyAPIMonitor cancelled")
         finally:
-            self.is_running = False
-            refresh_task.cancel()
-            try:
-                await refresh_task
-            except asyncio.CancelledError:
-                pass
+            logger.info("WildberriesSupplyAPIMonitor stopping...")
+            self.stop()
+            # a poll in flight still gets its snapshot cached and published
+            await scheduler_task
+            # the lease is released once the loops are done, not while the last poll is still writing
+            await cancel_tasks(leader_task)
+            await self.api.close()
+            if self.recorder is not None:
+                await self.recorder.close()
             logger.info("WildberriesSupplyAPIMonitor stopped")
 
     def stop(self):
+        """Stops polling, the poll in flight is finished first"""
         self.is_running = False
+        self._stopping.set()
+        self.scheduler.stop()
 
 async def main():
     load_dotenv()
@@ -117,4 +202,5 @@ async def main():
         monitor.stop()
 
 if __name__ == "__main__":
+    configure_logging()
     asyncio.run(main())
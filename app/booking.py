@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from dataclasses import dataclass
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+
+from app.db.db import BookingManager
+from app import metrics
+
+
+logger = logging.getLogger(__name__)
+
+BOOKING_OFF = "off"
+BOOKING_DRY_RUN = "dry_run"
+BOOKING_HTTP = "http"
+
+STATUS_PENDING = "pending"
+STATUS_BOOKED = "booked"
+STATUS_DRY_RUN = "dry_run"
+STATUS_REJECTED = "rejected"
+STATUS_FAILED = "failed"
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+@dataclass(frozen=True)
+class BookingRequest:
+    warehouse_id: int
+    warehouse_name: str
+    box_type: str
+    date: str
+    coefficient: int
+    rule_id: int | None = None
+
+    @property
+    def idempotency_key(self) -> str:
+        """Same for every attempt at the same slot, so the slot is booked at most once"""
+        slot = f"{self.warehouse_id}|{self.box_type}|{self.date}"
+        return hashlib.sha256(slot.encode()).hexdigest()[:32]
+
+    @classmethod
+    def from_match(cls, match: dict) -> "BookingRequest":
+        return cls(
+            warehouse_id=match["warehouseID"],
+            warehouse_name=match["warehouseName"],
+            box_type=match["boxTypeName"],
+            date=match["date"],
+            coefficient=match["coefficient"],
+            rule_id=match.get("rule_id"),
+        )
+
+
+@dataclass(frozen=True)
+class BookingResult:
+    request: BookingRequest
+    status: str
+    booking_id: str | None = None
+    detail: str | None = None
+
+
+class BookingClient:
+    """Books a supply slot, implementations must pass the idempotency key on to the booking API"""
+
+    # part of the claim key, slots claimed by a dry run are still booked once BOOKING_CLIENT=http
+    kind: str
+
+    async def book(self, request: BookingRequest) -> BookingResult:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        ...
+
+
+class DryRunBookingClient(BookingClient):
+    kind = BOOKING_DRY_RUN
+
+    async def book(self, request: BookingRequest) -> BookingResult:
+        logger.info(f"Dry run, would book {request.warehouse_name} {request.box_type} {request.date[:10]}")
+        return BookingResult(request, STATUS_DRY_RUN)
+
+
+class HTTPBookingClient(BookingClient):
+    """POSTs the slot as JSON with an Idempotency-Key header.
+
+    2xx with {"bookingID": ...} means booked, 409 and 422 that the slot is
+    gone or cannot be booked; anything else is a failure worth retrying.
+    """
+
+    kind = BOOKING_HTTP
+
+    def __init__(self, api_url: str, token: str | None, requests_per_minute: int = 10, timeout: float = 5):
+        self.api_url = api_url
+        self.token = token
+        self.rate_limiter = AsyncLimiter(requests_per_minute, 60)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def book(self, request: BookingRequest) -> BookingResult:
+        if self._session is None:
+            # kept open, a fresh connection would add a TLS handshake to every booking
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        headers = {
+            "Authorization": f"Bearer {self.token}",
+            IDEMPOTENCY_HEADER: request.idempotency_key,
+        }
+        payload = {
+            "warehouseID": request.warehouse_id,
+            "boxTypeName": request.box_type,
+            "date": request.date,
+            "coefficient": request.coefficient,
+        }
+        async with self.rate_limiter:
+            async with self._session.post(self.api_url, json=payload, headers=headers) as response:
+                if response.status in (409, 422):
+                    return BookingResult(request, STATUS_REJECTED, detail=await response.text())
+                response.raise_for_status()
+                body = await response.json()
+        return BookingResult(request, STATUS_BOOKED, booking_id=str(body.get("bookingID")))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+def create_booking_client(kind: str, api_url: str | None = None, token: str | None = None, requests_per_minute: int = 10) -> BookingClient | None:
+    if kind == BOOKING_OFF:
+        return None
+    if kind == BOOKING_DRY_RUN:
+        return DryRunBookingClient()
+    if kind == BOOKING_HTTP:
+        if not api_url:
+            raise ValueError("BOOKING_API_URL is required with BOOKING_CLIENT=http")
+        return HTTPBookingClient(api_url, token, requests_per_minute)
+    raise ValueError(f"Unknown booking client '{kind}'")
+
+
+class BookingPipeline:
+    """Books the matched slots of rules that ask for it.
+
+    Each slot is claimed under the client kind and its idempotency key in the
+    database first, so several bot workers evaluating the same snapshot book
+    it once. Failed and cancelled attempts are released and retried with the
+    next snapshot, booked and dry-run slots are not tried again. A rejected
+    slot may reopen, it is tried again after rejected_ttl seconds; a pending
+    claim left by a crashed worker is taken over after pending_ttl seconds.
+    """
+
+    def __init__(
+        self,
+        client: BookingClient,
+        booking_manager: BookingManager,
+        pending_ttl: float = 300,
+        rejected_ttl: float = 3600,
+    ):
+        self.client = client
+        self.booking_manager = booking_manager
+        self.pending_ttl = pending_ttl
+        self.rejected_ttl = rejected_ttl
+
+    @classmethod
+    def from_env(cls, booking_manager: BookingManager) -> "BookingPipeline | None":
+        """None unless BOOKING_CLIENT is dry_run or http"""
+        client = create_booking_client(
+            os.getenv("BOOKING_CLIENT", BOOKING_OFF),
+            api_url=os.getenv("BOOKING_API_URL"),
+            token=os.getenv("BOOKING_API_TOKEN") or os.getenv("WB_SUPPLY_API_TOKEN"),
+            requests_per_minute=int(os.getenv("BOOKING_REQUESTS_PER_MINUTE", 10)),
+        )
+        if client is None:
+            return None
+        return cls(
+            client,
+            booking_manager,
+            pending_ttl=float(os.getenv("BOOKING_PENDING_TTL", 300)),
+            rejected_ttl=float(os.getenv("BOOKING_REJECTED_TTL", 3600)),
+        )
+
+    async def initialize(self) -> None:
+        await self.booking_manager.initialize()
+
+    async def _attempt(self, request: BookingRequest) -> BookingResult | None:
+        key = f"{self.client.kind}:{request.idempotency_key}"
+        expired = {STATUS_PENDING: self.pending_ttl, STATUS_REJECTED: self.rejected_ttl}
+        if not await self.booking_manager.claim(
+            key, request.warehouse_id, request.box_type, request.date, request.coefficient, expired,
+        ):
+            return None
+
+        try:
+            with metrics.BOOKING_REQUEST_SECONDS.time():
+                result = await self.client.book(request)
+        except Exception as e:
+            logger.error(f"Booking {request.warehouse_name} {request.box_type} {request.date[:10]} failed: {e}")
+            metrics.BOOKING_ATTEMPTS.inc(status=STATUS_FAILED)
+            await self.booking_manager.release(key)
+            return BookingResult(request, STATUS_FAILED, detail=str(e))
+        except BaseException:
+            # cancelled, e.g. on shutdown, the slot is tried again with the next snapshot
+            await asyncio.shield(self.booking_manager.release(key))
+            raise
+
+        metrics.BOOKING_ATTEMPTS.inc(status=result.status)
+        await self.booking_manager.finish(key, result.status, result.booking_id, result.detail)
+        logger.info(f"Booking {request.warehouse_name} {request.box_type} {request.date[:10]}: {result.status}")
+        return result
+
+    async def handle(self, matches: list[dict], fetched_at: float | None = None) -> list[BookingResult]:
+        """Attempts every match of a booking rule, returns results of the attempts made now"""
+        requests = [BookingRequest.from_match(match) for match in matches if match.get("book")]
+        if not requests:
+            return []
+        if fetched_at is not None:
+            metrics.BOOKING_LATENCY_SECONDS.observe(time.time() - fetched_at)
+
+        results = await asyncio.gather(*(self._attempt(request) for request in requests))
+        return [result for result in results if result is not None]
+
+    async def close(self) -> None:
+        await self.client.close()
@@ -1,8 +1,13 @@
 import os
+import dataclasses
+import time
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.types import Update
 from dotenv import load_dotenv
 
 from app.db.db import (
@@ -10,30 +15,145 @@ from app.db.db import (
     TrackedWarehouseManager,
     BoxTypeManager,
     DateManager,
+    LeaseManager,
+    CatalogManager,
+    RuleManager,
 )
+from app.db import codecs
+from app.booking import STATUS_BOOKED, STATUS_DRY_RUN, BookingPipeline
+from app.broker import Broker, TOPIC_CATALOG, TOPIC_SNAPSHOTS, TOPIC_UPDATES
+from app.catalog import Catalog
+from app.cluster import LEASE_TELEGRAM_UPDATES, LeaderElection, owns_shard, update_chat_id
 from app.handlers.base import router as base_router
 from app.handlers.supply import router as supply_router
-from app.config import Config
-from app.dto import WarehouseShort
+from app.handlers.rules import router as rules_router
+from app.keyboards.editor import KeyboardEditor
+from app.config import Config, configure_logging
+from app.dto import DeliveryType
+from app.lifecycle import cancel_tasks, drain
+from app.middlewares.antiflood import AntiFloodMiddleware
+from app.middlewares.metrics import HandlerMetricsMiddleware
+from app.middlewares.profiling import ProfilingMiddleware
+from app.profiling import profiled
+from app.rules import RulesEngine
+from app.scheduler import FIXED_DELAY, Job, Scheduler
+from app.snapshots import SupplySnapshot
+from app.utils.ordering import KeyedSerialExecutor
+from app.webhook import WebhookServer, WebhookSettings
+from app import metrics
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_KEY = "notification_checkpoint"
+# offset after the last update the updates leader published
+UPDATES_OFFSET_KEY = "telegram_updates_offset"
+
+
+def format_slot(match: dict, tariffs: dict) -> str:
+    """Alert line of a matched slot, with the box delivery tariff of its warehouse and date if known"""
+    line = f"{match['warehouseName']} {match['boxTypeName']} {match['coefficient']} {match['date'][:10]}"
+    if match["boxTypeName"] == DeliveryType.MONOPALLETS.value:
+        return line
+    tariff = tariffs.get(match["date"][:10], {}).get(match["warehouseName"])
+    if tariff is None or tariff["delivery_base"] is None:
+        return line
+    liter = f" + {tariff['delivery_liter']:g} ₽/л" if tariff["delivery_liter"] is not None else ""
+    return f"{line} · {tariff['delivery_base']:g} ₽{liter}"
+
+
+def slot_key(match: dict) -> tuple:
+    return match["warehouseID"], match["boxTypeName"], match["date"]
+
+
 class TelegramBot:
-    def __init__(self, token: str, db_path: str, chat_ids: list[int]):
-        self.bot = Bot(token=token)
+    def __init__(
+        self,
+        token: str,
+        db_path: str,
+        chat_ids: list[int],
+        broker: Broker | None = None,
+        workers: int = 1,
+        worker_index: int = 0,
+        webhook_settings: WebhookSettings | None = None,
+        booking_pipeline: BookingPipeline | None = None,
+        api_url: str = Config.telegram_api_url,
+    ):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+        self.bot = Bot(token=token, session=session)
         self.dp = Dispatcher()
 
         self.cache_manager = WildberriesCacheManager(db_path)
         self.tracked_warehouse_manager = TrackedWarehouseManager(db_path)
         self.box_type_manager = BoxTypeManager(db_path)
         self.date_manager = DateManager(db_path)
+        self.supply_snapshot = SupplySnapshot(self.cache_manager)
+        # filled by the monitor, the bot only reads it
+        self.catalog = Catalog(CatalogManager(db_path))
+        self.rule_manager = RuleManager(db_path)
+        self.rules_engine = RulesEngine(
+            self.rule_manager,
+            self.cache_manager,
+            self.tracked_warehouse_manager,
+            self.box_type_manager,
+            self.date_manager,
+            self.supply_snapshot,
+        )
+        self.booking_pipeline = booking_pipeline
+        self.keyboard_editor = KeyboardEditor(debounce=Config.keyboard_edit_debounce)
 
-        self.chat_ids = chat_ids
+        self.broker = broker
+        self.workers = workers
+        self.worker_index = worker_index
+        # the worker that books reports to every chat, only one worker wins a slot
+        self.receiver_ids = list(chat_ids)
+        # every worker notifies its own share of chats
+        self.chat_ids = [
+            chat_id for chat_id in chat_ids
+            if owns_shard(chat_id, workers, worker_index)
+        ]
+        self.alerted_slots: set[tuple] = set()
+        # fetched_at of the last snapshot notified about, restored from the checkpoint on start
+        self.last_notified: float | None = None
+        # set by a restored checkpoint, the first round then leaves out slots alerted before the restart
+        self.resumed = False
+        self._notification_round: asyncio.Future | None = None
+        self._stopping = asyncio.Event()
+        self.scheduler = Scheduler("bot")
+
+        self.webhook_settings = webhook_settings
+        self.update_executor = KeyedSerialExecutor(
+            workers=webhook_settings.workers if webhook_settings is not None else 16
+        )
+
+        self.updates_leader: LeaderElection | None = None
+        if workers > 1 and webhook_settings is None:
+            self.updates_leader = LeaderElection(LeaseManager(db_path), LEASE_TELEGRAM_UPDATES)
 
     def setup_routers(self):
+        # handlers receive these as keyword arguments instead of building their own at import time
+        self.dp.workflow_data.update(
+            cache_manager=self.cache_manager,
+            tracked_warehouse_manager=self.tracked_warehouse_manager,
+            box_type_manager=self.box_type_manager,
+            date_manager=self.date_manager,
+            supply_snapshot=self.supply_snapshot,
+            catalog=self.catalog,
+            rule_manager=self.rule_manager,
+            keyboard_editor=self.keyboard_editor,
+        )
+        # outer: dropped updates never reach filters or handlers
+        antiflood = AntiFloodMiddleware(
+            rate=Config.antiflood_rate,
+            burst=Config.antiflood_burst,
+            duplicate_window=Config.callback_duplicate_window,
+        )
+        for observer in (self.dp.message, self.dp.callback_query):
+            observer.outer_middleware(antiflood)
+        for observer in (self.dp.message, self.dp.callback_query, self.dp.inline_query):
+            observer.middleware(HandlerMetricsMiddleware())
+            observer.middleware(ProfilingMiddleware())
         self.dp.include_router(base_router)
+        self.dp.include_router(rules_router)
         self.dp.include_router(supply_router)
         logger.debug("Routers have been set up")
 
@@ -42,58 +162,285 @@ class TelegramBot:
         data = await self.cache_manager.get('supply_data')
         return data if data else {}
 
+    @profiled("bot.send_notifications")
     async def send_notifications(self) -> None:
-        supply_data = await self.get_supply_data()
-        warehouses_to_track: list[WarehouseShort] = await self.tracked_warehouse_manager.get_all()
-        box_types_to_track = await self.box_type_manager.get_all()
-        dates_to_track = await self.date_manager.get_all()
-        maximum_coefficient = await self.cache_manager.get("coefficient")
-        if supply_data:
-            notification = [
-                f"{wh["warehouseName"]} {wh["boxTypeName"]} {wh["coefficient"]} {wh["date"][:10]}"
-                for wh in supply_data
-                if (
-                    WarehouseShort(
-                        id=wh["warehouseID"], name=wh["warehouseName"]
-                    ) in warehouses_to_track
-                    and wh["boxTypeName"] in box_types_to_track
-                    and wh["date"] in dates_to_track
-                    and int(wh["coefficient"]) != -1
-                    and int(wh["coefficient"]) < maximum_coefficient
-                )
-            ]
-            notification = "\n".join(notification)
-
-            for chat_id in self.chat_ids:
-                try:
-                    await self.bot.send_message(chat_id, notification, parse_mode=ParseMode.HTML)
-                    logger.info(f"Notification sent to chat {chat_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send notification to chat {chat_id}: {e}")
+        matches = await self.rules_engine.matches()
+        resumed, self.resumed = self.resumed, False
+        if not matches:
+            logger.info("No matching supply data available")
+            return
+
+        # slots are gone within seconds, booking must not wait for the fan-out below
+        booking = asyncio.create_task(self.book(matches)) if self.booking_pipeline is not None else None
+
+        # the first round after a restart leaves out what was alerted before it
+        alerts = [wh for wh in matches if slot_key(wh) not in self.alerted_slots] if resumed else matches
+        if alerts:
+            # cached by the monitor ahead of time, alerts do not wait for the tariffs endpoint
+            tariffs = await self.cache_manager.get('box_tariffs') or {}
+            notification = "\n".join(format_slot(wh, tariffs) for wh in alerts)
+
+            delivered = False
+            with metrics.NOTIFICATION_FANOUT_SECONDS.time():
+                for chat_id in self.chat_ids:
+                    try:
+                        await self.bot.send_message(chat_id, notification, parse_mode=ParseMode.HTML)
+                        metrics.TELEGRAM_MESSAGES_SENT.inc()
+                        delivered = True
+                        logger.info(f"Notification sent to chat {chat_id}")
+                    except Exception as e:
+                        metrics.TELEGRAM_SEND_FAILURES.inc()
+                        logger.error(f"Failed to send notification to chat {chat_id}: {e}")
+
+            if delivered:
+                await self.observe_alert_latency(matches)
         else:
-            logger.info("No new supply data available")
+            logger.info("Matching slots were all alerted before the restart")
+            self.alerted_slots = {slot_key(wh) for wh in matches}
+
+        if booking is not None:
+            await booking
+
+    async def book(self, matches: list[dict]) -> None:
+        fetched_at = await self.cache_manager.get("supply_data_fetched_at")
+        results = await self.booking_pipeline.handle(matches, fetched_at)
+        reported = [result for result in results if result.status in (STATUS_BOOKED, STATUS_DRY_RUN)]
+        if not reported:
+            return
+
+        report = "\n".join(
+            f"{'Booked' if result.status == STATUS_BOOKED else 'Would book (dry run)'}: "
+            f"{result.request.warehouse_name} {result.request.box_type} {result.request.coefficient} {result.request.date[:10]}"
+            + (f" #{result.booking_id}" if result.booking_id else "")
+            for result in reported
+        )
+        for chat_id in self.receiver_ids:
+            try:
+                await self.bot.send_message(chat_id, report)
+            except Exception as e:
+                logger.error(f"Failed to send booking report to chat {chat_id}: {e}")
+
+    async def observe_alert_latency(self, matches: list[dict]) -> None:
+        """Slot open time is approximated by the fetch time of the first snapshot the slot matched in"""
+        fetched_at = await self.cache_manager.get("supply_data_fetched_at")
+        matched_slots = {slot_key(wh) for wh in matches}
+        if fetched_at is not None:
+            now = time.time()
+            for _ in matched_slots - self.alerted_slots:
+                metrics.SLOT_ALERT_LATENCY_SECONDS.observe(now - fetched_at)
+        self.alerted_slots = matched_slots
+
+    async def notify_snapshot(self) -> None:
+        """Notifies about the current snapshot unless that happened already, e.g. before a restart"""
+        version = await self.supply_snapshot.version()
+        if version is not None and version == self.last_notified:
+            logger.debug(f"Snapshot {version} was notified about already")
+            return
+        await self.send_notifications()
+        self.last_notified = version
+
+    async def notification_round(self) -> None:
+        # shielded: stopping the listeners must not cut a fan-out short, drain waits for it instead
+        self._notification_round = asyncio.ensure_future(self.notify_snapshot())
+        await asyncio.shield(self._notification_round)
+
+    async def periodic_notification(self) -> None:
+        logger.debug("Running periodic notification check")
+        # without a broker there are no catalog events, pick up changes here
+        await self.catalog.load()
+        await self.notification_round()
+
+    async def listen_snapshots(self) -> None:
+        """Notifies as soon as the monitor publishes a new snapshot"""
+        async for event in self.broker.subscribe(TOPIC_SNAPSHOTS):
+            logger.debug(f"Snapshot {event['fetched_at']} with {event['rows']} rows received")
+            try:
+                await self.notification_round()
+            except Exception as e:
+                logger.error(f"Failed to send notifications: {e}")
 
-    async def schedule_notification(self) -> None:
+    async def listen_catalog(self) -> None:
+        async for _ in self.broker.subscribe(TOPIC_CATALOG):
+            try:
+                await self.catalog.load()
+            except Exception as e:
+                logger.error(f"Failed to reload the catalog: {e}")
+
+    async def relay_updates(self) -> None:
+        """While holding the updates lease, long polls Telegram and publishes updates to all workers.
+
+        Telegram confirms updates only with the offset of the next call, so the
+        offset is stored after every published update and a new leader resumes
+        from it instead of publishing the last batch of the previous one again.
+        """
+        offset = None
+        leading = False
+        allowed_updates = self.dp.resolve_used_update_types()
         while True:
-            logger.debug("Running periodic notification check")
-            await self.send_notifications()
-            await asyncio.sleep(60 // 6)
+            if not self.updates_leader.is_leader:
+                leading = False
+            await self.updates_leader.wait_until_leader()
+            try:
+                if not leading:
+                    # a webhook left by a run in webhook mode makes getUpdates fail with 409 Conflict
+                    await self.bot.delete_webhook(drop_pending_updates=False)
+                    offset = await self.stored_updates_offset() or offset
+                    leading = True
+                updates = await self.bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Failed to fetch updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.broker.publish(TOPIC_UPDATES, update.model_dump(mode="json", exclude_unset=True))
+                offset = update.update_id + 1
+                await self.cache_manager.set(UPDATES_OFFSET_KEY, offset)
 
-    async def run(self):
-        logger.info("Initializing cache manager")
+    async def stored_updates_offset(self) -> int | None:
+        # read past the in-process cache, the previous leader was another process
+        raw = await self.cache_manager.get_raw(UPDATES_OFFSET_KEY)
+        return codecs.decode(raw) if raw is not None else None
+
+    async def dispatch_update(self, update: Update) -> bool:
+        """Handles updates of different chats concurrently and of one chat in order"""
+        key = update_chat_id(update) or update.update_id
+        return self.update_executor.submit(key, lambda: self.dp.feed_update(self.bot, update))
+
+    async def publish_update(self, update: Update) -> bool:
+        await self.broker.publish(TOPIC_UPDATES, update.model_dump(mode="json", exclude_unset=True))
+        return True
+
+    async def consume_updates(self) -> None:
+        async for raw_update in self.broker.subscribe(TOPIC_UPDATES):
+            update = Update.model_validate(raw_update, context={"bot": self.bot})
+            chat_id = update_chat_id(update)
+            if chat_id is not None and not owns_shard(chat_id, self.workers, self.worker_index):
+                continue
+            if chat_id is None and self.worker_index != 0:
+                continue
+            if not await self.dispatch_update(update):
+                logger.warning(f"Dropped update {update.update_id}, too many pending updates for chat {chat_id}")
+
+    async def receive_webhooks(self) -> None:
+        # with several workers whichever receives an update relays it to the worker owning the chat
+        on_update = self.dispatch_update if self.workers == 1 else self.publish_update
+        # workers may share a host, each listens on a port of its own behind the proxy
+        settings = dataclasses.replace(self.webhook_settings, port=self.webhook_settings.port + self.worker_index)
+        server = WebhookServer(self.bot, self.dp, settings, on_update)
+        if self.worker_index == 0:
+            await server.register()
+
+        receivers = [server.serve()]
+        if self.workers > 1:
+            receivers.append(self.consume_updates())
+        await asyncio.gather(*receivers)
+
+    async def initialize(self):
+        logger.info("Initializing database managers")
         await self.cache_manager.initialize()
+        await self.tracked_warehouse_manager.initialize()
+        await self.box_type_manager.initialize()
+        await self.date_manager.initialize()
+        await self.rule_manager.initialize()
+        await self.catalog.initialize()
+        if self.booking_pipeline is not None:
+            await self.booking_pipeline.initialize()
+        await self.restore_checkpoint()
+
+    @property
+    def checkpoint_key(self) -> str:
+        # workers notify different chats, each keeps its own
+        return f"{CHECKPOINT_KEY}_{self.worker_index}"
+
+    async def checkpoint(self) -> None:
+        """Saves the last notified snapshot and the alerted slots it is compared against"""
+        await self.cache_manager.set(self.checkpoint_key, {
+            "fetched_at": self.last_notified,
+            "alerted_slots": sorted(self.alerted_slots),
+        })
+
+    async def restore_checkpoint(self) -> None:
+        checkpoint = await self.cache_manager.get(self.checkpoint_key)
+        if checkpoint is None:
+            return
+        self.last_notified = checkpoint["fetched_at"]
+        self.alerted_slots = {tuple(slot) for slot in checkpoint["alerted_slots"]}
+        self.resumed = True
+        logger.info(f"Resuming after snapshot {self.last_notified}, {len(self.alerted_slots)} slots alerted")
+
+    async def receive_updates(self) -> None:
+        if self.webhook_settings is not None:
+            await self.receive_webhooks()
+        elif self.workers == 1:
+            logger.info("Starting bot polling")
+            # a webhook left by a run in webhook mode makes getUpdates fail with 409 Conflict
+            await self.bot.delete_webhook(drop_pending_updates=False)
+            # signals are handled by Service, the session is closed after draining
+            await self.dp.start_polling(self.bot, handle_signals=False, close_bot_session=False)
+        else:
+            logger.info(f"Starting bot worker {self.worker_index + 1} of {self.workers}")
+            await asyncio.gather(
+                self.updates_leader.run(),
+                self.relay_updates(),
+                self.consume_updates(),
+            )
+
+    async def shutdown(self, timeout: float) -> None:
+        """Finishes accepted updates and the notification round in flight, then checkpoints"""
+        await self.update_executor.join(timeout)
+        # polling runs handlers as tasks of the dispatcher, the update executor does not see them;
+        # a private attribute, aiogram releases without it have nothing to drain here
+        await drain(list(getattr(self.dp, "_handle_update_tasks", ())), timeout, "Update handlers")
+        await self.keyboard_editor.close()
+        if self._notification_round is not None:
+            await drain([self._notification_round], timeout, "Notification round")
+        await self.checkpoint()
+
+    async def run(self):
+        await self.initialize()
         logger.info("Setting up routers")
         self.setup_routers()
-        
-        logger.info("Starting periodic notification task")
-        notification_task = asyncio.create_task(self.schedule_notification())
 
-        logger.info("Starting bot polling")
+        background_tasks = []
+        if self.broker is not None:
+            logger.info("Listening for new snapshots")
+            background_tasks.append(asyncio.create_task(self.listen_snapshots()))
+            background_tasks.append(asyncio.create_task(self.listen_catalog()))
+            # other bot workers write cache keys this one has in memory
+            self.cache_manager.memory.attach(self.broker)
+            background_tasks.append(asyncio.create_task(self.cache_manager.memory.listen()))
+        else:
+            logger.info("Starting periodic notification task")
+            self.scheduler.add(Job("notifications", self.periodic_notification, 60 // 6, mode=FIXED_DELAY))
+            background_tasks.append(asyncio.create_task(self.scheduler.run()))
+
+        receiver = asyncio.create_task(self.receive_updates())
+        stopping = asyncio.create_task(self._stopping.wait())
         try:
-            await self.dp.start_polling(self.bot)
+            await asyncio.wait({receiver, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                # receiving ended on its own, i.e. failed
+                receiver.result()
         finally:
-            notification_task.cancel()
-            await notification_task
+            logger.info("Bot stopping...")
+            if self.webhook_settings is None and self.workers == 1 and not receiver.done():
+                # cancelling start_polling leaves its polling task running, it has to be stopped
+                try:
+                    await self.dp.stop_polling()
+                except RuntimeError:
+                    # polling did not start yet, cancelling is enough
+                    pass
+            # stop accepting updates and snapshots, then finish what was accepted
+            await cancel_tasks(*(task for task in (receiver, stopping, *background_tasks) if not task.done()))
+            await self.shutdown(Config.shutdown_timeout)
+            if self.booking_pipeline is not None:
+                await self.booking_pipeline.close()
+            await self.bot.session.close()
+            logger.info("Bot stopped")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self.scheduler.stop()
 
 async def main():
     logger.info("Starting Wildberries Notification Bot")
@@ -110,4 +457,5 @@ async def main():
     await bot.run()
 
 if __name__ == "__main__":
+    configure_logging()
     asyncio.run(main())
@@ -0,0 +1,35 @@
+from app.broker.base import Broker
+from app.broker.memory import InMemoryBroker
+from app.broker.sqlite import SQLiteBroker
+# defined next to the cache it invalidates, app.db cannot import app.broker
+from app.db.memory import TOPIC_CACHE
+
+
+BROKER_MEMORY = "memory"
+BROKER_SQLITE = "sqlite"
+
+TOPIC_SNAPSHOTS = "snapshots"
+TOPIC_UPDATES = "updates"
+TOPIC_CATALOG = "catalog"
+
+
+def create_broker(kind: str, db_path: str) -> Broker:
+    if kind == BROKER_MEMORY:
+        return InMemoryBroker()
+    if kind == BROKER_SQLITE:
+        return SQLiteBroker(db_path)
+    raise ValueError(f"Unknown broker '{kind}'")
+
+
+__all__ = [
+    "Broker",
+    "InMemoryBroker",
+    "SQLiteBroker",
+    "create_broker",
+    "BROKER_MEMORY",
+    "BROKER_SQLITE",
+    "TOPIC_SNAPSHOTS",
+    "TOPIC_UPDATES",
+    "TOPIC_CATALOG",
+    "TOPIC_CACHE",
+]
@@ -0,0 +1,24 @@
+from typing import AsyncIterator
+
+
+class Broker:
+    """Publish/subscribe of small JSON-serializable messages between service roles"""
+
+    async def initialize(self) -> None:
+        ...
+
+    async def publish(self, topic: str, message: dict) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, topic: str) -> AsyncIterator[dict]:
+        """Yields messages published to topic after the subscription started"""
+        raise NotImplementedError
+
+    # seconds between compact calls, None if there is no history to compact
+    compaction_interval: float | None = None
+
+    async def compact(self) -> None:
+        """Drops messages every subscriber has seen"""
+
+    async def close(self) -> None:
+        ...
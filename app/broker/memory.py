@@ -0,0 +1,29 @@
+import asyncio
+from collections import defaultdict
+from typing import AsyncIterator
+
+from app.broker.base import Broker
+
+
+class InMemoryBroker(Broker):
+    """Broker for roles running in one process"""
+
+    def __init__(self, max_queue_size: int = 1000):
+        self.max_queue_size = max_queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+
+    async def publish(self, topic: str, message: dict) -> None:
+        for queue in self._subscribers[topic]:
+            if queue.full():
+                # a slow subscriber loses its oldest message instead of blocking publishers
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def subscribe(self, topic: str) -> AsyncIterator[dict]:
+        queue = asyncio.Queue(self.max_queue_size)
+        self._subscribers[topic].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[topic].discard(queue)
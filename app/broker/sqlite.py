@@ -0,0 +1,58 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator
+
+from app.broker.base import Broker
+from app.db.db import DatabaseManager
+
+
+class SQLiteBroker(Broker, DatabaseManager):
+    """Broker for roles running in separate processes on the same SQLite file.
+
+    Messages are rows in broker_messages, subscribers poll for rows newer than
+    the last one they have seen.
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 0.2, retention: float = 600):
+        DatabaseManager.__init__(self, db_path)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.compaction_interval = retention / 10
+
+    async def initialize(self) -> None:
+        # WAL lets readers in other processes work while one of them writes
+        await self.execute('PRAGMA journal_mode=WAL')
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS broker_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        await self.execute('CREATE INDEX IF NOT EXISTS broker_messages_topic_id ON broker_messages (topic, id)')
+
+    async def publish(self, topic: str, message: dict) -> None:
+        await self.execute(
+            'INSERT INTO broker_messages (topic, payload, created_at) VALUES (?, ?, ?)',
+            (topic, json.dumps(message), time.time()),
+        )
+
+    async def compact(self) -> None:
+        """Drops messages older than retention, scheduled by the monitor leader"""
+        await self.execute('DELETE FROM broker_messages WHERE created_at < ?', (time.time() - self.retention,))
+
+    async def subscribe(self, topic: str) -> AsyncIterator[dict]:
+        row = await self.fetch_one('SELECT MAX(id) FROM broker_messages WHERE topic = ?', (topic,))
+        last_id = row[0] or 0
+        while True:
+            rows = await self.fetch_all(
+                'SELECT id, payload FROM broker_messages WHERE topic = ? AND id > ? ORDER BY id',
+                (topic, last_id),
+            )
+            for message_id, payload in rows:
+                last_id = message_id
+                yield json.loads(payload)
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
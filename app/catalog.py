@@ -0,0 +1,137 @@
+import logging
+import os
+
+from app.api_data_processor import warehouse_sort_key
+from app.broker import Broker, TOPIC_CATALOG
+from app.db.db import CatalogManager
+from app.dto import Warehouse, WarehouseShort
+from app.utils.search import WarehouseSearchIndex
+from app.wb_api import WildberriesAPIClient
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = 6 * 60 * 60
+
+SOURCE_WAREHOUSES = "warehouses"
+
+
+class Catalog:
+    """Warehouses and box types, persisted in the catalog tables and mirrored in memory.
+
+    The monitor refreshes it from the WB warehouses endpoint with conditional
+    requests and merges warehouses and box types that show up in coefficient
+    snapshots. Every change is published on TOPIC_CATALOG so other processes
+    reload their copy; lookups never touch the database.
+    """
+
+    def __init__(
+        self,
+        catalog_manager: CatalogManager,
+        api: WildberriesAPIClient | None = None,
+        broker: Broker | None = None,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.catalog_manager = catalog_manager
+        self.api = api
+        self.broker = broker
+        self.refresh_interval = refresh_interval
+
+        self._warehouses: dict[int, Warehouse] = {}
+        self._sorted_warehouses: list[Warehouse] = []
+        self._box_types: dict[str, int | None] = {}
+        self._search_index = WarehouseSearchIndex([])
+
+    @classmethod
+    def from_env(
+        cls,
+        catalog_manager: CatalogManager,
+        api: WildberriesAPIClient | None = None,
+        broker: Broker | None = None,
+    ) -> "Catalog":
+        return cls(
+            catalog_manager,
+            api=api,
+            broker=broker,
+            refresh_interval=float(os.getenv("CATALOG_REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL)),
+        )
+
+    async def initialize(self) -> None:
+        await self.catalog_manager.initialize()
+        await self.load()
+
+    async def load(self) -> None:
+        warehouses = await self.catalog_manager.get_warehouses()
+        self._warehouses = {wh.id: wh for wh in warehouses}
+        self._sorted_warehouses = sorted(warehouses, key=lambda wh: warehouse_sort_key(wh.name))
+        self._box_types = await self.catalog_manager.get_box_types()
+        self._search_index = WarehouseSearchIndex(self._sorted_warehouses)
+        logger.debug(f"Catalog loaded: {len(self._warehouses)} warehouses, {len(self._box_types)} box types")
+
+    def warehouse(self, warehouse_id: int) -> Warehouse | None:
+        return self._warehouses.get(warehouse_id)
+
+    def warehouse_name(self, warehouse_id: int) -> str | None:
+        warehouse = self._warehouses.get(warehouse_id)
+        return warehouse.name if warehouse is not None else None
+
+    def warehouses(self) -> list[Warehouse]:
+        """Sorted by name ignoring the СЦ prefix, empty until the catalog has been filled"""
+        return self._sorted_warehouses
+
+    def search(self, query: str, limit: int = 10) -> list[Warehouse]:
+        return self._search_index.search(query, limit)
+
+    def box_types(self) -> list[str]:
+        return sorted(self._box_types, key=warehouse_sort_key)
+
+    async def _changed(self) -> None:
+        await self.load()
+        if self.broker is not None:
+            await self.broker.publish(TOPIC_CATALOG, {"warehouses": len(self._warehouses)})
+
+    async def merge_snapshot(self, warehouses: list[tuple[int, str]], box_types: dict[str, int | None]) -> bool:
+        """Stores warehouses and box types of a snapshot the catalog does not know yet, returns whether any were new"""
+        new_warehouses = [
+            WarehouseShort(id=warehouse_id, name=name)
+            for warehouse_id, name in warehouses
+            if warehouse_id not in self._warehouses
+        ]
+        new_box_types = {
+            name: box_type_id
+            for name, box_type_id in box_types.items()
+            if name not in self._box_types
+        }
+        if not new_warehouses and not new_box_types:
+            return False
+
+        if new_warehouses:
+            await self.catalog_manager.add_warehouses(new_warehouses)
+        if new_box_types:
+            await self.catalog_manager.add_box_types(new_box_types)
+        logger.info(f"Catalog got {len(new_warehouses)} warehouses and {len(new_box_types)} box types from a snapshot")
+        await self._changed()
+        return True
+
+    async def refresh(self) -> bool:
+        """Conditionally fetches the warehouses endpoint, returns whether the catalog changed"""
+        etag, last_modified = await self.catalog_manager.get_validators(SOURCE_WAREHOUSES)
+        warehouses, response = await self.api.warehouses(etag, last_modified)
+        if warehouses is None:
+            await self.catalog_manager.set_validators(SOURCE_WAREHOUSES, etag, last_modified)
+            logger.debug("Warehouses not modified")
+            return False
+        etag, last_modified = response.etag, response.last_modified
+
+        changed = [wh for wh in warehouses if self._differs(wh)]
+        if changed:
+            await self.catalog_manager.upsert_warehouses(changed)
+        await self.catalog_manager.set_validators(SOURCE_WAREHOUSES, etag, last_modified)
+        logger.info(f"Warehouses refreshed, {len(changed)} of {len(warehouses)} changed")
+        if changed:
+            await self._changed()
+        return bool(changed)
+
+    def _differs(self, warehouse: Warehouse) -> bool:
+        known = self._warehouses.get(warehouse.id)
+        return known is None or known.model_dump() != warehouse.model_dump()
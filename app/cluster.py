@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from app.db.db import LeaseManager
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_MONITOR = "monitor"
+LEASE_TELEGRAM_UPDATES = "telegram-updates"
+
+
+def default_holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def owns_shard(key: int | str, workers: int, index: int) -> bool:
+    """Whether the bot worker number index out of workers is responsible for key (a chat id)"""
+    return int(key) % workers == index
+
+
+class LeaderElection:
+    """Keeps trying to take the named lease and renews it every ttl / 3.
+
+    Leadership is dropped as soon as a renewal fails, while other processes
+    can only take the lease once it expired, so at most one process acts as
+    the leader of a role at a time.
+    """
+
+    def __init__(self, lease_manager: LeaseManager, name: str, ttl: float = 30, holder: str | None = None):
+        self.lease_manager = lease_manager
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or default_holder_id()
+        self._is_leader = asyncio.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader.is_set()
+
+    async def wait_until_leader(self) -> None:
+        await self._is_leader.wait()
+
+    async def run(self) -> None:
+        await self.lease_manager.initialize()
+        try:
+            while True:
+                try:
+                    acquired = await self.lease_manager.acquire(self.name, self.holder, self.ttl)
+                except Exception as e:
+                    logger.error(f"Failed to renew lease '{self.name}': {e}")
+                    acquired = False
+
+                if acquired and not self.is_leader:
+                    logger.info(f"{self.holder} became leader of '{self.name}'")
+                    self._is_leader.set()
+                elif not acquired and self.is_leader:
+                    logger.warning(f"{self.holder} lost leadership of '{self.name}'")
+                    self._is_leader.clear()
+
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            self._is_leader.clear()
+            try:
+                await self.lease_manager.release(self.name, self.holder)
+            except Exception as e:
+                logger.error(f"Failed to release lease '{self.name}': {e}")
+
+
+def update_chat_id(update) -> int | None:
+    """Chat an aiogram Update belongs to, the sender for events without a chat (e.g. inline queries)"""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
@@ -1,5 +1,47 @@
+import os
+import logging
+
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+# settings below are read on import, before entry points would load .env themselves
+load_dotenv()
+
 
 class Config:
-    db_path = Path(__file__).parent / "db" / "base.sqlite"
+    db_path = Path(os.getenv("DB_PATH", Path(__file__).parent / "db" / "base.sqlite"))
+    # quiet hours of notification rules are in this timezone
+    rules_timezone = os.getenv("RULES_TIMEZONE", "Europe/Moscow")
+    # poll windows of the scheduler are in this timezone
+    schedule_timezone = os.getenv("SCHEDULE_TIMEZONE") or rules_timezone
+    # "HH:MM-HH:MM=seconds,..." poll intervals at times of day, e.g. right after WB releases slots
+    poll_windows = os.getenv("POLL_WINDOWS", "")
+    # seconds between refreshes of the box tariffs shown in alerts, 0 disables them
+    tariffs_refresh_interval = float(os.getenv("TARIFFS_REFRESH_INTERVAL", 3600))
+    # cache value codecs, see app.db.codecs
+    cache_codec = os.getenv("CACHE_CODEC", "json")
+    cache_codecs = os.getenv("CACHE_CODECS", "supply_data=zlib,supply_data_previous=zlib")
+    # in-process cache of decoded values, see app.db.memory. Snapshots are decoded in the worker
+    # pool and their fetch time must be fresh for the bot in multi-process deployments
+    cache_memory_ttl = float(os.getenv("CACHE_MEMORY_TTL", 300))
+    cache_memory_ttls = os.getenv(
+        "CACHE_MEMORY_TTLS", "supply_data=0,supply_data_previous=0,supply_data_fetched_at=0"
+    )
+    cache_memory_max_bytes = int(os.getenv("CACHE_MEMORY_MAX_BYTES", 8 * 2 ** 20))
+    # clicks on one menu within this many seconds are applied as one edit
+    keyboard_edit_debounce = float(os.getenv("KEYBOARD_EDIT_DEBOUNCE", 0.3))
+    # updates per second a user may send after a burst, 0 disables the limit
+    antiflood_rate = float(os.getenv("ANTIFLOOD_RATE", 2))
+    antiflood_burst = int(os.getenv("ANTIFLOOD_BURST", 10))
+    # the same button clicked again within this many seconds is a double tap
+    callback_duplicate_window = float(os.getenv("CALLBACK_DUPLICATE_WINDOW", 0.5))
+    # Bot API server base URL, e.g. a self-hosted one or benchmarks.fake_telegram_api, empty is api.telegram.org
+    telegram_api_url = os.getenv("TELEGRAM_API_URL", "")
+    # seconds a stopping role gets to finish work in flight before it is cancelled
+    shutdown_timeout = float(os.getenv("SHUTDOWN_TIMEOUT", 10))
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """Called by entry points only, importing a module must not reconfigure logging"""
+    logging.basicConfig(level=level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
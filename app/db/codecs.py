@@ -0,0 +1,147 @@
+"""Encoding of cached values.
+
+A codec is a serializer optionally followed by a compressor, written as
+"json", "zlib" (json+zlib), "zstd", "msgpack", "msgpack+zstd" and so on.
+Plain json values are stored as TEXT exactly like before codecs existed,
+everything else as a BLOB behind a header naming the format version,
+serializer and compressor, so a value decodes whatever the codec of its key
+is now and rows written by older versions keep working.
+"""
+import json
+import zlib
+
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b"WBC"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+SERIALIZERS = {"json": 0, "msgpack": 1}
+COMPRESSORS = {"none": 0, "zlib": 1, "zstd": 2}
+DEPENDENCIES = {"msgpack": "msgpack", "zstd": "zstandard"}
+
+ZLIB_LEVEL = 1
+ZSTD_LEVEL = 3
+
+
+class Codec:
+    def __init__(self, serializer: str = "json", compressor: str = "none"):
+        self.serializer = serializer
+        self.compressor = compressor
+        self.header = MAGIC + bytes((FORMAT_VERSION, SERIALIZERS[serializer], COMPRESSORS[compressor]))
+
+    @classmethod
+    def parse(cls, spec: str) -> "Codec":
+        serializer, compressor = "json", "none"
+        for part in spec.strip().lower().split("+"):
+            if part in SERIALIZERS:
+                serializer = part
+            elif part in COMPRESSORS:
+                compressor = part
+            else:
+                raise ValueError(f"Unknown cache codec '{spec}'")
+
+        for name in (serializer, compressor):
+            if name in DEPENDENCIES and not _available(name):
+                raise ValueError(f"Cache codec '{spec}' needs the {DEPENDENCIES[name]} package")
+        return cls(serializer, compressor)
+
+    @property
+    def name(self) -> str:
+        if self.compressor == "none":
+            return self.serializer
+        if self.serializer == "json":
+            return self.compressor
+        return f"{self.serializer}+{self.compressor}"
+
+    @property
+    def is_plain(self) -> bool:
+        return self.serializer == "json" and self.compressor == "none"
+
+    def encode(self, value: Any) -> str | bytes:
+        if self.serializer == "msgpack":
+            return self._pack(msgpack.packb(value))
+        return self.encode_json(json.dumps(value))
+
+    def encode_json(self, serialized: str | bytes) -> str | bytes:
+        """Stores an already JSON-encoded value, e.g. an API response body.
+
+        Re-encoding it as msgpack would mean decoding it first, so only the
+        compressor of the codec applies.
+        """
+        if self.compressor == "none":
+            return serialized.decode() if isinstance(serialized, bytes) else serialized
+        if isinstance(serialized, str):
+            serialized = serialized.encode()
+        return Codec("json", self.compressor)._pack(serialized)
+
+    def _pack(self, data: bytes) -> bytes:
+        if self.compressor == "zlib":
+            data = zlib.compress(data, ZLIB_LEVEL)
+        elif self.compressor == "zstd":
+            data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        return self.header + data
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name!r})"
+
+
+def _available(name: str) -> bool:
+    return {"msgpack": msgpack, "zstd": zstandard}[name] is not None
+
+
+def _unpack(stored: bytes) -> tuple[str, bytes]:
+    """Serializer name and serialized data of an encoded value"""
+    if not stored.startswith(MAGIC) or len(stored) < HEADER_SIZE:
+        # a BLOB without a header is JSON that went through set_raw as bytes
+        return "json", stored
+
+    version, serializer_id, compressor_id = stored[len(MAGIC):HEADER_SIZE]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported cache value format version {version}")
+    serializer = next(name for name, id_ in SERIALIZERS.items() if id_ == serializer_id)
+    compressor = next(name for name, id_ in COMPRESSORS.items() if id_ == compressor_id)
+
+    data = stored[HEADER_SIZE:]
+    if compressor == "zlib":
+        data = zlib.decompress(data)
+    elif compressor == "zstd":
+        if zstandard is None:
+            raise ValueError("Cached value is zstd compressed, install the zstandard package")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return serializer, data
+
+
+def decode(stored: str | bytes) -> Any:
+    if isinstance(stored, str):
+        return json.loads(stored)
+    serializer, data = _unpack(stored)
+    if serializer == "msgpack":
+        if msgpack is None:
+            raise ValueError("Cached value is msgpack encoded, install the msgpack package")
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+def parse_codecs(spec: str) -> dict[str, Codec]:
+    """Parses "key=codec,key=codec" as used by CACHE_CODECS"""
+    codecs = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, sep, codec = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected key=codec in CACHE_CODECS, got '{item}'")
+        codecs[key.strip()] = Codec.parse(codec)
+    return codecs
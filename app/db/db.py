@@ -1,11 +1,14 @@
 import aiosqlite
-import json
+import time
 from typing import Any, List
 
 from pathlib import Path
 
 from app.config import Config
-from app.dto import WarehouseShort, Warehouse
+from app.db.codecs import Codec, decode, parse_codecs
+from app.db.memory import MemoryCache, memory_cache
+from app.metrics import CACHE_VALUE_BYTES, observe_query
+from app.dto import WarehouseShort, Warehouse, Rule
 
 class DatabaseManager:
     def __init__(self, db_path: str):
@@ -19,6 +22,11 @@ class DatabaseManager:
             await db.execute(query, parameters)
             await db.commit()
 
+    async def execute_many(self, query: str, parameters: list[tuple]):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(query, parameters)
+            await db.commit()
+
     async def fetch_one(self, query: str, parameters: tuple = ()):
         async with aiosqlite.connect(self.db_path) as db:
             async with db.execute(query, parameters) as cursor:
@@ -34,7 +42,28 @@ class DatabaseManager:
 
 
 class WildberriesCacheManager(DatabaseManager):
-    """Manages cache of Wildberries API call"""
+    """Manages cache of Wildberries API call.
+
+    Values are encoded with the codec configured for their key, by default
+    the snapshots are zlib compressed and everything else is plain JSON.
+    get reads through and set writes through the in-process MemoryCache of
+    the database, decoded values it returns must not be modified.
+    """
+    def __init__(
+        self,
+        db_path: str,
+        codecs: dict[str, Codec] | None = None,
+        default_codec: Codec | None = None,
+        memory: MemoryCache | None = None,
+    ):
+        super().__init__(db_path)
+        self.codecs = parse_codecs(Config.cache_codecs) if codecs is None else codecs
+        self.default_codec = default_codec or Codec.parse(Config.cache_codec)
+        self.memory = memory or memory_cache(db_path)
+
+    def codec(self, key: str) -> Codec:
+        return self.codecs.get(key, self.default_codec)
+
     async def initialize(self):
         await self.execute('''
             CREATE TABLE IF NOT EXISTS cache (
@@ -43,23 +72,69 @@ class WildberriesCacheManager(DatabaseManager):
             )
         ''')
 
+    @observe_query
     async def set(self, key: str, value: Any):
-        serialized_value = json.dumps(value)
+        encoded_value = self.codec(key).encode(value)
+        await self._store(key, encoded_value)
+        self.memory.put(key, value, len(encoded_value), self.memory.version(key))
+
+    async def get(self, key: str) -> Any:
+        # hits are counted by cache_memory_lookups_total, only a miss is a query
+        hit, value = self.memory.get(key)
+        if hit:
+            return value
+        return await self._fetch(key)
+
+    @observe_query
+    async def _fetch(self, key: str) -> Any:
+        version = self.memory.version(key)
+        result = await self.fetch_one('SELECT value FROM cache WHERE key = ?', (key,))
+        value = decode(result[0]) if result is not None else None
+        # missing keys are cached too, e.g. a menu message id that was never sent
+        self.memory.put(key, value, len(result[0]) if result is not None else 0, version)
+        return value
+
+    @observe_query
+    async def set_raw(self, key: str, serialized_value: str | bytes):
+        """Stores an already JSON-encoded value, e.g. an API response body"""
+        await self._store(key, self.codec(key).encode_json(serialized_value))
+
+    @observe_query
+    async def set_encoded(self, key: str, encoded_value: str | bytes):
+        """Stores a value encoded with self.codec(key) elsewhere, e.g. compressed in the worker pool"""
+        await self._store(key, encoded_value)
+
+    async def _store(self, key: str, stored_value: str | bytes):
+        CACHE_VALUE_BYTES.set(len(stored_value), key=key)
         await self.execute('''
             INSERT OR REPLACE INTO cache (key, value)
             VALUES (?, ?)
-        ''', (key, serialized_value))
-
-    async def get(self, key: str) -> Any:
+        ''', (key, stored_value))
+        # after the write: a read racing with it may have put the old value back
+        self.memory.bump(key)
+        await self.memory.publish(key)
+
+    @observe_query
+    async def get_raw(self, key: str) -> str | bytes | None:
+        """Returns the stored value without decoding it on the event loop, see app.db.codecs.decode"""
         result = await self.fetch_one('SELECT value FROM cache WHERE key = ?', (key,))
-        
-        if result is None:
-            return None
-        
-        return json.loads(result[0])
+        return result[0] if result is not None else None
+
+    @observe_query
+    async def copy(self, key: str, new_key: str):
+        """Copies a value within the database, e.g. to keep the previous snapshot"""
+        await self.execute('''
+            INSERT OR REPLACE INTO cache (key, value)
+            SELECT ?, value FROM cache WHERE key = ?
+        ''', (new_key, key))
+        self.memory.bump(new_key)
+        await self.memory.publish(new_key)
 
+    @observe_query
     async def clear(self):
         await self.clear_table('cache')
+        self.memory.clear()
+        await self.memory.publish(None)
 
 
 class TrackedWarehouseManager(DatabaseManager):
@@ -72,6 +147,7 @@ class TrackedWarehouseManager(DatabaseManager):
             )
         ''')
 
+    @observe_query
     async def get_all(self) -> list[WarehouseShort]:
         results = await self.fetch_all('SELECT id, name FROM warehouses')
         return [
@@ -79,12 +155,14 @@ class TrackedWarehouseManager(DatabaseManager):
             for result in results
         ]
 
+    @observe_query
     async def add(self, warehouse: WarehouseShort):
         try:
             await self.execute('INSERT INTO warehouses (id, name) VALUES (?, ?)', (warehouse.id, warehouse.name))
         except aiosqlite.IntegrityError:
-            raise ValueError(f"Warehouse with id '{warehouse_id}' or name '{warehouse_name}' already exists")
+            raise ValueError(f"Warehouse with id '{warehouse.id}' or name '{warehouse.name}' already exists")
 
+    @observe_query
     async def drop(self, warehouse_id: int):
         result = await self.fetch_one('SELECT id FROM warehouses WHERE id = ?', (warehouse_id,))
         if result is None:
@@ -92,12 +170,14 @@ class TrackedWarehouseManager(DatabaseManager):
         
         await self.execute('DELETE FROM warehouses WHERE id = ?', (warehouse_id,))
 
+    @observe_query
     async def get(self, warehouse_id: int) -> dict:
         result = await self.fetch_one('SELECT id, name FROM warehouses WHERE id = ?', (warehouse_id,))
         if result is None:
             raise ValueError(f"Warehouse with id '{warehouse_id}' not found")
         return {"id": result[0], "name": result[1]}
 
+    @observe_query
     async def clear(self):
         await self.clear_table('warehouses')
 
@@ -112,16 +192,19 @@ class BoxTypeManager(DatabaseManager):
             )
         ''')
 
+    @observe_query
     async def get_all(self) -> list[str]:
         results = await self.fetch_all('SELECT name FROM box_types')
         return [result[0] for result in results]
 
+    @observe_query
     async def add(self, name: str):
         try:
             await self.execute('INSERT INTO box_types (name) VALUES (?)', (name,))
         except aiosqlite.IntegrityError:
             raise ValueError(f"Box type '{name}' already exists")
 
+    @observe_query
     async def drop(self, name: str):
         result = await self.fetch_one('SELECT name FROM box_types WHERE name = ?', (name,))
         if result is None:
@@ -129,6 +212,7 @@ class BoxTypeManager(DatabaseManager):
         
         await self.execute('DELETE FROM box_types WHERE name = ?', (name,))
 
+    @observe_query
     async def clear(self):
         await self.clear_table('box_types')
 
@@ -143,16 +227,19 @@ class DateManager(DatabaseManager):
             )
         ''')
 
+    @observe_query
     async def get_all(self) -> list[str]:
         results = await self.fetch_all('SELECT date FROM dates')
         return [result[0] for result in results]
 
+    @observe_query
     async def add(self, date: str) -> None:
         try:
             await self.execute('INSERT INTO dates (date) VALUES (?)', (date,))
         except aiosqlite.IntegrityError:
             raise ValueError(f"Date '{date}' already exists")
 
+    @observe_query
     async def drop(self, date: str) -> None:
         result = await self.fetch_one('SELECT date FROM dates WHERE date = ?', (date,))
         if result is None:
@@ -160,5 +247,260 @@ class DateManager(DatabaseManager):
         
         await self.execute('DELETE FROM dates WHERE date = ?', (date,))
 
+    @observe_query
     async def clear(self) -> None:
         await self.clear_table('dates')
+
+
+class LeaseManager(DatabaseManager):
+    """Time-limited named leases, used to elect one process for a role"""
+    async def initialize(self):
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+
+    @observe_query
+    async def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        """Takes or renews the lease, returns whether holder owns it afterwards"""
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            ''', (name, holder, now + ttl, now))
+            await db.commit()
+            async with db.execute('SELECT holder FROM leases WHERE name = ?', (name,)) as cursor:
+                row = await cursor.fetchone()
+        return row is not None and row[0] == holder
+
+    @observe_query
+    async def release(self, name: str, holder: str) -> None:
+        await self.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+
+class CatalogManager(DatabaseManager):
+    """Warehouses and box types known to WB and the validators of the last catalog responses"""
+    async def initialize(self):
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_warehouses (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                address TEXT NOT NULL DEFAULT '',
+                work_time TEXT NOT NULL DEFAULT '',
+                accepts_qr INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        await self.execute('''
+            CREATE INDEX IF NOT EXISTS catalog_warehouses_name ON catalog_warehouses (name)
+        ''')
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_box_types (
+                name TEXT PRIMARY KEY,
+                id INTEGER
+            )
+        ''')
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_sources (
+                source TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL
+            )
+        ''')
+
+    @observe_query
+    async def get_warehouses(self) -> list[Warehouse]:
+        results = await self.fetch_all('''
+            SELECT id, name, address, work_time, accepts_qr FROM catalog_warehouses
+        ''')
+        return [
+            Warehouse(id=result[0], name=result[1], address=result[2], work_time=result[3], accepts_qr=result[4])
+            for result in results
+        ]
+
+    @observe_query
+    async def upsert_warehouses(self, warehouses: list[Warehouse]) -> None:
+        await self.execute_many('''
+            INSERT INTO catalog_warehouses (id, name, address, work_time, accepts_qr)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name,
+                address = excluded.address,
+                work_time = excluded.work_time,
+                accepts_qr = excluded.accepts_qr
+        ''', [(wh.id, wh.name, wh.address, wh.work_time, wh.accepts_qr) for wh in warehouses])
+
+    @observe_query
+    async def add_warehouses(self, warehouses: list[WarehouseShort]) -> None:
+        """Adds warehouses that are not in the catalog yet, known ones are left as they are"""
+        await self.execute_many(
+            'INSERT OR IGNORE INTO catalog_warehouses (id, name) VALUES (?, ?)',
+            [(wh.id, wh.name) for wh in warehouses],
+        )
+
+    @observe_query
+    async def get_box_types(self) -> dict[str, int | None]:
+        results = await self.fetch_all('SELECT name, id FROM catalog_box_types')
+        return {result[0]: result[1] for result in results}
+
+    @observe_query
+    async def add_box_types(self, box_types: dict[str, int | None]) -> None:
+        await self.execute_many(
+            'INSERT OR IGNORE INTO catalog_box_types (name, id) VALUES (?, ?)',
+            list(box_types.items()),
+        )
+
+    @observe_query
+    async def get_validators(self, source: str) -> tuple[str | None, str | None]:
+        """ETag and Last-Modified of the last successful response of source"""
+        result = await self.fetch_one(
+            'SELECT etag, last_modified FROM catalog_sources WHERE source = ?', (source,)
+        )
+        return (result[0], result[1]) if result is not None else (None, None)
+
+    @observe_query
+    async def set_validators(self, source: str, etag: str | None, last_modified: str | None) -> None:
+        await self.execute('''
+            INSERT OR REPLACE INTO catalog_sources (source, etag, last_modified, checked_at)
+            VALUES (?, ?, ?, ?)
+        ''', (source, etag, last_modified, time.time()))
+
+
+class RuleManager(DatabaseManager):
+    """Notification rules, see Rule"""
+    async def initialize(self):
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS rules (
+                id INTEGER PRIMARY KEY,
+                warehouse_id INTEGER,
+                box_type TEXT,
+                coefficient_less INTEGER,
+                free_only INTEGER NOT NULL DEFAULT 0,
+                drop_by INTEGER,
+                quiet_start INTEGER,
+                quiet_end INTEGER,
+                book INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # tables created before rules could book
+        columns = {result[1] for result in await self.fetch_all('PRAGMA table_info(rules)')}
+        if "book" not in columns:
+            await self.execute('ALTER TABLE rules ADD COLUMN book INTEGER NOT NULL DEFAULT 0')
+
+    @observe_query
+    async def get_all(self) -> list[Rule]:
+        results = await self.fetch_all('''
+            SELECT id, warehouse_id, box_type, coefficient_less, free_only, drop_by, quiet_start, quiet_end, book
+            FROM rules ORDER BY id
+        ''')
+        return [
+            Rule(
+                id=result[0],
+                warehouse_id=result[1],
+                box_type=result[2],
+                coefficient_less=result[3],
+                free_only=bool(result[4]),
+                drop_by=result[5],
+                quiet_start=result[6],
+                quiet_end=result[7],
+                book=bool(result[8]),
+            )
+            for result in results
+        ]
+
+    @observe_query
+    async def add(self, rule: Rule) -> int:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                INSERT INTO rules (warehouse_id, box_type, coefficient_less, free_only, drop_by, quiet_start, quiet_end, book)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                rule.warehouse_id, rule.box_type, rule.coefficient_less, rule.free_only,
+                rule.drop_by, rule.quiet_start, rule.quiet_end, rule.book,
+            ))
+            await db.commit()
+            return cursor.lastrowid
+
+    @observe_query
+    async def drop(self, rule_id: int) -> None:
+        result = await self.fetch_one('SELECT id FROM rules WHERE id = ?', (rule_id,))
+        if result is None:
+            raise ValueError(f"Rule '{rule_id}' not found")
+
+        await self.execute('DELETE FROM rules WHERE id = ?', (rule_id,))
+
+    @observe_query
+    async def clear(self) -> None:
+        await self.clear_table('rules')
+
+
+class BookingManager(DatabaseManager):
+    """Booking attempts by idempotency key, a slot is only ever claimed by one attempt at a time"""
+    async def initialize(self):
+        await self.execute('''
+            CREATE TABLE IF NOT EXISTS bookings (
+                idempotency_key TEXT PRIMARY KEY,
+                warehouse_id INTEGER NOT NULL,
+                box_type TEXT NOT NULL,
+                date TEXT NOT NULL,
+                coefficient INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                booking_id TEXT,
+                detail TEXT,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+    @observe_query
+    async def claim(
+        self,
+        idempotency_key: str,
+        warehouse_id: int,
+        box_type: str,
+        date: str,
+        coefficient: int,
+        expired: dict[str, float] | None = None,
+    ) -> bool:
+        """Records a pending attempt, False if the key was already claimed (by any process).
+
+        expired maps a status to seconds after which an attempt with it no longer holds the key.
+        """
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            for status, ttl in (expired or {}).items():
+                await db.execute('''
+                    DELETE FROM bookings WHERE idempotency_key = ? AND status = ? AND created_at < ?
+                ''', (idempotency_key, status, now - ttl))
+            cursor = await db.execute('''
+                INSERT OR IGNORE INTO bookings
+                    (idempotency_key, warehouse_id, box_type, date, coefficient, status, created_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?)
+            ''', (idempotency_key, warehouse_id, box_type, date, coefficient, now))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @observe_query
+    async def finish(self, idempotency_key: str, status: str, booking_id: str | None, detail: str | None) -> None:
+        # the expiry of a finished attempt counts from its result
+        await self.execute('''
+            UPDATE bookings SET status = ?, booking_id = ?, detail = ?, created_at = ? WHERE idempotency_key = ?
+        ''', (status, booking_id, detail, time.time(), idempotency_key))
+
+    @observe_query
+    async def release(self, idempotency_key: str) -> None:
+        """Forgets an attempt so the slot can be tried again"""
+        await self.execute('DELETE FROM bookings WHERE idempotency_key = ?', (idempotency_key,))
+
+    @observe_query
+    async def get_recent(self, limit: int = 20) -> list[tuple]:
+        return await self.fetch_all('''
+            SELECT idempotency_key, warehouse_id, box_type, date, coefficient, status, booking_id, detail, created_at
+            FROM bookings ORDER BY created_at DESC LIMIT ?
+        ''', (limit,))
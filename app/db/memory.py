@@ -0,0 +1,149 @@
+import logging
+import os
+import time
+import uuid
+
+from collections import OrderedDict
+from typing import Any
+
+from app.config import Config
+from app.metrics import CACHE_MEMORY_LOOKUPS
+
+
+logger = logging.getLogger(__name__)
+
+# published on the broker of the process, app.broker is not imported here as it depends on app.db
+TOPIC_CACHE = "cache"
+
+
+def parse_ttls(spec: str) -> dict[str, float]:
+    """Parses "key=seconds,key=seconds" as used by CACHE_MEMORY_TTLS"""
+    ttls = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, sep, ttl = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected key=seconds in CACHE_MEMORY_TTLS, got '{item}'")
+        ttls[key.strip()] = float(ttl)
+    return ttls
+
+
+class MemoryCache:
+    """Decoded cache values of one database, shared by every manager of the process.
+
+    Entries expire after the TTL of their key (0 disables caching the key)
+    and the least recently used ones are evicted beyond max_bytes, measured
+    as the stored size. Every write bumps the version of its key, a read that
+    started before a write does not put its older value back. Writes are
+    published on TOPIC_CACHE so other processes drop their copy.
+    """
+
+    def __init__(
+        self,
+        ttls: dict[str, float] | None = None,
+        default_ttl: float = 300,
+        max_bytes: int = 8 * 2 ** 20,
+        max_entries: int = 1024,
+    ):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.holder = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.broker = None
+
+        # key -> (expires_at, size, value)
+        self._entries: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        # bumped by clear, part of every version
+        self._generation = 0
+        self._bytes = 0
+
+    @classmethod
+    def from_config(cls) -> "MemoryCache":
+        return cls(
+            ttls=parse_ttls(Config.cache_memory_ttls),
+            default_ttl=Config.cache_memory_ttl,
+            max_bytes=Config.cache_memory_max_bytes,
+        )
+
+    def ttl(self, key: str) -> float:
+        return self.ttls.get(key, self.default_ttl)
+
+    def version(self, key: str) -> tuple[int, int]:
+        return self._generation, self._versions.get(key, 0)
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """(True, value) on a hit, (False, None) otherwise"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            CACHE_MEMORY_LOOKUPS.inc(result="miss")
+            return False, None
+        self._entries.move_to_end(key)
+        CACHE_MEMORY_LOOKUPS.inc(result="hit")
+        return True, entry[2]
+
+    def put(self, key: str, value: Any, size: int, version: tuple[int, int]) -> None:
+        """Caches a value read or written at version, unless the key changed since"""
+        ttl = self.ttl(key)
+        if ttl <= 0 or version != self.version(key) or size > self.max_bytes // 4:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def bump(self, key: str) -> tuple[int, int]:
+        """Marks a write of key, drops its entry and returns the new version"""
+        self._remove(key)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        return self.version(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._generation += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def attach(self, broker) -> None:
+        """Publishes writes of this process through broker"""
+        self.broker = broker
+
+    async def publish(self, key: str | None) -> None:
+        """Tells other processes to drop key, None stands for every key"""
+        # keys that are never cached need no invalidation, e.g. the snapshot written on every poll
+        if self.broker is None or (key is not None and self.ttl(key) <= 0):
+            return
+        try:
+            await self.broker.publish(TOPIC_CACHE, {"key": key, "holder": self.holder})
+        except Exception as e:
+            logger.error(f"Failed to publish invalidation of cache key {key}: {e}")
+
+    async def listen(self) -> None:
+        """Drops keys written by other processes"""
+        async for message in self.broker.subscribe(TOPIC_CACHE):
+            if message["holder"] == self.holder:
+                continue
+            if message["key"] is None:
+                self.clear()
+            else:
+                self.bump(message["key"])
+
+
+_caches: dict[str, MemoryCache] = {}
+
+
+def memory_cache(db_path: str) -> MemoryCache:
+    """The MemoryCache of a database file, one per process so every manager sees the writes of the others"""
+    key = str(db_path)
+    if key not in _caches:
+        _caches[key] = MemoryCache.from_config()
+    return _caches[key]
@@ -2,7 +2,7 @@ import datetime
 
 from enum import Enum
 from dataclasses import dataclass
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
@@ -14,6 +14,28 @@ class TimePeriod:
     end_date: datetime.datetime
 
 
+@dataclass(frozen=True)
+class Rule:
+    """Notification rule, every condition that is set has to hold.
+
+    warehouse_id and box_type of None match any warehouse or box type,
+    quiet hours are [quiet_start, quiet_end) and may wrap around midnight.
+    Slots matched by a rule with book set are handed to the booking pipeline.
+    Rules of the tracking menus have tracked_dates set and only match the
+    dates chosen there, rules added with /rule match any date.
+    """
+    id: int | None = None
+    warehouse_id: int | None = None
+    box_type: str | None = None
+    coefficient_less: int | None = None
+    free_only: bool = False
+    drop_by: int | None = None
+    quiet_start: int | None = None
+    quiet_end: int | None = None
+    book: bool = False
+    tracked_dates: bool = False
+
+
 class DeliveryType(Enum):
     SUPERSAFE = 'Суперсейф'
     MONOPALLETS = 'Монопаллеты'
@@ -37,9 +59,33 @@ class WarehouseShort(BaseModel):
 
 
 class Warehouse(WarehouseShort):
-    address: str
-    wopk_time: str
-    acceptsQR: bool
+    """Entry of the WB warehouses endpoint, aliases are its field names"""
+    id: int = Field(alias="ID")
+    address: str = ""
+    work_time: str = Field("", alias="workTime")
+    accepts_qr: bool = Field(False, alias="acceptsQR")
+
+    model_config = ConfigDict(frozen=False, populate_by_name=True)
+
+
+class BoxTariff(BaseModel):
+    """Entry of the WB box tariffs endpoint, amounts in rubles per box and per liter"""
+    warehouse_name: str = Field(alias="warehouseName")
+    delivery_base: float | None = Field(None, alias="boxDeliveryBase")
+    delivery_liter: float | None = Field(None, alias="boxDeliveryLiter")
+    storage_base: float | None = Field(None, alias="boxStorageBase")
+    storage_liter: float | None = Field(None, alias="boxStorageLiter")
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    @field_validator("delivery_base", "delivery_liter", "storage_base", "storage_liter", mode="before")
+    @classmethod
+    def parse_amount(cls, value):
+        # WB writes amounts as "48,75" and "-" where a warehouse has none
+        if isinstance(value, str):
+            value = value.replace(",", ".").strip()
+            return None if value in ("", "-") else value
+        return value
 
 
 class Coefficient(BaseModel):
@@ -4,7 +4,6 @@ from aiogram.filters import Command
 
 from app.utils.messages.messages import get_message_text_by_key
 from app.keyboards.keyboards import AddTrackingItemsMenuKeyboard
-from app.config import Config
 from app.db.db import (
     WildberriesCacheManager,
 )
@@ -12,11 +11,9 @@ from app.db.db import (
 
 router = Router()
 
-cache_manager = WildberriesCacheManager(Config.db_path)
-
 
 @router.message(Command(commands=["start"]))
-async def start_command(message: types.Message) -> None:
+async def start_command(message: types.Message, cache_manager: WildberriesCacheManager) -> None:
     text = get_message_text_by_key("start")
 
     coefficient_now: int | None = await cache_manager.get("coefficient")
@@ -0,0 +1,58 @@
+import dataclasses
+
+from aiogram import Router, types
+from aiogram.filters import Command, CommandObject
+
+from app.catalog import Catalog
+from app.db.db import RuleManager
+from app.rules import RULE_SYNTAX, describe_rule, parse_rule
+from app.utils.messages.messages import get_message_text_by_key
+
+
+router = Router()
+
+
+@router.message(Command(commands=["rules"]))
+async def list_rules(message: types.Message, rule_manager: RuleManager, catalog: Catalog) -> None:
+    rules = await rule_manager.get_all()
+    if not rules:
+        await message.answer(get_message_text_by_key("rules_empty").format(syntax=RULE_SYNTAX))
+        return
+    await message.answer("\n".join(describe_rule(rule, catalog.warehouse_name) for rule in rules))
+
+
+@router.message(Command(commands=["rule"]))
+async def rule_command(
+    message: types.Message,
+    command: CommandObject,
+    rule_manager: RuleManager,
+    catalog: Catalog,
+) -> None:
+    action, _, arguments = (command.args or "").partition(" ")
+
+    if action == "add":
+        def resolve_warehouse(name: str) -> int | None:
+            found = catalog.search(name, limit=1)
+            return found[0].id if found else None
+
+        try:
+            rule = parse_rule(arguments, resolve_warehouse)
+        except ValueError as e:
+            await message.answer(f"{e}\n/rule add {RULE_SYNTAX}")
+            return
+        rule = dataclasses.replace(rule, id=await rule_manager.add(rule))
+        await message.answer(f"Rule added {describe_rule(rule, catalog.warehouse_name)}")
+
+    elif action in ("del", "delete") and arguments.strip().isdigit():
+        try:
+            await rule_manager.drop(int(arguments))
+        except ValueError as e:
+            await message.answer(str(e))
+            return
+        await message.answer(f"Rule #{int(arguments)} deleted")
+
+    else:
+        await message.answer(get_message_text_by_key("rule_usage").format(syntax=RULE_SYNTAX))
+
+
+__all__ = ['router']
@@ -1,10 +1,10 @@
-import re
 import datetime
 
 from functools import wraps
 
 from aiogram import Router, F, types
-from aiogram.filters import Command
+from aiogram.enums import ParseMode
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
@@ -14,19 +14,23 @@ from app.db.db import (
     BoxTypeManager,
     DateManager,
 )
-from app.config import Config
 from app.keyboards.keyboards import (
     Buttons,
     WarehousesKeyboard,
     BoxTypesKeyboard,
     AddTrackingItemsMenuKeyboard,
     DateKeyboard,
+    SupplyMatrixKeyboard,
 )
+from app.keyboards.editor import KeyboardEditor
+from app.catalog import Catalog
 from app.dto import (
     WarehouseShort,
     RightDate,
 )
+from app.snapshots import SupplySnapshot
 from app.utils.messages.messages import get_message_text_by_key
+from app.utils.search import WarehouseSearchIndex
 
 
 class CoefStates(StatesGroup):
@@ -35,16 +39,16 @@ class CoefStates(StatesGroup):
 
 router = Router()
 
-cache_manager = WildberriesCacheManager(Config.db_path)
-tracked_warehouse_manager = TrackedWarehouseManager(Config.db_path)
-box_type_manager = BoxTypeManager(Config.db_path)
-date_manager = DateManager(Config.db_path)
+SEARCH_RESULTS_LIMIT = 10
+INLINE_RESULTS_LIMIT = 20
 
 
 def delete_previous_message(menu_type: str):
+    """The decorated handler has to accept cache_manager, aiogram only injects declared arguments"""
     def decorator(func):
         @wraps(func)
         async def wrapper(message: types.Message, *args, **kwargs):
+            cache_manager: WildberriesCacheManager = kwargs["cache_manager"]
             # Delete the previous menu message
             previous_message_id = await cache_manager.get(f"previous_{menu_type}_message_id")
             if previous_message_id:
@@ -74,6 +78,58 @@ def delete_previous_message(menu_type: str):
     return decorator
 
 
+async def list_warehouses(catalog: Catalog, supply_snapshot: SupplySnapshot) -> list[WarehouseShort]:
+    """Catalog warehouses, the ones of the latest snapshot until the catalog is filled"""
+    return catalog.warehouses() or await supply_snapshot.warehouses()
+
+
+async def list_box_types(catalog: Catalog, supply_snapshot: SupplySnapshot) -> list[str]:
+    return catalog.box_types() or await supply_snapshot.box_types()
+
+
+async def find_warehouse_name(catalog: Catalog, supply_snapshot: SupplySnapshot, warehouse_id: int) -> str | None:
+    name = catalog.warehouse_name(warehouse_id)
+    if name is None:
+        # catalog not filled yet
+        name = next((wh.name for wh in await supply_snapshot.warehouses() if wh.id == warehouse_id), None)
+    return name
+
+
+async def search_warehouses(
+    catalog: Catalog,
+    supply_snapshot: SupplySnapshot,
+    query: str,
+    limit: int,
+) -> list[WarehouseShort]:
+    if catalog.warehouses():
+        return catalog.search(query, limit)
+    # catalog not filled yet, a few hundred snapshot warehouses are indexed in no time
+    return WarehouseSearchIndex(await supply_snapshot.warehouses()).search(query, limit)
+
+
+async def toggle_tracking(tracked_warehouse_manager: TrackedWarehouseManager, warehouse: WarehouseShort) -> str:
+    tracked_warehouses = await tracked_warehouse_manager.get_all()
+    if warehouse.id in {wh.id for wh in tracked_warehouses}:
+        await tracked_warehouse_manager.drop(warehouse.id)
+        return "removed from"
+    await tracked_warehouse_manager.add(warehouse)
+    return "added to"
+
+
+def mark_tracked_warehouses(
+    warehouses: list[WarehouseShort],
+    tracked_warehouses: list[WarehouseShort],
+) -> list[WarehouseShort]:
+    tracked_ids = {wh.id for wh in tracked_warehouses}
+    return [
+        WarehouseShort(
+            id=wh.id,
+            name=f"🏫 {wh.name}" if wh.id in tracked_ids else wh.name,
+        )
+        for wh in warehouses
+    ]
+
+
 @router.message(F.text.regexp(Buttons.COEFFICIENT_F_REPLY.value.regex))
 async def awaiting_coefficient(message: types.Message, state: FSMContext) -> None:
     text = get_message_text_by_key("enter_coefficient")
@@ -82,7 +138,11 @@ async def awaiting_coefficient(message: types.Message, state: FSMContext) -> Non
 
 
 @router.message(CoefStates.awaiting_coefficient)
-async def set_coefficient(message: types.Message, state: FSMContext):
+async def set_coefficient(
+    message: types.Message,
+    state: FSMContext,
+    cache_manager: WildberriesCacheManager,
+):
     try:
         coef = int(message.text)
         await cache_manager.set("coefficient", coef)
@@ -98,17 +158,53 @@ async def set_coefficient(message: types.Message, state: FSMContext):
         await state.clear()
 
 
+def supply_matrix_page(
+    matrix: list[tuple[str, list[str]]],
+    box_type_index: int,
+    page: int,
+) -> tuple[str, types.InlineKeyboardMarkup]:
+    """A rendered page of SupplySnapshot.coefficient_matrix, indices of an older snapshot are clamped"""
+    box_type_index = min(max(box_type_index, 0), len(matrix) - 1)
+    pages = matrix[box_type_index][1]
+    page = min(max(page, 0), len(pages) - 1)
+    keyboard = SupplyMatrixKeyboard([box_type for box_type, _ in matrix], box_type_index, page, len(pages)).build()
+    return pages[page], keyboard
+
+
 @router.message(Command(commands=["supply"]))
-async def supply_command(message: types.Message) -> None:
-    supply_data = await cache_manager.get('supply_data')
-    if supply_data:
-        await message.answer(f"Latest supply data: {str(supply_data[:11])}")
-    else:
+async def supply_command(message: types.Message, supply_snapshot: SupplySnapshot) -> None:
+    # rendered once per snapshot, every request after the first one is a lookup
+    matrix = await supply_snapshot.coefficient_matrix()
+    if not matrix:
         await message.answer("No supply data available at the moment.")
+        return
+    text, keyboard = supply_matrix_page(matrix, 0, 0)
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("sm:"))
+async def turn_supply_matrix_page(
+    clbck: types.CallbackQuery,
+    supply_snapshot: SupplySnapshot,
+    keyboard_editor: KeyboardEditor,
+) -> None:
+    matrix = await supply_snapshot.coefficient_matrix()
+    if not matrix:
+        await clbck.answer("No supply data available at the moment.")
+        return
+    _, box_type_index, page = clbck.data.split(":")
+    text, keyboard = supply_matrix_page(matrix, int(box_type_index), int(page))
+    keyboard_editor.edit(clbck.message, keyboard, text=text, parse_mode=ParseMode.HTML)
+    await clbck.answer()
 
 
 @router.message(Command(commands=["clearall"]))
-async def clear_warehouses(message: types.Message) -> None:
+async def clear_warehouses(
+    message: types.Message,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    box_type_manager: BoxTypeManager,
+    date_manager: DateManager,
+) -> None:
     await tracked_warehouse_manager.clear()
     await box_type_manager.clear()
     await date_manager.clear()
@@ -116,29 +212,15 @@ async def clear_warehouses(message: types.Message) -> None:
 
 @router.message(F.text == Buttons.ADD_WAREHOUSE_REPLY.value.text)
 @delete_previous_message("warehouse")
-async def get_add_warehouse_menu(message: types.Message) -> None:
-    warehouses_raw = await cache_manager.get("supply_data")
-
-    warehouses: list[WarehouseShort] = [
-        WarehouseShort(id=wh["warehouseID"], name=wh["warehouseName"])
-        for wh in warehouses_raw
-    ]
-    warehouses = list(set(warehouses))
-    warehouses.sort(
-        key=lambda x: re.sub(r'^СЦ\s+', '', x.name)
-    )
-
-    tracked_warehouses: list[WarehouseShort] = await tracked_warehouse_manager.get_all()
-    marked_warehouses = [
-        WarehouseShort(
-            id=wh.id,
-            name=(
-                f"🏫 {wh.name}" if wh in tracked_warehouses
-                else wh.name
-            )
-        )
-        for wh in warehouses
-    ]
+async def get_add_warehouse_menu(
+    message: types.Message,
+    cache_manager: WildberriesCacheManager,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    warehouses = await list_warehouses(catalog, supply_snapshot)
+    marked_warehouses = mark_tracked_warehouses(warehouses, await tracked_warehouse_manager.get_all())
 
     keyboard = WarehousesKeyboard(
         marked_warehouses
@@ -151,66 +233,39 @@ async def get_add_warehouse_menu(message: types.Message) -> None:
 
 
 @router.callback_query(F.data.startswith("wh:"))
-async def toggle_warehouse(clbck: types.CallbackQuery) -> None:
+async def toggle_warehouse(
+    clbck: types.CallbackQuery,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+    keyboard_editor: KeyboardEditor,
+) -> None:
     warehouse_id: int = int(clbck.data.split(":")[1].replace("🏫 ", ""))
-    tracked_warehouses: list[WarehouseShort] = await tracked_warehouse_manager.get_all()
-
-    warehouses_raw = await cache_manager.get("supply_data")
-    for wh in warehouses_raw:
-        if wh["warehouseID"] == warehouse_id:
-            warehouse_name = wh["warehouseName"]
-            break
-
-    if warehouse_id in [wh.id for wh in tracked_warehouses]:
-        await tracked_warehouse_manager.drop(warehouse_id)
-        action = "removed from"
-    else:
-        await tracked_warehouse_manager.add(
-            WarehouseShort(id=warehouse_id, name=warehouse_name)
-        )
-        action = "added to"
-
-    warehouses: list[WarehouseShort] = [
-        WarehouseShort(id=wh["warehouseID"], name=wh["warehouseName"])
-        for wh in warehouses_raw
-    ]
-    warehouses = list(set(warehouses))
-    warehouses.sort(
-        key=lambda x: re.sub(r'^СЦ\s+', '', x.name)
-    )
-
-    tracked_warehouses: list[WarehouseShort] = await tracked_warehouse_manager.get_all()
-    marked_warehouses = [
-        WarehouseShort(
-            id=wh.id,
-            name=(
-                f"🏫 {wh.name}" if wh in tracked_warehouses
-                else wh.name
-            )
-        )
-        for wh in warehouses
-    ]
+    warehouse_name = await find_warehouse_name(catalog, supply_snapshot, warehouse_id)
+    if warehouse_name is None:
+        await clbck.answer("Unknown warehouse")
+        return
 
-    new_keyboard = WarehousesKeyboard(marked_warehouses).build()
+    action = await toggle_tracking(tracked_warehouse_manager, WarehouseShort(id=warehouse_id, name=warehouse_name))
 
-    await clbck.message.edit_text(
-        f"Warehouse {warehouse_name} {action} tracking list. Select more warehouses:",
-        reply_markup=new_keyboard
-    )
+    warehouses = await list_warehouses(catalog, supply_snapshot)
+    marked_warehouses = mark_tracked_warehouses(warehouses, await tracked_warehouse_manager.get_all())
 
+    # the menu text stays, only the marker of the clicked button changes
+    keyboard_editor.edit(clbck.message, WarehousesKeyboard(marked_warehouses).build())
     await clbck.answer(f"Warehouse {warehouse_name} {action} tracking list")
 
 
 @router.message(F.text == Buttons.ADD_BOX_TYPE_REPLY.value.text)
 @delete_previous_message("box_type")
-async def get_add_box_type_menu(message: types.Message) -> None:
-    warehouses = await cache_manager.get("supply_data")
-
-    box_type_names = [wh["boxTypeName"] for wh in warehouses]
-    box_type_names = list(set(box_type_names))
-    box_type_names.sort(
-        key=lambda x: re.sub(r'^СЦ\s+', '', x)
-    )
+async def get_add_box_type_menu(
+    message: types.Message,
+    cache_manager: WildberriesCacheManager,
+    box_type_manager: BoxTypeManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    box_type_names = await list_box_types(catalog, supply_snapshot)
 
     tracked_box_types = await box_type_manager.get_all()
     box_type_names = [
@@ -222,13 +277,19 @@ async def get_add_box_type_menu(message: types.Message) -> None:
     keyboard = BoxTypesKeyboard(box_type_names).build()
 
     return await message.answer(
-        str(tracked_box_types),
+        get_message_text_by_key("box_types_menu"),
         reply_markup=keyboard
     )
 
 
 @router.callback_query(F.data.startswith("bt:"))
-async def toggle_box_type(clbck: types.CallbackQuery) -> None:
+async def toggle_box_type(
+    clbck: types.CallbackQuery,
+    box_type_manager: BoxTypeManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+    keyboard_editor: KeyboardEditor,
+) -> None:
     box_type_name = clbck.data.split(":")[1].replace("📦 ", "")
     tracked_box_types = await box_type_manager.get_all()
 
@@ -240,9 +301,7 @@ async def toggle_box_type(clbck: types.CallbackQuery) -> None:
         action = "added to"
 
     # Update the keyboard
-    supply_data = await cache_manager.get("supply_data")
-    box_type_names = list(set(bt["boxTypeName"] for bt in supply_data))
-    box_type_names.sort(key=lambda x: re.sub(r'^СЦ\s+', '', x))
+    box_type_names = await list_box_types(catalog, supply_snapshot)
 
     tracked_box_types = await box_type_manager.get_all()
     box_type_names = [
@@ -250,19 +309,17 @@ async def toggle_box_type(clbck: types.CallbackQuery) -> None:
         for bt_name in box_type_names
     ]
 
-    new_keyboard = BoxTypesKeyboard(box_type_names).build()
-
-    await clbck.message.edit_text(
-        f"Box type {box_type_name} {action} tracking list. Select more box types:",
-        reply_markup=new_keyboard
-    )
-
+    keyboard_editor.edit(clbck.message, BoxTypesKeyboard(box_type_names).build())
     await clbck.answer(f"Box type {box_type_name} {action} tracking list")
 
 
 @router.message(F.text == Buttons.ADD_DATE_REPLY.value.text)
 @delete_previous_message("date")
-async def get_add_date_menu(message: types.Message) -> None:
+async def get_add_date_menu(
+    message: types.Message,
+    cache_manager: WildberriesCacheManager,
+    date_manager: DateManager,
+) -> None:
     tracked_dates = [RightDate.from_string(date) for date in await date_manager.get_all()]
 
     today = RightDate(datetime.datetime.today())
@@ -283,7 +340,11 @@ async def get_add_date_menu(message: types.Message) -> None:
 
 
 @router.callback_query(F.data.startswith("dt:"))
-async def toggle_date(clbck: types.CallbackQuery) -> None:
+async def toggle_date(
+    clbck: types.CallbackQuery,
+    date_manager: DateManager,
+    keyboard_editor: KeyboardEditor,
+) -> None:
     date_str = ":".join(clbck.data.split(":")[1:])
     tracked_date = RightDate.from_string(date_str)
     
@@ -308,14 +369,115 @@ async def toggle_date(clbck: types.CallbackQuery) -> None:
         for date in actual_dates
     ]
 
-    new_keyboard = DateKeyboard(marked_dates).build()
+    keyboard_editor.edit(clbck.message, DateKeyboard(marked_dates).build())
+    await clbck.answer(f"Date {tracked_date.display_date()} {action} tracking list")
+
 
-    await clbck.message.edit_text(
-        f"Date {tracked_date.display_date()} {action} tracking list. Select more dates:",
-        reply_markup=new_keyboard
+async def answer_search(
+    message: types.Message,
+    query: str,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    found = await search_warehouses(catalog, supply_snapshot, query, SEARCH_RESULTS_LIMIT)
+    if not found:
+        await message.answer(get_message_text_by_key("find_nothing"))
+        return
+
+    marked_warehouses = mark_tracked_warehouses(found, await tracked_warehouse_manager.get_all())
+    await message.answer(
+        get_message_text_by_key("find_results"),
+        reply_markup=WarehousesKeyboard(marked_warehouses, prefix="whf").build(),
     )
 
-    await clbck.answer(f"Date {tracked_date.display_date()} {action} tracking list")
+
+@router.message(Command(commands=["find"]))
+async def find_command(
+    message: types.Message,
+    command: CommandObject,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    if not command.args:
+        await message.answer(get_message_text_by_key("find_usage"))
+        return
+    await answer_search(message, command.args, tracked_warehouse_manager, supply_snapshot, catalog)
+
+
+@router.callback_query(F.data.startswith("whf:"))
+async def toggle_found_warehouse(
+    clbck: types.CallbackQuery,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+    keyboard_editor: KeyboardEditor,
+) -> None:
+    """Toggles a warehouse from search results and re-marks just the warehouses shown there"""
+    warehouse_id = int(clbck.data.split(":")[1])
+    warehouse_name = await find_warehouse_name(catalog, supply_snapshot, warehouse_id)
+    if warehouse_name is None:
+        await clbck.answer("Unknown warehouse")
+        return
+
+    action = await toggle_tracking(tracked_warehouse_manager, WarehouseShort(id=warehouse_id, name=warehouse_name))
+
+    # messages sent through inline mode to other chats are not accessible, they show one warehouse
+    reply_markup = getattr(clbck.message, "reply_markup", None)
+    if reply_markup is not None:
+        shown = [
+            WarehouseShort(id=int(button.callback_data.split(":")[1]), name=button.text.removeprefix("🏫 "))
+            for row in reply_markup.inline_keyboard
+            for button in row
+        ]
+    else:
+        shown = [WarehouseShort(id=warehouse_id, name=warehouse_name)]
+    keyboard = WarehousesKeyboard(
+        mark_tracked_warehouses(shown, await tracked_warehouse_manager.get_all()),
+        prefix="whf",
+    ).build()
+
+    if reply_markup is not None:
+        keyboard_editor.edit(clbck.message, keyboard)
+    elif clbck.inline_message_id:
+        await clbck.bot.edit_message_reply_markup(inline_message_id=clbck.inline_message_id, reply_markup=keyboard)
+    await clbck.answer(f"Warehouse {warehouse_name} {action} tracking list")
+
+
+@router.inline_query()
+async def inline_find(
+    inline_query: types.InlineQuery,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    if inline_query.query.strip():
+        found = await search_warehouses(catalog, supply_snapshot, inline_query.query, INLINE_RESULTS_LIMIT)
+    else:
+        found = (await list_warehouses(catalog, supply_snapshot))[:INLINE_RESULTS_LIMIT]
+
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(wh.id),
+            title=wh.name,
+            description=getattr(wh, "address", None) or None,
+            input_message_content=types.InputTextMessageContent(message_text=wh.name),
+            reply_markup=WarehousesKeyboard([wh], prefix="whf").build(),
+        )
+        for wh in found
+    ]
+    await inline_query.answer(results, cache_time=10)
+
+
+# Registered last so buttons, commands and the coefficient prompt take precedence
+@router.message(F.text, ~F.text.startswith("/"))
+async def search_by_text(
+    message: types.Message,
+    tracked_warehouse_manager: TrackedWarehouseManager,
+    supply_snapshot: SupplySnapshot,
+    catalog: Catalog,
+) -> None:
+    await answer_search(message, message.text, tracked_warehouse_manager, supply_snapshot, catalog)
 
 
 __all__ = ['router']
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from app.metrics import KEYBOARD_EDITS
+
+
+logger = logging.getLogger(__name__)
+
+MessageKey = tuple[int, int]
+
+
+def dump_markup(markup: InlineKeyboardMarkup | None) -> list | None:
+    """What Telegram compares, the rows of button texts and their data"""
+    if markup is None:
+        return None
+    return [
+        [(button.text, button.callback_data, button.url) for button in row]
+        for row in markup.inline_keyboard
+    ]
+
+
+class KeyboardEditor:
+    """Applies keyboard changes to sent messages with the smallest edit that does it.
+
+    Remembers the text and markup last shown per message. An edit that changes
+    neither is skipped, one that only changes buttons goes out as
+    edit_message_reply_markup without the text. The first edit of a message goes
+    out right away, edits requested while it is in flight or within debounce
+    seconds after it are coalesced, only the newest one is sent once the window ends.
+    """
+
+    def __init__(self, debounce: float = 0.3, max_messages: int = 1024):
+        self.debounce = debounce
+        self.max_messages = max_messages
+        # message -> (text, dumped markup) as last shown
+        self._shown: OrderedDict[MessageKey, tuple[str | None, list | None]] = OrderedDict()
+        # message -> (message, text, parse mode, markup) to apply next
+        self._wanted: dict[MessageKey, tuple[Message, str | None, str | None, InlineKeyboardMarkup]] = {}
+        self._tasks: dict[MessageKey, asyncio.Task] = {}
+
+    def edit(
+        self,
+        message: Message,
+        reply_markup: InlineKeyboardMarkup,
+        text: str | None = None,
+        parse_mode: str | None = None,
+    ) -> None:
+        """Schedules the edit, text None keeps the text of the message"""
+        key = (message.chat.id, message.message_id)
+        if key in self._wanted:
+            KEYBOARD_EDITS.inc(kind="coalesced")
+        self._wanted[key] = (message, text, parse_mode, reply_markup)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._apply_later(key))
+
+    async def _apply_later(self, key: MessageKey) -> None:
+        try:
+            # clicks during an edit in flight or the window after it are sent when the window ends
+            while key in self._wanted:
+                await self._apply(key)
+                await asyncio.sleep(self.debounce)
+        finally:
+            del self._tasks[key]
+
+    async def _apply(self, key: MessageKey) -> None:
+        message, text, parse_mode, reply_markup = self._wanted.pop(key)
+        # a message not edited yet is compared to how it looked when the button was clicked
+        shown_text, shown_markup = self._shown.get(key) or (message.text, dump_markup(message.reply_markup))
+        wanted_markup = dump_markup(reply_markup)
+        new_text = text if text is not None and text != shown_text else None
+
+        if new_text is None and wanted_markup == shown_markup:
+            KEYBOARD_EDITS.inc(kind="skipped")
+            return
+        try:
+            if new_text is None:
+                await message.edit_reply_markup(reply_markup=reply_markup)
+                KEYBOARD_EDITS.inc(kind="markup")
+            else:
+                await message.edit_text(new_text, parse_mode=parse_mode, reply_markup=reply_markup)
+                KEYBOARD_EDITS.inc(kind="text")
+        except TelegramBadRequest as e:
+            # the message changed elsewhere, e.g. another worker, it does show what we wanted
+            if "message is not modified" not in str(e):
+                logger.error(f"Failed to edit keyboard of message {key[1]} in chat {key[0]}: {e}")
+                self._shown.pop(key, None)
+                return
+        except Exception as e:
+            logger.error(f"Failed to edit keyboard of message {key[1]} in chat {key[0]}: {e}")
+            self._shown.pop(key, None)
+            return
+
+        self._shown[key] = (new_text if new_text is not None else shown_text, wanted_markup)
+        self._shown.move_to_end(key)
+        while len(self._shown) > self.max_messages:
+            self._shown.popitem(last=False)
+
+    async def close(self) -> None:
+        """Sends the edits still waiting for the end of their debounce window"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
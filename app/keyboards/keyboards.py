@@ -122,10 +122,11 @@ class DeletePostKeyboard(BaseKeyboard):
 
 class WarehousesKeyboard(BaseKeyboard):
     def __init__(self,
-        warehouses: list[WarehouseShort]
+        warehouses: list[WarehouseShort],
+        prefix: str = "wh",
     ):
         buttons = [
-            Button(wh.name, f"wh:{wh.id}", ButtonType.INLINE)
+            Button(wh.name, f"{prefix}:{wh.id}", ButtonType.INLINE)
             for wh in warehouses
         ]
         super().__init__(KeyboardConfig(button_keys=buttons, adjust=(1, 2)))
@@ -151,6 +152,28 @@ class DateKeyboard(BaseKeyboard):
         super().__init__(KeyboardConfig(button_keys=buttons, adjust=(3,)))
 
 
+class SupplyMatrixKeyboard(BaseKeyboard):
+    def __init__(self,
+        box_types: list[str],
+        box_type_index: int,
+        page: int,
+        pages: int,
+    ):
+        buttons = [
+            Button(f"• {name}" if i == box_type_index else name, f"sm:{i}:0", ButtonType.INLINE)
+            for i, name in enumerate(box_types)
+        ]
+        rows = [2] * (len(box_types) // 2) + [1] * (len(box_types) % 2)
+        if pages > 1:
+            buttons += [
+                Button("◀", f"sm:{box_type_index}:{(page - 1) % pages}", ButtonType.INLINE),
+                Button(f"{page + 1}/{pages}", f"sm:{box_type_index}:{page}", ButtonType.INLINE),
+                Button("▶", f"sm:{box_type_index}:{(page + 1) % pages}", ButtonType.INLINE),
+            ]
+            rows.append(3)
+        super().__init__(KeyboardConfig(button_keys=buttons, adjust=tuple(rows)))
+
+
 class AddTrackingItemsMenuKeyboard(BaseKeyboard):
     def __init__(self,
         coefficient: int | None,
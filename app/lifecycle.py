@@ -0,0 +1,42 @@
+import asyncio
+import logging
+
+from typing import Awaitable
+
+
+logger = logging.getLogger(__name__)
+
+
+async def cancel_tasks(*tasks: asyncio.Task | None) -> None:
+    """Cancels tasks and waits until they are done, ignoring None"""
+    tasks = [task for task in tasks if task is not None]
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Task {task.get_name()} failed while stopping: {e}")
+
+
+async def first_completed(*awaitables: Awaitable) -> None:
+    """Waits until one of awaitables is done and cancels the rest, e.g. a sleep or a stop event"""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        await cancel_tasks(*tasks)
+
+
+async def drain(tasks: list[asyncio.Task | None], timeout: float, what: str) -> None:
+    """Gives tasks up to timeout seconds to finish on their own, then cancels them"""
+    tasks = [task for task in tasks if task is not None]
+    pending = {task for task in tasks if not task.done()}
+    if pending:
+        _, pending = await asyncio.wait(pending, timeout=timeout)
+    if pending:
+        logger.warning(f"{what} did not finish within {timeout:g}s, cancelling")
+    # also collects results, errors of finished tasks are logged rather than lost
+    await cancel_tasks(*tasks)
@@ -1,29 +1,74 @@
 import asyncio
 import logging
 import os
+import signal
 
 from dotenv import load_dotenv
-from app.api_monitor import WildberriesSupplyAPIMonitor
-from app.bot import TelegramBot
-from app.config import Config
+from app.broker import BROKER_MEMORY, BROKER_SQLITE, create_broker
+from app.config import Config, configure_logging
+from app.lifecycle import cancel_tasks
+from app.metrics import MetricsExporter
+from app.profiling import profiler
+from app.workers import pool
+
+# Role modules (app.api_monitor, app.bot with the whole aiogram stack) are
+# imported where the role starts, so a process only pays for what it runs.
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+MODE_ALL = "all"
+MODE_MONITOR = "monitor"
+MODE_BOT = "bot"
+
+
 class Service:
     def __init__(self):
         load_dotenv()
         self.monitor = None
         self.bot = None
+        self.role_tasks: list[asyncio.Task] = []
+        self.stopping = False
+
+        self.mode = os.getenv("SERVICE_MODE", MODE_ALL)
+        if self.mode not in (MODE_ALL, MODE_MONITOR, MODE_BOT):
+            raise ValueError(f"Unknown SERVICE_MODE '{self.mode}'")
+        # monitor and bot in one process can talk in memory, separate processes share the SQLite file
+        broker_kind = os.getenv("BROKER", BROKER_MEMORY if self.mode == MODE_ALL else BROKER_SQLITE)
+        if broker_kind == BROKER_MEMORY and self.mode != MODE_ALL:
+            raise ValueError(f"BROKER={BROKER_MEMORY} only works with SERVICE_MODE={MODE_ALL}")
+        self.broker = create_broker(broker_kind, Config.db_path)
 
     async def start_monitor(self):
+        from app.api_monitor import WildberriesSupplyAPIMonitor
+        from app.catalog import Catalog
+        from app.cluster import LEASE_MONITOR, LeaderElection
+        from app.db.db import CatalogManager, LeaseManager
+        from app.recording import SnapshotRecorder
+        from app.wb_api import WildberriesAPIClient
+
         token = os.getenv("WB_SUPPLY_API_TOKEN")
         api_url = os.getenv("WB_SUPPLY_API_URL")
         requests_per_minute = 6
-        self.monitor = WildberriesSupplyAPIMonitor(token, api_url, Config.db_path, requests_per_minute)
-        await self.monitor.run()
+        leader = LeaderElection(LeaseManager(Config.db_path), LEASE_MONITOR)
+        # one session and per-endpoint rate limits for everything the monitor fetches
+        api = WildberriesAPIClient.from_env(coefficients_requests_per_minute=requests_per_minute)
+        self.monitor = WildberriesSupplyAPIMonitor(
+            token, api_url, Config.db_path, requests_per_minute,
+            broker=self.broker,
+            leader=leader,
+            catalog=Catalog.from_env(CatalogManager(Config.db_path), api=api, broker=self.broker),
+            recorder=SnapshotRecorder.from_env(),
+            api=api,
+        )
+        if not self.stopping:
+            await self.monitor.run()
 
     async def start_bot(self):
+        from app.booking import BookingPipeline
+        from app.bot import TelegramBot
+        from app.db.db import BookingManager
+        from app.webhook import WebhookSettings
+
         BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
         DB_PATH = Config.db_path
         CHAT_IDS = os.getenv("RECIEVER_IDS").split(",")
@@ -32,37 +77,84 @@ class Service:
             logger.error("Bot token not found in environment variables")
             return
 
-        self.bot = TelegramBot(BOT_TOKEN, DB_PATH, CHAT_IDS)
-        await self.bot.run()
+        self.bot = TelegramBot(
+            BOT_TOKEN, DB_PATH, CHAT_IDS,
+            broker=self.broker,
+            workers=int(os.getenv("BOT_WORKERS", 1)),
+            worker_index=int(os.getenv("BOT_WORKER_INDEX", 0)),
+            webhook_settings=WebhookSettings.from_env(),
+            booking_pipeline=BookingPipeline.from_env(BookingManager(DB_PATH)),
+        )
+        if not self.stopping:
+            await self.bot.run()
+
+    def request_shutdown(self, signum: int) -> None:
+        """First signal stops the roles gracefully, a second one cancels them"""
+        if self.stopping:
+            logger.warning(f"{signal.Signals(signum).name} received again, cancelling")
+            for task in self.role_tasks:
+                task.cancel()
+            return
+
+        logger.info(f"{signal.Signals(signum).name} received, shutting down gracefully")
+        self.stopping = True
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self.bot is not None:
+            self.bot.stop()
 
     async def run_all(self):
-        logger.info("Starting Wildberries Supply Monitoring and Notification System")
-        monitor_task = asyncio.create_task(self.start_monitor())
-        bot_task = asyncio.create_task(self.start_bot())
+        logger.info(f"Starting Wildberries Supply Monitoring and Notification System, mode: {self.mode}")
+        profiler.configure_from_env()
+        profiler.start()
+        # spawning worker processes takes a while, do it while the roles start
+        pool.start()
+        await self.broker.initialize()
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.request_shutdown, signum)
+
+        if self.mode in (MODE_ALL, MODE_MONITOR):
+            self.role_tasks.append(asyncio.create_task(self.start_monitor()))
+        if self.mode in (MODE_ALL, MODE_BOT):
+            self.role_tasks.append(asyncio.create_task(self.start_bot()))
+        metrics_exporter = MetricsExporter.from_env()
+        exporter_task = asyncio.create_task(metrics_exporter.run()) if metrics_exporter is not None else None
 
         try:
-            await asyncio.gather(monitor_task, bot_task)
+            # roles return once they drained after request_shutdown
+            await asyncio.gather(*self.role_tasks)
         except asyncio.CancelledError:
             logger.info("Shutting down...")
         finally:
-            for task in [monitor_task, bot_task]:
-                if not task.done():
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
+            await cancel_tasks(*(task for task in self.role_tasks if not task.done()), exporter_task)
 
+            await self.broker.close()
+            pool.shutdown()
+            profiler.stop()
             logger.info("Shutdown complete")
 
+    async def run_role(self, start_role) -> None:
+        """Runs a single role, e.g. start_monitor, with the profiler of run_all but without signal handling"""
+        profiler.configure_from_env()
+        profiler.start()
+        try:
+            await self.broker.initialize()
+            await start_role()
+        finally:
+            await self.broker.close()
+            profiler.stop()
+
 async def test_monitor():
     service = Service()
-    await service.start_monitor()
+    await service.run_role(service.start_monitor)
 
 async def test_bot():
     service = Service()
-    await service.start_bot()
+    await service.run_role(service.start_bot)
 
 if __name__ == "__main__":
+    configure_logging()
     service = Service()
     asyncio.run(service.run_all())
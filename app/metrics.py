@@ -0,0 +1,292 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 5e7)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict) -> tuple[tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(header + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: counts per bucket (non cumulative, last one is +Inf), sum
+        self.values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = key + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+WB_API_REQUEST_SECONDS = REGISTRY.histogram(
+    "wb_api_request_seconds", "Latency of Wildberries API requests", ("endpoint",)
+)
+WB_API_RESPONSES = REGISTRY.counter(
+    "wb_api_responses_total", "Wildberries API responses by status code", ("endpoint", "status")
+)
+WB_API_PAYLOAD_BYTES = REGISTRY.histogram(
+    "wb_api_payload_bytes", "Size of Wildberries API response bodies", ("endpoint",), buckets=SIZE_BUCKETS
+)
+WB_API_PARSE_SECONDS = REGISTRY.histogram(
+    "wb_api_parse_seconds", "Time spent decoding Wildberries API responses", ("endpoint",)
+)
+SNAPSHOT_ROWS = REGISTRY.gauge(
+    "wb_snapshot_rows", "Rows in the latest coefficients snapshot"
+)
+CACHE_VALUE_BYTES = REGISTRY.gauge(
+    "cache_value_bytes", "Stored size of the latest value of a cache key", ("key",)
+)
+CACHE_MEMORY_LOOKUPS = REGISTRY.counter(
+    "cache_memory_lookups_total", "Lookups of the in-process cache by result", ("result",)
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Latency of database manager methods", ("manager", "method")
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Latency of bot handlers", ("handler",)
+)
+NOTIFICATION_FANOUT_SECONDS = REGISTRY.histogram(
+    "bot_notification_fanout_seconds", "Time to send one notification to all chats"
+)
+TELEGRAM_MESSAGES_SENT = REGISTRY.counter(
+    "bot_telegram_messages_sent_total", "Notifications delivered to Telegram"
+)
+TELEGRAM_SEND_FAILURES = REGISTRY.counter(
+    "bot_telegram_send_failures_total", "Notifications Telegram refused or failed to deliver"
+)
+ANTIFLOOD_DROPPED = REGISTRY.counter(
+    "bot_antiflood_dropped_total", "Updates dropped by the anti-flood middleware by reason", ("reason",)
+)
+KEYBOARD_EDITS = REGISTRY.counter(
+    "bot_keyboard_edits_total", "Inline keyboard edits by kind: markup, text, skipped or coalesced", ("kind",)
+)
+SLOT_ALERT_LATENCY_SECONDS = REGISTRY.histogram(
+    "bot_slot_alert_latency_seconds",
+    "Time from the first snapshot containing a matching slot to the alert being sent",
+)
+BOOKING_ATTEMPTS = REGISTRY.counter(
+    "booking_attempts_total", "Auto-booking attempts by outcome", ("status",)
+)
+BOOKING_REQUEST_SECONDS = REGISTRY.histogram(
+    "booking_request_seconds", "Latency of booking client calls"
+)
+BOOKING_LATENCY_SECONDS = REGISTRY.histogram(
+    "booking_latency_seconds", "Time from the snapshot being fetched to the booking request being sent"
+)
+SCHEDULER_RUNS = REGISTRY.counter(
+    "scheduler_runs_total", "Scheduled job runs by result: ok, error, cancelled or missed", ("job", "result")
+)
+SCHEDULER_RUN_SECONDS = REGISTRY.histogram(
+    "scheduler_run_seconds", "Duration of scheduled job runs", ("job",)
+)
+SCHEDULER_START_DELAY_SECONDS = REGISTRY.histogram(
+    "scheduler_start_delay_seconds", "How late scheduled runs start, jitter included", ("job",)
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late the event loop wakes up a sleeping heartbeat task"
+)
+
+
+def observe_query(func):
+    """Records latency of a DatabaseManager method labelled with manager and method name"""
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(
+                time.perf_counter() - started,
+                manager=type(self).__name__,
+                method=func.__name__,
+            )
+    return wrapper
+
+
+class MetricsExporter:
+    """Serves REGISTRY over HTTP and/or writes it to a textfile for node_exporter"""
+
+    def __init__(
+        self,
+        port: int | None = None,
+        host: str = "127.0.0.1",
+        textfile: str | Path | None = None,
+        textfile_interval: float = 15,
+    ):
+        self.port = port
+        self.host = host
+        self.textfile = Path(textfile) if textfile else None
+        self.textfile_interval = textfile_interval
+
+    @classmethod
+    def from_env(cls) -> "MetricsExporter | None":
+        port = os.getenv("METRICS_PORT")
+        textfile = os.getenv("METRICS_TEXTFILE")
+        if not port and not textfile:
+            return None
+        return cls(
+            port=int(port) if port else None,
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            textfile=textfile,
+            textfile_interval=float(os.getenv("METRICS_TEXTFILE_INTERVAL", 15)),
+        )
+
+    def write_textfile(self) -> None:
+        tmp_path = self.textfile.with_suffix(self.textfile.suffix + ".tmp")
+        tmp_path.write_text(REGISTRY.render(), encoding="utf-8")
+        tmp_path.replace(self.textfile)
+
+    async def serve(self) -> None:
+        from aiohttp import web
+
+        async def handle_metrics(request: web.Request) -> web.Response:
+            return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def write_periodically(self) -> None:
+        while True:
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logger.error(f"Failed to write metrics textfile: {e}")
+            await asyncio.sleep(self.textfile_interval)
+
+    async def run(self) -> None:
+        tasks = []
+        if self.port:
+            tasks.append(self.serve())
+        if self.textfile:
+            tasks.append(self.write_periodically())
+        await asyncio.gather(*tasks)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from app.metrics import ANTIFLOOD_DROPPED
+from app.utils.messages.messages import get_message_text_by_key
+
+
+logger = logging.getLogger(__name__)
+
+# state of idle users and chats is dropped once there is this much of it
+MAX_TRACKED = 4096
+
+
+class TokenBucket:
+    """Per-key token buckets refilled at rate tokens per second up to burst"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        # key -> (tokens, updated_at)
+        self._buckets: dict[Hashable, tuple[float, float]] = {}
+
+    def take(self, key: Hashable, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > MAX_TRACKED:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now: float) -> None:
+        # a bucket that refilled completely is the same as no bucket
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < full_after
+        }
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """Outer middleware protecting the database and the loop from a single noisy user.
+
+    Events beyond rate per second (after a burst) of one user are dropped, a
+    callback with the same data on the same message within duplicate_window
+    seconds is dropped as a double tap, and events of one chat are handled one
+    at a time so toggles never race on the tracked tables. Dropped callbacks
+    are still answered so the button stops spinning. rate=0 disables the limit.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 10, duplicate_window: float = 0.5):
+        self.buckets = TokenBucket(rate, burst) if rate > 0 else None
+        self.duplicate_window = duplicate_window
+        # (user, message, data) -> when it was last accepted
+        self._callbacks: dict[tuple, float] = {}
+        # chat -> (lock, events holding or waiting for it)
+        self._chats: dict[int, tuple[asyncio.Lock, int]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            if self.buckets is not None and not self.buckets.take(user.id):
+                return await self._drop(event, "rate")
+            if isinstance(event, CallbackQuery) and self._is_duplicate(user.id, event):
+                return await self._drop(event, "duplicate")
+
+        chat = data.get("event_chat")
+        if chat is None:
+            return await handler(event, data)
+        async with self._serialized(chat.id):
+            return await handler(event, data)
+
+    def _is_duplicate(self, user_id: int, callback: CallbackQuery) -> bool:
+        now = time.monotonic()
+        message_id = callback.message.message_id if callback.message is not None else callback.inline_message_id
+        key = (user_id, message_id, callback.data)
+        last = self._callbacks.get(key)
+        if last is not None and now - last < self.duplicate_window:
+            return True
+        self._callbacks[key] = now
+        if len(self._callbacks) > MAX_TRACKED:
+            self._callbacks = {
+                key: seen for key, seen in self._callbacks.items()
+                if now - seen < self.duplicate_window
+            }
+        return False
+
+    async def _drop(self, event: TelegramObject, reason: str) -> None:
+        ANTIFLOOD_DROPPED.inc(reason=reason)
+        if isinstance(event, CallbackQuery):
+            text = get_message_text_by_key("too_many_requests") if reason == "rate" else None
+            try:
+                await event.answer(text)
+            except Exception as e:
+                logger.debug(f"Failed to answer dropped callback: {e}")
+
+    @asynccontextmanager
+    async def _serialized(self, chat_id: int):
+        lock, waiting = self._chats.get(chat_id) or (asyncio.Lock(), 0)
+        self._chats[chat_id] = (lock, waiting + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            # forget the lock once nobody holds or waits for it
+            lock, waiting = self._chats[chat_id]
+            if waiting == 1:
+                del self._chats[chat_id]
+            else:
+                self._chats[chat_id] = (lock, waiting - 1)
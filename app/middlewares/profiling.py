@@ -0,0 +1,23 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.profiling import profiler
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Inner middleware, wraps the matched handler into a profiler section"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not profiler.enabled:
+            return await handler(event, data)
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        async with profiler.section(f"handler.{name}"):
+            return await handler(event, data)
@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from contextlib import asynccontextmanager
+from functools import wraps
+from pathlib import Path
+
+from app import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_SAMPLE = "sample"
+MODE_DETERMINISTIC = "deterministic"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the stack of one thread and aggregates it in the collapsed (flamegraph.pl) format"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            with self._lock:
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def drain(self) -> collections.Counter[str]:
+        with self._lock:
+            stacks, self.stacks = self.stacks, collections.Counter()
+        return stacks
+
+
+class LoopWatchdog:
+    """Reports the loop thread stack whenever the event loop stays blocked longer than threshold"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, threshold: float):
+        self.loop = loop
+        self.thread_id = thread_id
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.blocked_reports: list[dict] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._heartbeat_task: asyncio.Task | None = None
+
+    async def _heartbeat(self) -> None:
+        interval = self.threshold / 2
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            metrics.EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self.last_beat = now
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 4):
+            beat = self.last_beat
+            blocked_for = time.monotonic() - beat
+            if blocked_for < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            frame = sys._current_frames().get(self.thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.blocked_reports.append({"at": time.time(), "blocked_for": blocked_for, "stack": stack})
+            logger.warning(f"Event loop blocked for {blocked_for * 1000:.0f} ms, loop thread stack:\n{stack}")
+
+    def start(self) -> None:
+        self._heartbeat_task = self.loop.create_task(self._heartbeat())
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    def drain(self) -> list[dict]:
+        reports, self.blocked_reports = self.blocked_reports, []
+        return reports
+
+
+class Profiler:
+    """Opt-in profiling, configured with PROFILE_* environment variables.
+
+    PROFILE_MODE is off, sample (periodic stack sampling, flamegraph-ready
+    collapsed stacks) or deterministic (cProfile, .prof files). Independently
+    of the mode PROFILE_SLOW_CALLBACK_MS enables the event loop watchdog.
+    """
+
+    def __init__(self):
+        self.mode = MODE_OFF
+        self.output_dir = Path("profiles")
+        self.dump_interval = 60.0
+        self.sample_interval = 0.005
+        self.slow_callback = None
+        self.sections: dict[str, dict] = {}
+
+        self._sampler: StackSampler | None = None
+        self._cprofile: cProfile.Profile | None = None
+        self._watchdog: LoopWatchdog | None = None
+        self._dump_task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != MODE_OFF or self.slow_callback is not None
+
+    def configure_from_env(self) -> None:
+        self.mode = os.getenv("PROFILE_MODE", MODE_OFF).lower()
+        if self.mode not in (MODE_OFF, MODE_SAMPLE, MODE_DETERMINISTIC):
+            raise ValueError(f"Unknown PROFILE_MODE '{self.mode}'")
+        self.output_dir = Path(os.getenv("PROFILE_DIR", "profiles"))
+        self.dump_interval = float(os.getenv("PROFILE_DUMP_INTERVAL", 60))
+        self.sample_interval = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000
+        slow_callback_ms = os.getenv("PROFILE_SLOW_CALLBACK_MS")
+        self.slow_callback = float(slow_callback_ms) / 1000 if slow_callback_ms else None
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        thread_id = threading.get_ident()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.mode == MODE_SAMPLE:
+            self._sampler = StackSampler(thread_id, self.sample_interval)
+            self._sampler.start()
+        elif self.mode == MODE_DETERMINISTIC:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        if self.slow_callback is not None:
+            self._watchdog = LoopWatchdog(loop, thread_id, self.slow_callback)
+            self._watchdog.start()
+
+        self._dump_task = loop.create_task(self._dump_periodically())
+        logger.info(f"Profiling enabled: mode={self.mode}, slow_callback={self.slow_callback}, dir={self.output_dir}")
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+        self.dump()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._watchdog is not None:
+            self._watchdog.stop()
+
+    async def _dump_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except OSError as e:
+                logger.error(f"Failed to dump profile: {e}")
+
+    def dump(self) -> None:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+
+        if self._sampler is not None:
+            stacks = self._sampler.drain()
+            with open(self.output_dir / f"stacks-{stamp}.txt", "w", encoding="utf-8") as file:
+                for stack, count in stacks.items():
+                    file.write(f"{stack} {count}\n")
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.output_dir / f"profile-{stamp}.prof")
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        report = {"sections": self.sections}
+        if self._watchdog is not None:
+            report["blocked"] = self._watchdog.drain()
+        with open(self.output_dir / f"sections-{stamp}.json", "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        self.sections = {}
+
+    def record(self, name: str, duration: float) -> None:
+        section = self.sections.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+        section["calls"] += 1
+        section["total"] += duration
+        section["max"] = max(section["max"], duration)
+        if self.slow_callback is not None and duration > self.slow_callback:
+            logger.info(f"Slow section {name}: {duration * 1000:.0f} ms")
+
+    @asynccontextmanager
+    async def section(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+
+profiler = Profiler()
+
+
+def profiled(name: str):
+    """Wraps a coroutine function into a profiler section, no-op unless profiling is enabled"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with profiler.section(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from app.workers import WorkerPool, pool
+
+
+logger = logging.getLogger(__name__)
+
+RECORDING_PREFIX = "snapshots-"
+RECORDING_SUFFIX = ".jsonl.gz"
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+DEFAULT_KEEP = 20
+
+
+def append_record(path: str, fetched_at: float, status: int, body: bytes | None) -> int:
+    """Appends one response as a JSON line to a gzip file and returns the file size.
+
+    Runs in the worker pool. The body is kept as a string so truncated or
+    otherwise broken responses are recorded as they came.
+    """
+    record = {
+        "fetched_at": fetched_at,
+        "status": status,
+        "body": body.decode(errors="replace") if body is not None else None,
+    }
+    # every append is a gzip member of its own, gzip readers concatenate them
+    with gzip.open(path, "ab", compresslevel=6) as recording:
+        recording.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+    return os.path.getsize(path)
+
+
+def recording_files(paths: Iterable[str | Path]) -> list[Path]:
+    """Recording files in recording order, directories are expanded"""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(path.glob(f"{RECORDING_PREFIX}*{RECORDING_SUFFIX}")))
+        else:
+            files.append(path)
+    return files
+
+
+def read_records(paths: Iterable[str | Path]) -> Iterator[dict]:
+    for path in recording_files(paths):
+        with gzip.open(path, "rt", encoding="utf-8") as recording:
+            for line in recording:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class SnapshotRecorder:
+    """Records every coefficients response with its timestamp to rotating gzip JSONL files.
+
+    Writing happens in the background in the worker pool, in the order the
+    responses arrived, so the poll does not wait for compression. A file is
+    rotated once it is max_bytes large and only the newest keep files stay,
+    keep=0 keeps all of them.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        keep: int = DEFAULT_KEEP,
+        worker_pool: WorkerPool = pool,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.worker_pool = worker_pool
+        self._current: Path | None = None
+        self._lock = asyncio.Lock()
+        self._pending: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls) -> "SnapshotRecorder | None":
+        """None unless RECORD_DIR is set"""
+        directory = os.getenv("RECORD_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_bytes=int(os.getenv("RECORD_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            keep=int(os.getenv("RECORD_KEEP", DEFAULT_KEEP)),
+        )
+
+    def record(self, fetched_at: float, status: int, body: bytes | None = None) -> None:
+        task = asyncio.create_task(self._write(fetched_at, status, body))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _write(self, fetched_at: float, status: int, body: bytes | None) -> None:
+        # asyncio.Lock wakes waiters first come first served, records stay in order
+        async with self._lock:
+            try:
+                if self._current is None:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(fetched_at))
+                    self._current = self.directory / f"{RECORDING_PREFIX}{stamp}{RECORDING_SUFFIX}"
+                size = await self.worker_pool.run(append_record, str(self._current), fetched_at, status, body)
+            except Exception as e:
+                logger.error(f"Failed to record response: {e}")
+                return
+
+            if size >= self.max_bytes:
+                self._current = None
+                self._prune()
+
+    def _prune(self) -> None:
+        if self.keep <= 0:
+            return
+        for path in recording_files([self.directory])[:-self.keep]:
+            logger.info(f"Removing old recording {path}")
+            path.unlink(missing_ok=True)
+
+    async def close(self) -> None:
+        """Waits for the records still being written"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
@@ -0,0 +1,167 @@
+import datetime
+import logging
+import shlex
+
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+from app.config import Config
+from app.db.db import (
+    WildberriesCacheManager,
+    TrackedWarehouseManager,
+    BoxTypeManager,
+    DateManager,
+    RuleManager,
+)
+from app.dto import Rule, WarehouseShort
+from app.snapshots import SupplySnapshot
+
+
+logger = logging.getLogger(__name__)
+
+RULE_SYNTAX = "wh=<id or name> bt=<box type> below=<n> free drop=<n> quiet=<hour>-<hour> book"
+
+
+def in_quiet_hours(rule: Rule, now: datetime.datetime) -> bool:
+    if rule.quiet_start is None or rule.quiet_end is None:
+        return False
+    if rule.quiet_start <= rule.quiet_end:
+        return rule.quiet_start <= now.hour < rule.quiet_end
+    return now.hour >= rule.quiet_start or now.hour < rule.quiet_end
+
+
+def tracking_rules(
+    warehouses: list[WarehouseShort],
+    box_types: list[str],
+    dates: list[str],
+    coefficient: int | None,
+) -> list[Rule]:
+    """The tracking menus as rules: tracked warehouses and box types below the global coefficient.
+
+    Nothing is tracked until a coefficient and at least one date are chosen.
+    """
+    if coefficient is None or not dates:
+        return []
+    return [
+        Rule(warehouse_id=warehouse.id, box_type=box_type, coefficient_less=coefficient, tracked_dates=True)
+        for warehouse in warehouses
+        for box_type in box_types
+    ]
+
+
+def decision_table(rules: list[Rule]) -> list[tuple]:
+    """Rows in the layout of api_data_processor.RULE_COLUMNS, cheap to send to the worker pool"""
+    return [
+        (
+            rule.id, rule.warehouse_id, rule.box_type, rule.coefficient_less,
+            rule.free_only, rule.drop_by, rule.book, rule.tracked_dates,
+        )
+        for rule in rules
+    ]
+
+
+def parse_hour(value: str) -> int:
+    hour = int(value)
+    if not 0 <= hour <= 23:
+        raise ValueError(f"Hour '{value}' is not within 0-23")
+    return hour
+
+
+def parse_rule(text: str, resolve_warehouse: Callable[[str], int | None]) -> Rule:
+    """Parses RULE_SYNTAX, resolve_warehouse maps a warehouse name to its id"""
+    fields = {}
+    for token in shlex.split(text):
+        key, _, value = token.partition("=")
+        if key == "free" and not value:
+            fields["free_only"] = True
+        elif key == "book" and not value:
+            fields["book"] = True
+        elif key == "wh" and value:
+            warehouse_id = int(value) if value.isdigit() else resolve_warehouse(value)
+            if warehouse_id is None:
+                raise ValueError(f"Warehouse '{value}' not found")
+            fields["warehouse_id"] = warehouse_id
+        elif key == "bt" and value:
+            fields["box_type"] = value
+        elif key == "below" and value:
+            fields["coefficient_less"] = int(value)
+        elif key == "drop" and value:
+            fields["drop_by"] = int(value)
+        elif key == "quiet" and value:
+            start, _, end = value.partition("-")
+            fields["quiet_start"], fields["quiet_end"] = parse_hour(start), parse_hour(end)
+        else:
+            raise ValueError(f"Unknown rule option '{token}'")
+
+    rule = Rule(**fields)
+    if not rule.free_only and rule.coefficient_less is None and rule.drop_by is None:
+        raise ValueError("A rule needs at least one of below=, free or drop=")
+    return rule
+
+
+def describe_rule(rule: Rule, warehouse_name: Callable[[int], str | None]) -> str:
+    parts = [
+        warehouse_name(rule.warehouse_id) or str(rule.warehouse_id) if rule.warehouse_id is not None else "any warehouse",
+        rule.box_type or "any box type",
+    ]
+    if rule.free_only:
+        parts.append("free only")
+    if rule.coefficient_less is not None:
+        parts.append(f"coefficient < {rule.coefficient_less}")
+    if rule.drop_by is not None:
+        parts.append(f"drops by {rule.drop_by}+")
+    if rule.quiet_start is not None:
+        parts.append(f"quiet {rule.quiet_start}:00-{rule.quiet_end}:00")
+    if rule.book:
+        parts.append("auto-book")
+    return f"#{rule.id}: " + ", ".join(parts)
+
+
+class RulesEngine:
+    """Decides which slots of the current snapshot to notify about.
+
+    Rules are the ones added with /rule plus the tracking menus expressed as
+    rules. Quiet hours are applied per rule before evaluation, the rest runs
+    vectorized over the snapshot in the worker pool.
+    """
+
+    def __init__(
+        self,
+        rule_manager: RuleManager,
+        cache_manager: WildberriesCacheManager,
+        tracked_warehouse_manager: TrackedWarehouseManager,
+        box_type_manager: BoxTypeManager,
+        date_manager: DateManager,
+        supply_snapshot: SupplySnapshot,
+        timezone: str = Config.rules_timezone,
+    ):
+        self.rule_manager = rule_manager
+        self.cache_manager = cache_manager
+        self.tracked_warehouse_manager = tracked_warehouse_manager
+        self.box_type_manager = box_type_manager
+        self.date_manager = date_manager
+        self.supply_snapshot = supply_snapshot
+        self.timezone = ZoneInfo(timezone)
+
+    async def active_rules(self, now: datetime.datetime | None = None) -> list[Rule]:
+        now = now or datetime.datetime.now(self.timezone)
+        rules = tracking_rules(
+            await self.tracked_warehouse_manager.get_all(),
+            await self.box_type_manager.get_all(),
+            await self.date_manager.get_all(),
+            await self.cache_manager.get("coefficient"),
+        )
+        rules += await self.rule_manager.get_all()
+        return [rule for rule in rules if not in_quiet_hours(rule, now)]
+
+    async def matches(self, now: datetime.datetime | None = None) -> list[dict] | None:
+        """Slots to notify about, None if there is no snapshot yet"""
+        rules = await self.active_rules(now)
+        if not rules:
+            logger.debug("No active rules")
+            return []
+        return await self.supply_snapshot.evaluate(
+            decision_table(rules),
+            set(await self.date_manager.get_all()),
+            compare_previous=any(rule.drop_by is not None for rule in rules),
+        )
@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from app.config import Config
+from app.lifecycle import cancel_tasks, drain, first_completed
+from app.metrics import SCHEDULER_RUN_SECONDS, SCHEDULER_RUNS, SCHEDULER_START_DELAY_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# runs start every interval, however long they take
+FIXED_RATE = "rate"
+# the next run starts interval after the previous one finished
+FIXED_DELAY = "delay"
+
+
+@dataclass(frozen=True)
+class Window:
+    """Time of day range with an interval of its own, an end before the start wraps past midnight"""
+    start: datetime.time
+    end: datetime.time
+    interval: float
+
+    def contains(self, moment: datetime.time) -> bool:
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+
+def parse_windows(spec: str) -> list[Window]:
+    """Parses "HH:MM-HH:MM=seconds,..." as used by POLL_WINDOWS"""
+    windows = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        span, sep, interval = item.partition("=")
+        start, dash, end = span.partition("-")
+        if not sep or not dash:
+            raise ValueError(f"Expected HH:MM-HH:MM=seconds in POLL_WINDOWS, got '{item}'")
+        windows.append(Window(
+            datetime.time.fromisoformat(start.strip()),
+            datetime.time.fromisoformat(end.strip()),
+            float(interval),
+        ))
+    return windows
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    interval: float
+    mode: str = FIXED_RATE
+    # every run starts up to jitter seconds late, processes sharing an API do not start in lockstep
+    jitter: float = 0.0
+    # runs of a fixed rate job allowed to overlap, a due run waits for a free one
+    max_concurrency: int = 1
+    windows: list[Window] = field(default_factory=list)
+    # awaited before every run, e.g. until this process leads its role
+    gate: Callable[[], Awaitable[Any]] | None = None
+
+    def interval_at(self, now: datetime.datetime) -> float:
+        moment = now.time()
+        return next((window.interval for window in self.windows if window.contains(moment)), self.interval)
+
+
+class Scheduler:
+    """Runs periodic jobs until stopped.
+
+    Fixed rate jobs keep their cadence however long a run takes. A run that
+    comes due while max_concurrency runs are still going waits for one of them,
+    the slots missed meanwhile are skipped rather than run back to back.
+    Windows switch a job to another interval at times of day in timezone.
+    Stopping ends the schedule, runs in flight get shutdown_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timezone: str = Config.schedule_timezone,
+        shutdown_timeout: float = Config.shutdown_timeout,
+    ):
+        self.name = name
+        self.timezone = ZoneInfo(timezone)
+        self.shutdown_timeout = shutdown_timeout
+        self.jobs: list[Job] = []
+        self._running: dict[str, set[asyncio.Task]] = {}
+        self._stopping = asyncio.Event()
+
+    def add(self, job: Job) -> Job:
+        if job.mode not in (FIXED_RATE, FIXED_DELAY):
+            raise ValueError(f"Unknown mode '{job.mode}' of job {job.name}")
+        self.jobs.append(job)
+        self._running[job.name] = set()
+        return job
+
+    def interval(self, job: Job) -> float:
+        return job.interval_at(datetime.datetime.now(self.timezone))
+
+    async def run(self) -> None:
+        loops = [asyncio.create_task(self._loop(job), name=f"{self.name}.{job.name}") for job in self.jobs]
+        try:
+            await self._stopping.wait()
+        finally:
+            await cancel_tasks(*loops)
+            running = [task for tasks in self._running.values() for task in tasks]
+            await drain(running, self.shutdown_timeout, f"{self.name} jobs")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def _loop(self, job: Job) -> None:
+        running = self._running[job.name]
+        due = time.monotonic()
+        while not self._stopping.is_set():
+            await self._sleep(due - time.monotonic() + random.uniform(0, job.jitter))
+            if job.gate is not None:
+                await first_completed(job.gate(), self._stopping.wait())
+            while len(running) >= job.max_concurrency and not self._stopping.is_set():
+                await first_completed(asyncio.wait(set(running)), self._stopping.wait())
+            if self._stopping.is_set():
+                return
+
+            now = time.monotonic()
+            SCHEDULER_START_DELAY_SECONDS.observe(max(0.0, now - due), job=job.name)
+            run = asyncio.create_task(self._run(job), name=f"{self.name}.{job.name}.run")
+            running.add(run)
+            run.add_done_callback(running.discard)
+
+            interval = self.interval(job)
+            if job.mode == FIXED_DELAY:
+                await first_completed(asyncio.wait({run}), self._stopping.wait())
+                due = time.monotonic() + interval
+            elif interval <= 0:
+                due = now
+            else:
+                due += interval
+                if due <= now:
+                    missed = int((now - due) // interval) + 1
+                    SCHEDULER_RUNS.inc(missed, job=job.name, result="missed")
+                    due += missed * interval
+
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            await first_completed(asyncio.sleep(seconds), self._stopping.wait())
+
+    async def _run(self, job: Job) -> None:
+        started = time.perf_counter()
+        result = "cancelled"
+        try:
+            await job.func()
+            result = "ok"
+        except Exception as e:
+            result = "error"
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            SCHEDULER_RUN_SECONDS.observe(time.perf_counter() - started, job=job.name)
+            SCHEDULER_RUNS.inc(job=job.name, result=result)
@@ -0,0 +1,84 @@
+from typing import Any, Callable
+
+from app.api_data_processor import (
+    coefficient_matrix_pages,
+    evaluate_rules,
+    unique_box_types,
+    unique_warehouses,
+)
+from app.db.db import WildberriesCacheManager
+from app.dto import WarehouseShort
+from app.workers import SingleFlight, WorkerPool, pool
+
+# shared by every SupplySnapshot of the process, bot workers evaluate the same rules over the same snapshot
+evaluations = SingleFlight()
+
+
+class SupplySnapshot:
+    """Views derived from the cached coefficients snapshot.
+
+    Decoding and scanning the snapshot runs in the worker pool. Views that do
+    not depend on arguments are computed once per snapshot, concurrent
+    callers share one computation.
+    """
+
+    def __init__(self, cache_manager: WildberriesCacheManager, worker_pool: WorkerPool = pool):
+        self.cache_manager = cache_manager
+        self.worker_pool = worker_pool
+        self._single_flight = SingleFlight()
+        self._views: dict[str, tuple[Any, Any]] = {}
+
+    async def version(self) -> float | None:
+        return await self.cache_manager.get("supply_data_fetched_at")
+
+    async def _compute(self, func: Callable, *args) -> Any:
+        raw = await self.cache_manager.get_raw("supply_data")
+        if raw is None:
+            return None
+        return await self.worker_pool.run(func, raw, *args)
+
+    async def _view(self, name: str, func: Callable) -> Any:
+        version = await self.version()
+        cached = self._views.get(name)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+
+        result = await self._single_flight.do((name, version), lambda: self._compute(func))
+        self._views[name] = (version, result)
+        return result
+
+    async def warehouses(self) -> list[WarehouseShort]:
+        """Unique warehouses sorted by name, ignoring the СЦ prefix"""
+        warehouses = await self._view("warehouses", unique_warehouses) or []
+        return [WarehouseShort(id=warehouse_id, name=name) for warehouse_id, name in warehouses]
+
+    async def box_types(self) -> list[str]:
+        return await self._view("box_types", unique_box_types) or []
+
+    async def coefficient_matrix(self) -> list[tuple[str, list[str]]]:
+        """/supply pages per box type, warehouses by dates of the coefficients"""
+        return await self._view("coefficient_matrix", coefficient_matrix_pages) or []
+
+    async def evaluate(
+        self,
+        rules: list[tuple],
+        dates: set[str],
+        compare_previous: bool = False,
+    ) -> list[dict] | None:
+        """Slots matching a decision table (see app.rules), None if there is no snapshot yet.
+
+        With compare_previous the previous snapshot is loaded as well so drop
+        rules can compare coefficients. Concurrent evaluations of the same
+        rules and snapshot share one run, the result must not be modified.
+        """
+        dates = sorted(dates)
+        version = await self.version()
+        key = (self.cache_manager.db_path, version, tuple(rules), tuple(dates), compare_previous)
+        return await evaluations.do(key, lambda: self._evaluate(rules, dates, compare_previous))
+
+    async def _evaluate(self, rules: list[tuple], dates: list[str], compare_previous: bool) -> list[dict] | None:
+        raw = await self.cache_manager.get_raw("supply_data")
+        if raw is None:
+            return None
+        previous_raw = await self.cache_manager.get_raw("supply_data_previous") if compare_previous else None
+        return await self.worker_pool.run(evaluate_rules, raw, rules, dates, previous_raw)
@@ -0,0 +1,59 @@
+import html
+import math
+
+from app.utils.messages.messages import get_message_text_by_key
+
+
+# Telegram shows a <pre> block in a monospace font, a row is the name and a cell per date
+NAME_WIDTH = 14
+CELL_WIDTH = 3
+CLOSED = "·"
+# keeps a page well below the 4096 characters of a message
+ROWS_PER_PAGE = 25
+
+
+def format_name(name: str) -> str:
+    if len(name) > NAME_WIDTH:
+        name = name[:NAME_WIDTH - 1] + "…"
+    return name.ljust(NAME_WIDTH)
+
+
+def format_cell(value: int | None) -> str:
+    if value is None:
+        return " " * CELL_WIDTH
+    return (CLOSED if value == -1 else str(value)).rjust(CELL_WIDTH)
+
+
+def format_day(date: str) -> str:
+    """Day and month of an ISO date, 01.10 for 2024-10-01"""
+    return f"{date[8:10]}.{date[5:7]}"
+
+
+def render_pages(matrix: dict, rows_per_page: int = ROWS_PER_PAGE) -> list[tuple[str, list[str]]]:
+    """HTML pages of every box type of an app.api_data_processor.coefficient_matrix"""
+    dates = matrix["dates"]
+    if not dates:
+        return []
+    header = format_name("") + "".join(date[8:10].rjust(CELL_WIDTH) for date in dates)
+    caption = get_message_text_by_key("supply_matrix")
+
+    result = []
+    for box_type, warehouses, rows in matrix["tables"]:
+        count = math.ceil(len(warehouses) / rows_per_page)
+        pages = []
+        for offset in range(0, len(warehouses), rows_per_page):
+            lines = [header] + [
+                (format_name(name) + "".join(format_cell(value) for value in row)).rstrip()
+                for name, row in zip(warehouses[offset:offset + rows_per_page], rows[offset:offset + rows_per_page])
+            ]
+            table = "\n".join(lines)
+            title = caption.format(
+                box_type=box_type,
+                start=format_day(dates[0]),
+                end=format_day(dates[-1]),
+                page=len(pages) + 1,
+                pages=count,
+            )
+            pages.append(f"{html.escape(title)}<pre>{html.escape(table)}</pre>")
+        result.append((box_type, pages))
+    return result
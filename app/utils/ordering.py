@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[object]]
+
+
+class KeyedSerialExecutor:
+    """Runs jobs concurrently across keys and strictly in submission order within one key.
+
+    At most `workers` jobs run at the same time and at most `max_pending_per_key`
+    jobs wait per key; submit refuses jobs beyond that so callers can push back.
+    """
+
+    def __init__(self, workers: int = 16, max_pending_per_key: int = 100):
+        self.max_pending_per_key = max_pending_per_key
+        self._semaphore = asyncio.Semaphore(workers)
+        self._queues: dict[Hashable, deque[Job]] = {}
+        self._runners: set[asyncio.Task] = set()
+
+    def submit(self, key: Hashable, job: Job) -> bool:
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            runner = asyncio.create_task(self._run_key(key, queue))
+            self._runners.add(runner)
+            runner.add_done_callback(self._runners.discard)
+        elif len(queue) >= self.max_pending_per_key:
+            return False
+        queue.append(job)
+        return True
+
+    async def _run_key(self, key: Hashable, queue: deque[Job]) -> None:
+        try:
+            # the first job is appended right after this task is created
+            await asyncio.sleep(0)
+            while queue:
+                job = queue[0]
+                async with self._semaphore:
+                    try:
+                        await job()
+                    except Exception:
+                        logger.exception(f"Job for key {key} failed")
+                queue.popleft()
+        finally:
+            del self._queues[key]
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def join(self, timeout: float | None = None) -> None:
+        """Waits until every submitted job finished"""
+        if self._runners:
+            await asyncio.wait(set(self._runners), timeout=timeout)
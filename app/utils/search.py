@@ -0,0 +1,96 @@
+import re
+from collections import Counter
+
+from app.dto import WarehouseShort
+
+
+# Names are matched in Latin so "коледино", "Koledino" and "koledino" are the same query
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+
+NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+# СЦ (sorting center) transliterated, or typed in Latin
+SERVICE_CENTER_PREFIX = re.compile(r"^(?:sts|sc)(?: |$)")
+
+MIN_SCORE = 0.3
+
+
+def normalize(text: str) -> str:
+    text = text.lower().translate(CYRILLIC_TO_LATIN)
+    return NON_ALPHANUMERIC.sub(" ", text).strip()
+
+
+def strip_prefix(normalized: str) -> tuple[str, bool]:
+    stripped = SERVICE_CENTER_PREFIX.sub("", normalized)
+    return stripped, stripped != normalized
+
+
+def trigrams(normalized: str) -> set[str]:
+    """Trigrams of every word padded like pg_trgm, so short prefixes still produce some"""
+    result = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class WarehouseSearchIndex:
+    """Fuzzy search over warehouse names, built once per catalog load.
+
+    Ranks by the share of query trigrams found in a name, prefix matches of
+    the name or one of its words rank first. Case, the СЦ prefix, punctuation
+    and Cyrillic/Latin spelling are ignored.
+    """
+
+    def __init__(self, warehouses: list[WarehouseShort]):
+        self.warehouses = list(warehouses)
+        self._keys: list[str] = []
+        self._service_centers: list[bool] = []
+        self._postings: dict[str, list[int]] = {}
+
+        for position, warehouse in enumerate(self.warehouses):
+            key, is_service_center = strip_prefix(normalize(warehouse.name))
+            self._keys.append(key)
+            self._service_centers.append(is_service_center)
+            for trigram in trigrams(key):
+                self._postings.setdefault(trigram, []).append(position)
+
+    def __len__(self) -> int:
+        return len(self.warehouses)
+
+    def search(self, query: str, limit: int = 10) -> list[WarehouseShort]:
+        query, wants_service_center = strip_prefix(normalize(query))
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            if not wants_service_center:
+                return []
+            # just "сц": every sorting center
+            positions = [position for position, flag in enumerate(self._service_centers) if flag]
+            positions.sort(key=lambda position: self._keys[position])
+            return [self.warehouses[position] for position in positions[:limit]]
+
+        hits = Counter()
+        for trigram in query_trigrams:
+            hits.update(self._postings.get(trigram, ()))
+
+        scored = []
+        for position, count in hits.items():
+            score = count / len(query_trigrams)
+            key = self._keys[position]
+            if key.startswith(query):
+                score += 1
+            elif any(word.startswith(query) for word in key.split()):
+                score += 0.5
+            if score < MIN_SCORE:
+                continue
+            # "сц казань" prefers the sorting center, "казань" the warehouse
+            service_center_match = self._service_centers[position] == wants_service_center
+            scored.append((-score, not service_center_match, len(key), position))
+
+        scored.sort()
+        return [self.warehouses[position] for *_, position in scored[:limit]]
@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+from dataclasses import dataclass
+from typing import Any, Awaitable
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+
+from app.dto import BoxTariff, Warehouse
+from app import metrics
+
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_COEFFICIENTS = "coefficients"
+ENDPOINT_WAREHOUSES = "warehouses"
+ENDPOINT_TARIFFS = "tariffs"
+
+DEFAULT_COEFFICIENTS_API_URL = "https://supplies-api.wildberries.ru/api/v1/acceptance/coefficients"
+DEFAULT_WAREHOUSES_API_URL = "https://supplies-api.wildberries.ru/api/v1/warehouses"
+DEFAULT_TARIFFS_API_URL = "https://common-api.wildberries.ru/api/v1/tariffs/box"
+
+# requests per minute WB allows per endpoint and token
+DEFAULT_LIMITS = {
+    ENDPOINT_COEFFICIENTS: 6,
+    ENDPOINT_WAREHOUSES: 6,
+    ENDPOINT_TARIFFS: 60,
+}
+
+
+class WildberriesAPIError(aiohttp.ClientError):
+    def __init__(self, endpoint: str, status: int, detail: str = ""):
+        super().__init__(f"{endpoint} responded with status {status}: {detail}")
+        self.endpoint = endpoint
+        self.status = status
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    url: str
+    requests_per_minute: int
+
+
+@dataclass(frozen=True)
+class APIResponse:
+    endpoint: str
+    status: int
+    body: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise WildberriesAPIError(self.endpoint, self.status, self.body[:200].decode(errors="replace"))
+
+
+class WildberriesAPIClient:
+    """Wildberries API endpoints behind one pooled session.
+
+    Every endpoint has a rate limiter of its own, so fetching context for
+    alerts never spends the quota of the coefficients poll. Methods return
+    DTOs of app.dto, except coefficients: its body is cached as is and
+    validated in the worker pool.
+    """
+
+    def __init__(
+        self,
+        token: str | None,
+        endpoints: dict[str, Endpoint],
+        timeout: float = 30,
+        connections: int = 10,
+    ):
+        self.token = token
+        self.endpoints = endpoints
+        self.limiters = {name: AsyncLimiter(endpoint.requests_per_minute, 60) for name, endpoint in endpoints.items()}
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.connections = connections
+        self._session: aiohttp.ClientSession | None = None
+
+    @classmethod
+    def from_env(cls, coefficients_requests_per_minute: int = DEFAULT_LIMITS[ENDPOINT_COEFFICIENTS]) -> "WildberriesAPIClient":
+        """Endpoints whose URL is set to an empty string are left out"""
+        urls = {
+            ENDPOINT_COEFFICIENTS: os.getenv("WB_SUPPLY_API_URL", DEFAULT_COEFFICIENTS_API_URL),
+            ENDPOINT_WAREHOUSES: os.getenv("WB_WAREHOUSES_API_URL", DEFAULT_WAREHOUSES_API_URL),
+            ENDPOINT_TARIFFS: os.getenv("WB_TARIFFS_API_URL", DEFAULT_TARIFFS_API_URL),
+        }
+        limits = {**DEFAULT_LIMITS, ENDPOINT_COEFFICIENTS: coefficients_requests_per_minute}
+        return cls(
+            os.getenv("WB_SUPPLY_API_TOKEN"),
+            {name: Endpoint(url, limits[name]) for name, url in urls.items() if url},
+        )
+
+    def has(self, endpoint: str) -> bool:
+        return endpoint in self.endpoints
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # created lazily, a session has to be created inside the running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.connections),
+            )
+        return self._session
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str = "GET",
+        params: dict | None = None,
+        payload: Any = None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> APIResponse:
+        """Sends a request within the rate limit of the endpoint, error statuses are returned, not raised"""
+        headers = {"Authorization": f"Bearer {self.token}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self.limiters[endpoint]:
+            with metrics.WB_API_REQUEST_SECONDS.time(endpoint=endpoint):
+                async with self.session.request(
+                    method, self.endpoints[endpoint].url, params=params, json=payload, headers=headers,
+                ) as response:
+                    metrics.WB_API_RESPONSES.inc(endpoint=endpoint, status=response.status)
+                    body = await response.read()
+                    result = APIResponse(
+                        endpoint,
+                        response.status,
+                        body,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+
+        if response.ok:
+            metrics.WB_API_PAYLOAD_BYTES.observe(len(body), endpoint=endpoint)
+        return result
+
+    async def coefficients(self) -> APIResponse:
+        return await self.request(ENDPOINT_COEFFICIENTS)
+
+    async def warehouses(self, etag: str | None = None, last_modified: str | None = None) -> tuple[list[Warehouse] | None, APIResponse]:
+        """Warehouses, None if they did not change since the response etag and last_modified came with"""
+        response = await self.request(ENDPOINT_WAREHOUSES, etag=etag, last_modified=last_modified)
+        if response.not_modified:
+            return None, response
+        response.raise_for_status()
+        return [Warehouse.model_validate(entry) for entry in json.loads(response.body)], response
+
+    async def box_tariffs(self, date: datetime.date) -> list[BoxTariff]:
+        response = await self.request(ENDPOINT_TARIFFS, params={"date": date.isoformat()})
+        response.raise_for_status()
+        data = json.loads(response.body)["response"]["data"]
+        return [BoxTariff.model_validate(entry) for entry in data.get("warehouseList") or []]
+
+    @staticmethod
+    async def gather(*requests: Awaitable) -> list:
+        """Runs requests concurrently, the first failure cancels the rest and is raised"""
+        tasks = [asyncio.ensure_future(request) for request in requests]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # collects the errors of the cancelled ones, they are not the ones that matter
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
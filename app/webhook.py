@@ -0,0 +1,111 @@
+import asyncio
+import hmac
+import logging
+import os
+
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+UPDATE_MODE_POLLING = "polling"
+UPDATE_MODE_WEBHOOK = "webhook"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+@dataclass
+class WebhookSettings:
+    url: str
+    secret: str
+    path: str = "/telegram/webhook"
+    host: str = "0.0.0.0"
+    port: int = 8080
+    workers: int = 16
+
+    @classmethod
+    def from_env(cls) -> "WebhookSettings | None":
+        """None unless TELEGRAM_UPDATE_MODE=webhook"""
+        mode = os.getenv("TELEGRAM_UPDATE_MODE", UPDATE_MODE_POLLING)
+        if mode == UPDATE_MODE_POLLING:
+            return None
+        if mode != UPDATE_MODE_WEBHOOK:
+            raise ValueError(f"Unknown TELEGRAM_UPDATE_MODE '{mode}'")
+
+        url = os.getenv("WEBHOOK_URL")
+        secret = os.getenv("WEBHOOK_SECRET")
+        if not url or not secret:
+            raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode")
+        return cls(
+            url=url,
+            secret=secret,
+            path=os.getenv("WEBHOOK_PATH", cls.path),
+            host=os.getenv("WEBHOOK_HOST", cls.host),
+            port=int(os.getenv("WEBHOOK_PORT", cls.port)),
+            workers=int(os.getenv("WEBHOOK_WORKERS", cls.workers)),
+        )
+
+    @property
+    def webhook_url(self) -> str:
+        return self.url.rstrip("/") + self.path
+
+
+class WebhookServer:
+    """Receives updates from Telegram and hands them to on_update.
+
+    The request is answered as soon as the update is accepted, on_update returns
+    False to refuse it (Telegram then retries delivery later).
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        settings: WebhookSettings,
+        on_update: Callable[[Update], Awaitable[bool]],
+    ):
+        self.bot = bot
+        self.dp = dp
+        self.settings = settings
+        self.on_update = on_update
+
+    async def handle(self, request: web.Request) -> web.Response:
+        secret = request.headers.get(SECRET_HEADER, "")
+        # bytes, compare_digest refuses str with non-ASCII characters
+        if not hmac.compare_digest(secret.encode(), self.settings.secret.encode()):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as e:
+            logger.warning(f"Malformed update received: {e}")
+            return web.Response(status=400)
+
+        if not await self.on_update(update):
+            return web.Response(status=429)
+        return web.Response()
+
+    async def register(self) -> None:
+        await self.bot.set_webhook(
+            self.settings.webhook_url,
+            secret_token=self.settings.secret,
+            allowed_updates=self.dp.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook set to {self.settings.webhook_url}")
+
+    async def serve(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.settings.path, self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.settings.host, self.settings.port).start()
+        logger.info(f"Listening for webhook updates on {self.settings.host}:{self.settings.port}{self.settings.path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Hashable
+
+
+logger = logging.getLogger(__name__)
+
+POOL_THREAD = "thread"
+POOL_PROCESS = "process"
+
+
+class WorkerPool:
+    """Runs CPU-bound steps off the event loop thread.
+
+    json decoding holds the GIL for the whole payload, so only the process pool
+    keeps the loop responsive while a large snapshot is decoded. Functions
+    submitted to it must be importable module-level functions.
+    """
+
+    def __init__(self, kind: str | None = None, max_workers: int | None = None):
+        self.kind = kind
+        self.max_workers = max_workers
+        self._executor: Executor | None = None
+        self._size = 0
+
+    def _create_executor(self) -> Executor:
+        kind = self.kind or os.getenv("WORKER_POOL_KIND", POOL_PROCESS)
+        max_workers = self.max_workers or int(os.getenv("WORKER_POOL_SIZE", 2))
+        logger.info(f"Starting {kind} worker pool with {max_workers} workers")
+        self._size = max_workers
+        if kind == POOL_PROCESS:
+            # spawn: forking a process that already runs threads and an event loop is unsafe
+            return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+        if kind == POOL_THREAD:
+            return ThreadPoolExecutor(max_workers, thread_name_prefix="worker")
+        raise ValueError(f"Unknown WORKER_POOL_KIND '{kind}'")
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    def start(self) -> None:
+        """Starts the workers in the background instead of on the first submitted job"""
+        executor = self.executor
+        for _ in range(self._size):
+            executor.submit(int)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution"""
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        # shield: one cancelled caller must not cancel the work the others wait for
+        return await asyncio.shield(future)
+
+
+pool = WorkerPool()
@@ -0,0 +1,43 @@
+import argparse
+import json
+import sys
+
+from pathlib import Path
+
+
+def load_results(path: Path) -> dict[tuple[str, int], dict]:
+    report = json.loads(path.read_text(encoding="utf-8"))
+    return {
+        (result["name"], result["rows"]): result["stats"]
+        for result in report["results"]
+    }
+
+
+def compare(base: dict, head: dict) -> list[tuple[str, int, float, float, float]]:
+    rows = []
+    for key in sorted(base.keys() & head.keys()):
+        before, after = base[key]["median"], head[key]["median"]
+        ratio = after / before if before else float("inf")
+        rows.append((*key, before, after, ratio))
+    return rows
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports by median time")
+    parser.add_argument("base", type=Path)
+    parser.add_argument("head", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 means 10%%")
+    args = parser.parse_args(argv)
+
+    regressions = 0
+    for name, rows, before, after, ratio in compare(load_results(args.base), load_results(args.head)):
+        regressed = ratio > 1 + args.threshold
+        regressions += regressed
+        marker = "REGRESSION" if regressed else ""
+        print(f"{name:<28} rows={rows:<7} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms  x{ratio:5.2f} {marker}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import time
+
+from typing import Callable
+
+from aiohttp import web
+
+from app.config import configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 123456789, "is_bot": True, "first_name": "Fake WB bot", "username": "fake_wb_bot"}
+
+# parameters the Bot API takes as JSON inside form fields
+JSON_PARAMS = ("reply_markup", "allowed_updates", "entities", "results")
+INT_PARAMS = ("chat_id", "message_id", "offset", "limit", "timeout")
+
+NOT_MODIFIED = (
+    "Bad Request: message is not modified: specified new message content and reply markup "
+    "are exactly the same as a current content and reply markup of the message"
+)
+
+# (method, params, result) of a call the bot made
+Call = tuple[str, dict, object]
+
+
+class TelegramAPIError(Exception):
+    def __init__(self, status: int, description: str):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def private_chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+
+class FakeTelegramAPI:
+    """Bot API methods the bot uses, served at /bot{token}/{method} like api.telegram.org.
+
+    Keeps the messages of every chat so edits compare and fail like the real
+    API does. Simulated users queue updates with send_text and click and wait
+    for the calls of the bot in their chat with expect. Anything else is
+    answered 404 and counted, so a handler using a new method shows up.
+    """
+
+    def __init__(self, bot_user: dict = BOT_USER):
+        self.bot_user = bot_user
+        self.updates: collections.deque[dict] = collections.deque()
+        self.update_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.message_ids: dict[int, itertools.count] = collections.defaultdict(lambda: itertools.count(1))
+        # (chat, message) -> message as last sent or edited
+        self.messages: dict[tuple[int, int], dict] = {}
+        # callback query -> chat it was clicked in
+        self.callbacks: dict[str, int] = {}
+        self.stats: collections.Counter[str] = collections.Counter()
+        self.polling = asyncio.Event()
+        self._updates_available = asyncio.Event()
+        self._waiters: dict[int, list[tuple[Callable[[Call], bool], asyncio.Future]]] = collections.defaultdict(list)
+
+        self.methods = {
+            "getMe": self.get_me,
+            "deleteWebhook": self.ok,
+            "getUpdates": self.get_updates,
+            "sendMessage": self.send_message,
+            "editMessageText": self.edit_message,
+            "editMessageReplyMarkup": self.edit_message,
+            "deleteMessage": self.delete_message,
+            "answerCallbackQuery": self.answer_callback_query,
+            "answerInlineQuery": self.ok,
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_post("/_fake/send", self.fake_send)
+        app.router.add_get("/_fake/stats", self.get_stats)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.stats[method] += 1
+        if method not in self.methods:
+            self.stats["unsupported"] += 1
+            logger.warning(f"Unsupported method {method}")
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+        params = await self._params(request)
+        try:
+            result = await self.methods[method](params)
+        except TelegramAPIError as e:
+            self.stats[f"{method}.{e.status}"] += 1
+            return web.json_response({"ok": False, "error_code": e.status, "description": e.description}, status=e.status)
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(await request.post())
+        for name in JSON_PARAMS:
+            if name in params:
+                params[name] = json.loads(params[name])
+        for name in INT_PARAMS:
+            if name in params:
+                params[name] = int(params[name])
+        return params
+
+    async def ok(self, params: dict) -> bool:
+        return True
+
+    async def get_me(self, params: dict) -> dict:
+        return self.bot_user
+
+    async def get_updates(self, params: dict) -> list[dict]:
+        self.polling.set()
+        offset = params.get("offset")
+        # confirmed by the offset, like Telegram forgets them
+        while self.updates and offset is not None and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), params.get("timeout", 0))
+            except asyncio.TimeoutError:
+                return []
+        updates = list(itertools.islice(self.updates, params.get("limit", 100)))
+        self.stats["updates_delivered"] += len(updates)
+        return updates
+
+    async def send_message(self, params: dict) -> dict:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": next(self.message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": private_chat(chat_id),
+            "from": self.bot_user,
+            "text": params["text"],
+        }
+        # the API echoes inline keyboards only, reply keyboards stay with the client
+        markup = params.get("reply_markup")
+        if markup is not None and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        self.messages[chat_id, message["message_id"]] = message
+        self._notify(chat_id, ("sendMessage", params, message))
+        return message
+
+    async def edit_message(self, params: dict) -> dict | bool:
+        if "inline_message_id" in params:
+            return True
+        chat_id, message_id = params["chat_id"], params["message_id"]
+        message = self.messages.get((chat_id, message_id))
+        if message is None:
+            raise TelegramAPIError(400, "Bad Request: message to edit not found")
+        edited = {**message, "edit_date": int(time.time())}
+        if "text" in params:
+            edited["text"] = params["text"]
+        edited.pop("reply_markup", None)
+        if params.get("reply_markup") is not None:
+            edited["reply_markup"] = params["reply_markup"]
+        if (edited.get("text"), edited.get("reply_markup")) == (message.get("text"), message.get("reply_markup")):
+            raise TelegramAPIError(400, NOT_MODIFIED)
+        self.messages[chat_id, message_id] = edited
+        self._notify(chat_id, ("editMessage", params, edited))
+        return edited
+
+    async def delete_message(self, params: dict) -> bool:
+        if self.messages.pop((params["chat_id"], params["message_id"]), None) is None:
+            raise TelegramAPIError(400, "Bad Request: message to delete not found")
+        return True
+
+    async def answer_callback_query(self, params: dict) -> bool:
+        chat_id = self.callbacks.pop(params["callback_query_id"], None)
+        if chat_id is not None:
+            self._notify(chat_id, ("answerCallbackQuery", params, True))
+        return True
+
+    def _notify(self, chat_id: int, call: Call) -> None:
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        pending = []
+        for predicate, future in waiters:
+            if future.done():
+                continue
+            if predicate(call):
+                future.set_result(call)
+            else:
+                pending.append((predicate, future))
+        if pending:
+            self._waiters[chat_id] = pending
+        else:
+            del self._waiters[chat_id]
+
+    def expect(self, chat_id: int, predicate: Callable[[Call], bool]) -> asyncio.Future:
+        """Future of the next call of the bot in chat_id matching predicate, register it before sending"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    def _enqueue(self, update: dict) -> int:
+        update = {"update_id": next(self.update_ids), **update}
+        self.updates.append(update)
+        self._updates_available.set()
+        self.stats["updates_queued"] += 1
+        return update["update_id"]
+
+    def send_text(self, user_id: int, text: str) -> int:
+        """Queues a message of user_id in their private chat, returns the update id"""
+        message = {
+            "message_id": next(self.message_ids[user_id]),
+            "date": int(time.time()),
+            "chat": private_chat(user_id),
+            "from": user_dict(user_id),
+            "text": text,
+        }
+        self.messages[user_id, message["message_id"]] = message
+        return self._enqueue({"message": message})
+
+    def click(self, user_id: int, message_id: int, data: str) -> str:
+        """Queues a click of user_id on a button of a bot message, returns the callback query id"""
+        callback_id = str(next(self.callback_ids))
+        self.callbacks[callback_id] = user_id
+        self._enqueue({"callback_query": {
+            "id": callback_id,
+            "from": user_dict(user_id),
+            "chat_instance": str(user_id),
+            "message": self.messages[user_id, message_id],
+            "data": data,
+        }})
+        return callback_id
+
+    async def fake_send(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        return web.json_response({"update_id": self.send_text(int(payload["user_id"]), payload["text"])})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "pending_updates": len(self.updates)})
+
+
+def main(argv: list[str] | None = None) -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API, see TELEGRAM_API_URL")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    args = parser.parse_args(argv)
+
+    api = FakeTelegramAPI()
+    logger.info(f"Serving the Bot API on http://{args.host}:{args.port}, POST /_fake/send to message the bot")
+    web.run_app(api.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
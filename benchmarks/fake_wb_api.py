@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import random
+import time
+
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from app.config import configure_logging
+from benchmarks.synthetic import generate_coefficients, random_coefficient
+
+
+logger = logging.getLogger(__name__)
+
+COEFFICIENTS_PATH = "/api/v1/acceptance/coefficients"
+WAREHOUSES_PATH = "/api/v1/warehouses"
+TARIFFS_PATH = "/api/v1/tariffs/box"
+# not a WB endpoint, the target of the http booking client (app.booking.HTTPBookingClient)
+BOOKINGS_PATH = "/_fake/bookings"
+
+
+@dataclass
+class FakeAPIConfig:
+    rows: int = 6_000
+    churn: float = 0.01
+    tick_interval: float = 1.0
+    requests_per_minute: int = 6
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    latency_ms: float = 50.0
+    latency_jitter_ms: float = 25.0
+    booking_requests_per_minute: int = 10
+    seed: int = 0
+
+
+class SlotMarket:
+    """Evolving set of acceptance slots, churn is the share of rows changed per tick"""
+
+    def __init__(self, config: FakeAPIConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rows = generate_coefficients(config.rows, seed=config.seed)
+        self.slots = {(row["warehouseID"], row["boxTypeName"], row["date"]): row for row in self.rows}
+        self.body = json.dumps(self.rows).encode()
+        self.opened: collections.deque[dict] = collections.deque(maxlen=10_000)
+        self.ticks = 0
+
+    def tick(self) -> None:
+        changed = max(1, int(len(self.rows) * self.config.churn))
+        now = time.time()
+        for row in self.rng.sample(self.rows, changed):
+            was_closed = row["coefficient"] == -1
+            row["coefficient"] = random_coefficient(self.rng)
+            if was_closed and row["coefficient"] != -1:
+                self.opened.append({
+                    "opened_at": now,
+                    "warehouseID": row["warehouseID"],
+                    "boxTypeName": row["boxTypeName"],
+                    "date": row["date"],
+                    "coefficient": row["coefficient"],
+                })
+        self.body = json.dumps(self.rows).encode()
+        self.ticks += 1
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.tick_interval)
+            self.tick()
+
+
+class SlidingWindowLimiter:
+    def __init__(self, requests_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.calls: dict[str, collections.deque[float]] = collections.defaultdict(collections.deque)
+
+    def retry_after(self, token: str) -> float:
+        """Registers a call and returns 0 if it is allowed, otherwise seconds to wait"""
+        now = time.monotonic()
+        calls = self.calls[token]
+        while calls and now - calls[0] >= 60:
+            calls.popleft()
+        if len(calls) >= self.requests_per_minute:
+            return 60 - (now - calls[0])
+        calls.append(now)
+        return 0
+
+
+class FakeWildberriesAPI:
+    def __init__(self, config: FakeAPIConfig):
+        self.config = config
+        self.market = SlotMarket(config)
+        self.limiter = SlidingWindowLimiter(config.requests_per_minute)
+        self.booking_limiter = SlidingWindowLimiter(config.booking_requests_per_minute)
+        self.bookings: dict[str, dict] = {}
+        self.rng = random.Random(config.seed + 1)
+        self.stats: collections.Counter[str] = collections.Counter()
+        self._market_task: asyncio.Task | None = None
+
+        warehouses = {row["warehouseID"]: row["warehouseName"] for row in self.market.rows}
+        self.warehouses_body = json.dumps([
+            {
+                "ID": warehouse_id,
+                "name": name,
+                "address": f"{name}, 1",
+                "workTime": "24/7",
+                "acceptsQR": warehouse_id % 2 == 0,
+            }
+            for warehouse_id, name in warehouses.items()
+        ]).encode()
+        self.warehouse_names = warehouses
+        self.warehouses_etag = f'"{hashlib.sha1(self.warehouses_body).hexdigest()}"'
+        self.warehouses_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(COEFFICIENTS_PATH, self.coefficients)
+        app.router.add_get(WAREHOUSES_PATH, self.warehouses)
+        app.router.add_get(TARIFFS_PATH, self.tariffs)
+        app.router.add_post(BOOKINGS_PATH, self.book)
+        app.router.add_get(BOOKINGS_PATH, self.get_bookings)
+        app.router.add_get("/_fake/events", self.events)
+        app.router.add_get("/_fake/stats", self.get_stats)
+        app.on_startup.append(self._start_market)
+        app.on_cleanup.append(self._stop_market)
+        return app
+
+    async def _start_market(self, app: web.Application) -> None:
+        self._market_task = asyncio.create_task(self.market.run())
+
+    async def _stop_market(self, app: web.Application) -> None:
+        self._market_task.cancel()
+
+    def too_many_requests(self, retry_after: float) -> web.Response:
+        self.stats["429"] += 1
+        return web.json_response(
+            {
+                "title": "too many requests",
+                "detail": "limited by c122a060-a7fb-4bb4-abb0-32fd4e18d489",
+                "status": 429,
+            },
+            status=429,
+            headers={
+                "X-Ratelimit-Retry": str(int(retry_after) + 1),
+                "X-Ratelimit-Limit": str(self.config.requests_per_minute),
+            },
+        )
+
+    async def coefficients(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        token = request.headers.get("Authorization", "")
+        if not token:
+            self.stats["401"] += 1
+            return web.json_response({"title": "unauthorized", "status": 401}, status=401)
+
+        latency = self.config.latency_ms + self.rng.uniform(-1, 1) * self.config.latency_jitter_ms
+        await asyncio.sleep(max(0.0, latency) / 1000)
+
+        retry_after = self.limiter.retry_after(token)
+        if retry_after:
+            return self.too_many_requests(retry_after)
+        if self.rng.random() < self.config.error_rate:
+            return self.too_many_requests(1)
+
+        if self.rng.random() < self.config.malformed_rate:
+            self.stats["malformed"] += 1
+            body = self.market.body
+            return web.Response(body=body[:len(body) // 2], content_type="application/json")
+
+        self.stats["200"] += 1
+        self.stats["bytes"] += len(self.market.body)
+        return web.Response(body=self.market.body, content_type="application/json")
+
+    async def warehouses(self, request: web.Request) -> web.Response:
+        self.stats["warehouses"] += 1
+        if not request.headers.get("Authorization"):
+            self.stats["401"] += 1
+            return web.json_response({"title": "unauthorized", "status": 401}, status=401)
+
+        headers = {"ETag": self.warehouses_etag, "Last-Modified": self.warehouses_modified}
+        if (
+            request.headers.get("If-None-Match") == self.warehouses_etag
+            or request.headers.get("If-Modified-Since") == self.warehouses_modified
+        ):
+            self.stats["304"] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=self.warehouses_body, content_type="application/json", headers=headers)
+
+    async def tariffs(self, request: web.Request) -> web.Response:
+        self.stats["tariffs"] += 1
+        if not request.headers.get("Authorization"):
+            self.stats["401"] += 1
+            return web.json_response({"title": "unauthorized", "status": 401}, status=401)
+        if "date" not in request.query:
+            return web.json_response({"title": "date is required", "status": 400}, status=400)
+
+        # formatted like WB does, decimal commas and "-" for a missing amount
+        warehouse_list = [
+            {
+                "warehouseName": name,
+                "boxDeliveryAndStorageExpr": "100",
+                "boxDeliveryBase": f"{40 + warehouse_id % 20},5" if warehouse_id % 2 else str(40 + warehouse_id % 20),
+                "boxDeliveryLiter": f"{10 + warehouse_id % 5},25",
+                "boxStorageBase": "0,1",
+                "boxStorageLiter": "0,1" if warehouse_id % 3 else "-",
+            }
+            for warehouse_id, name in self.warehouse_names.items()
+        ]
+        return web.json_response({"response": {"data": {
+            "dtNextBox": "",
+            "dtTillMax": request.query["date"],
+            "warehouseList": warehouse_list,
+        }}})
+
+    async def book(self, request: web.Request) -> web.Response:
+        """Takes an open slot (its coefficient becomes -1), replays the result for a known Idempotency-Key"""
+        self.stats["booking_requests"] += 1
+        token = request.headers.get("Authorization", "")
+        if not token:
+            self.stats["401"] += 1
+            return web.json_response({"title": "unauthorized", "status": 401}, status=401)
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return web.json_response({"title": "Idempotency-Key header is required", "status": 400}, status=400)
+        if key in self.bookings:
+            self.stats["booking_replays"] += 1
+            return web.json_response(self.bookings[key], status=201)
+
+        retry_after = self.booking_limiter.retry_after(token)
+        if retry_after:
+            return self.too_many_requests(retry_after)
+
+        payload = await request.json()
+        slot = self.market.slots.get((payload.get("warehouseID"), payload.get("boxTypeName"), payload.get("date")))
+        if slot is None or slot["coefficient"] == -1:
+            self.stats["booking_conflicts"] += 1
+            return web.json_response({"title": "slot is not available", "status": 409}, status=409)
+
+        slot["coefficient"] = -1
+        booking = {"bookingID": len(self.bookings) + 1, **payload, "bookedAt": time.time()}
+        self.bookings[key] = booking
+        self.stats["booked"] += 1
+        return web.json_response(booking, status=201)
+
+    async def get_bookings(self, request: web.Request) -> web.Response:
+        return web.json_response(list(self.bookings.values()))
+
+    async def events(self, request: web.Request) -> web.Response:
+        since = float(request.query.get("since", 0))
+        return web.json_response([event for event in self.market.opened if event["opened_at"] > since])
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "ticks": self.market.ticks, "rows": len(self.market.rows)})
+
+
+def parse_args(argv: list[str] | None = None) -> tuple[argparse.Namespace, FakeAPIConfig]:
+    parser = argparse.ArgumentParser(description="Local stand-in for the WB acceptance coefficients API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rows", type=int, default=FakeAPIConfig.rows)
+    parser.add_argument("--churn", type=float, default=FakeAPIConfig.churn, help="share of rows changed per tick")
+    parser.add_argument("--tick-interval", type=float, default=FakeAPIConfig.tick_interval, help="seconds between ticks")
+    parser.add_argument("--requests-per-minute", type=int, default=FakeAPIConfig.requests_per_minute)
+    parser.add_argument("--error-rate", type=float, default=FakeAPIConfig.error_rate, help="share of spurious 429s")
+    parser.add_argument("--malformed-rate", type=float, default=FakeAPIConfig.malformed_rate)
+    parser.add_argument("--latency-ms", type=float, default=FakeAPIConfig.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=FakeAPIConfig.latency_jitter_ms)
+    parser.add_argument("--booking-requests-per-minute", type=int, default=FakeAPIConfig.booking_requests_per_minute)
+    parser.add_argument("--seed", type=int, default=FakeAPIConfig.seed)
+    args = parser.parse_args(argv)
+
+    config = FakeAPIConfig(
+        rows=args.rows,
+        churn=args.churn,
+        tick_interval=args.tick_interval,
+        requests_per_minute=args.requests_per_minute,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        booking_requests_per_minute=args.booking_requests_per_minute,
+        seed=args.seed,
+    )
+    return args, config
+
+
+def main(argv: list[str] | None = None) -> None:
+    configure_logging()
+    args, config = parse_args(argv)
+    api = FakeWildberriesAPI(config)
+    logger.info(f"Serving {config.rows} slots on http://{args.host}:{args.port}{COEFFICIENTS_PATH}")
+    web.run_app(api.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
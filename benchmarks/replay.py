@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import bisect
+import json
+import shutil
+import statistics
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Iterable
+
+import aiohttp
+
+from app.api_data_processor import evaluate_rules
+from app.api_monitor import WildberriesSupplyAPIMonitor
+from app.bot import TelegramBot
+from app.broker import InMemoryBroker
+from app.config import configure_logging
+from app.recording import read_records
+from app.rules import parse_rule
+from app.workers import pool
+from benchmarks.stubs import StubBot, STUB_TELEGRAM_TOKEN
+
+
+class RecordedAPI:
+    """Stands in for WildberriesSupplyAPIMonitor.make_request with recorded responses.
+
+    Responses come at the recorded pace sped up speed times, recorded error
+    statuses are raised like real ones.
+    """
+
+    def __init__(self, records: Iterable[dict], speed: float = 1.0):
+        self.records = iter(records)
+        self.speed = speed
+        self.delivered: list[dict] = []
+        self.finished = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._started_at: float | None = None
+        self._first_fetched_at: float | None = None
+
+    async def make_request(self) -> bytes:
+        # decompressing a recorded snapshot takes a while, keep it off the loop
+        record = await asyncio.to_thread(next, self.records, None)
+        if record is None:
+            self.finished.set()
+            # the monitor would retry right away, park it until the replay is over
+            await self._closed.wait()
+            raise aiohttp.ClientError("Replay finished")
+
+        if self._started_at is None:
+            self._started_at, self._first_fetched_at = time.monotonic(), record["fetched_at"]
+        due = self._started_at + (record["fetched_at"] - self._first_fetched_at) / self.speed
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+
+        self.delivered.append({
+            "recorded_at": record["fetched_at"],
+            "delivered_at": time.time(),
+            "status": record["status"],
+        })
+        if record["body"] is None:
+            raise aiohttp.ClientError(f"Recorded response with status {record['status']}")
+        return record["body"].encode()
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+def slot_key(match: dict) -> str:
+    return f"{match['warehouseName']} {match['boxTypeName']} {match['date'][:10]}"
+
+
+class NotificationTracker:
+    """Pairs every notification round of the bot with the replayed response it evaluated"""
+
+    def __init__(self, api: RecordedAPI, bot: TelegramBot):
+        self.api = api
+        self.bot = bot
+        self.rounds: list[dict] = []
+        self.alerted: set[str] = set()
+        self._current: dict = {}
+
+    def install(self) -> None:
+        matches = self.bot.rules_engine.matches
+        send_notifications = self.bot.send_notifications
+
+        async def tracked_matches(now=None):
+            result = await matches(now)
+            self._current["slots"] = {slot_key(match) for match in result or []}
+            return result
+
+        async def tracked_send_notifications():
+            self._current = {"version": await self.bot.supply_snapshot.version(), "slots": set()}
+            await send_notifications()
+            self.observe(self._current, time.time())
+
+        self.bot.rules_engine.matches = tracked_matches
+        self.bot.send_notifications = tracked_send_notifications
+
+    def observe(self, current: dict, notified_at: float) -> None:
+        # the monitor stamps a snapshot after it got the response, the last response before the stamp is its source
+        delivered_at = [record["delivered_at"] for record in self.api.delivered]
+        index = bisect.bisect_right(delivered_at, current["version"] or 0) - 1
+        if index < 0:
+            return
+        new_slots = current["slots"] - self.alerted
+        self.alerted = current["slots"]
+        self.rounds.append({
+            "response": index,
+            "recorded_at": self.api.delivered[index]["recorded_at"],
+            "latency": notified_at - self.api.delivered[index]["delivered_at"],
+            "matches": len(current["slots"]),
+            "new_slots": sorted(new_slots),
+        })
+
+    @property
+    def last_response(self) -> int:
+        return self.rounds[-1]["response"] if self.rounds else -1
+
+
+def percentile(values: list[float], share: float) -> float | None:
+    return values[round(share * (len(values) - 1))] if values else None
+
+
+async def replay(args: argparse.Namespace) -> dict:
+    api = RecordedAPI(read_records(args.recordings), args.speed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "replay.sqlite"
+        if args.db is not None:
+            # tracked warehouses, rules and coefficient of a real setup
+            shutil.copy(args.db, db_path)
+
+        broker = InMemoryBroker()
+        monitor = WildberriesSupplyAPIMonitor("replay", "http://replay.invalid", db_path, broker=broker)
+        monitor.make_request = api.make_request
+        # RecordedAPI paces the requests
+        monitor.cache_refresh_interval = 0
+
+        bot = TelegramBot(STUB_TELEGRAM_TOKEN, db_path, list(range(1, args.chats + 1)), broker=broker)
+        bot.bot = StubBot()
+        await bot.initialize()
+
+        def resolve_warehouse(name: str) -> int | None:
+            found = bot.catalog.search(name, limit=1)
+            return found[0].id if found else None
+
+        for text in args.rule or ([] if args.db is not None else ["free"]):
+            await bot.rule_manager.add(parse_rule(text, resolve_warehouse))
+
+        # spawning workers and importing pandas in them is startup cost, not detection latency
+        pool.start()
+        await asyncio.gather(*(pool.run(evaluate_rules, "[]", [], []) for _ in range(4)))
+
+        tracker = NotificationTracker(api, bot)
+        tracker.install()
+        listener = asyncio.create_task(bot.listen_snapshots())
+        await asyncio.sleep(0)
+        monitor_task = asyncio.create_task(monitor.run())
+
+        started = time.monotonic()
+        try:
+            await api.finished.wait()
+            # let the bot catch up with the last snapshot
+            deadline = time.monotonic() + args.drain_timeout
+            last_ok = max((i for i, record in enumerate(api.delivered) if record["status"] == 200), default=-1)
+            while tracker.last_response < last_ok and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+        finally:
+            api.close()
+            monitor.stop()
+            await monitor_task
+            listener.cancel()
+            try:
+                await listener
+            except asyncio.CancelledError:
+                pass
+
+    elapsed = time.monotonic() - started
+    latencies = sorted(round_["latency"] for round_ in tracker.rounds)
+    evaluated = {round_["response"] for round_ in tracker.rounds}
+    successful = [i for i, record in enumerate(api.delivered) if record["status"] == 200]
+    recorded_span = api.delivered[-1]["recorded_at"] - api.delivered[0]["recorded_at"] if api.delivered else 0
+    report = {
+        "responses": len(api.delivered),
+        "errors": len(api.delivered) - len(successful),
+        "recorded_seconds": recorded_span,
+        "replay_seconds": elapsed,
+        "speed": args.speed,
+        "notification_rounds": len(tracker.rounds),
+        # responses that failed to parse or were replaced by a newer snapshot before the bot evaluated them
+        "skipped_snapshots": len([i for i in successful if i not in evaluated]),
+        "alerts": sum(len(round_["new_slots"]) for round_ in tracker.rounds),
+        "detection_latency": {
+            "median": statistics.median(latencies) if latencies else None,
+            "p95": percentile(latencies, 0.95),
+            "max": latencies[-1] if latencies else None,
+        },
+        "messages_sent": len(bot.bot.sent),
+    }
+    if args.details:
+        report["rounds"] = tracker.rounds
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Replay recorded WB API responses through monitor and bot")
+    parser.add_argument("recordings", nargs="+", type=Path, help="recording files or RECORD_DIR directories")
+    parser.add_argument("--speed", type=float, default=10, help="times faster than recorded")
+    parser.add_argument("--db", type=Path, help="database to copy tracking settings and rules from")
+    parser.add_argument("--rule", action="append", help='rule to add, e.g. "wh=коледино below=3", may repeat (default "free" without --db)')
+    parser.add_argument("--chats", type=int, default=1)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for the last notification")
+    parser.add_argument("--details", action="store_true", help="include every notification round with its new slots")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(replay(args))
+    serialized = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(serialized, encoding="utf-8")
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from app.db.db import (
+    WildberriesCacheManager,
+    TrackedWarehouseManager,
+    BoxTypeManager,
+    DateManager,
+)
+from app.db.codecs import Codec, decode
+from app.dto import WarehouseShort, RightDate
+from app.keyboards.keyboards import (
+    WarehousesKeyboard,
+    BoxTypesKeyboard,
+    DateKeyboard,
+)
+from benchmarks.fake_wb_api import COEFFICIENTS_PATH, TARIFFS_PATH, WAREHOUSES_PATH, FakeAPIConfig, FakeWildberriesAPI
+from benchmarks.stubs import StubBot, STUB_TELEGRAM_TOKEN
+from benchmarks.synthetic import generate_coefficients
+
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+BenchmarkRun = Callable[[], Awaitable[None]]
+
+
+@dataclass
+class Scenario:
+    rows: int
+    chats: int
+    subscriptions: int
+    db_path: Path
+    payload: list[dict] = field(default_factory=list)
+    cleanups: list[Callable[[], Awaitable[None]]] = field(default_factory=list)
+
+    @property
+    def warehouses(self) -> list[WarehouseShort]:
+        unique = {
+            wh["warehouseID"]: WarehouseShort(id=wh["warehouseID"], name=wh["warehouseName"])
+            for wh in self.payload
+        }
+        return list(unique.values())
+
+    @property
+    def box_types(self) -> list[str]:
+        return sorted({wh["boxTypeName"] for wh in self.payload})
+
+    @property
+    def dates(self) -> list[str]:
+        return sorted({wh["date"] for wh in self.payload})
+
+
+BENCHMARKS: dict[str, Callable[[Scenario], Awaitable[BenchmarkRun]]] = {}
+# benchmarks that do not depend on the payload size run once with rows=0
+UNSIZED_BENCHMARKS: set[str] = set()
+
+
+def benchmark(name: str, sized: bool = True):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        if not sized:
+            UNSIZED_BENCHMARKS.add(name)
+        return func
+    return decorator
+
+
+async def track_subscriptions(scenario: Scenario) -> None:
+    warehouse_manager = TrackedWarehouseManager(scenario.db_path)
+    box_type_manager = BoxTypeManager(scenario.db_path)
+    date_manager = DateManager(scenario.db_path)
+    for manager in (warehouse_manager, box_type_manager, date_manager):
+        await manager.initialize()
+        await manager.clear()
+
+    for warehouse in scenario.warehouses[:scenario.subscriptions]:
+        await warehouse_manager.add(warehouse)
+    for box_type in scenario.box_types[:2]:
+        await box_type_manager.add(box_type)
+    for date in scenario.dates[:7]:
+        await date_manager.add(date)
+
+
+@benchmark("cache.set")
+async def bench_cache_set(scenario: Scenario) -> BenchmarkRun:
+    manager = WildberriesCacheManager(scenario.db_path)
+    await manager.initialize()
+
+    async def run():
+        await manager.set("supply_data", scenario.payload)
+    return run
+
+
+@benchmark("cache.get")
+async def bench_cache_get(scenario: Scenario) -> BenchmarkRun:
+    manager = WildberriesCacheManager(scenario.db_path)
+    await manager.initialize()
+    await manager.set("supply_data", scenario.payload)
+
+    async def run():
+        await manager.get("supply_data")
+    return run
+
+
+@benchmark("cache.get.hot", sized=False)
+async def bench_cache_get_hot(scenario: Scenario) -> BenchmarkRun:
+    """Small keys handlers read on every update, served by the in-process cache"""
+    manager = WildberriesCacheManager(scenario.db_path)
+    await manager.initialize()
+    await manager.set("coefficient", 5)
+
+    async def run():
+        for _ in range(1000):
+            await manager.get("coefficient")
+    return run
+
+
+def bench_cache_codec(codec: Codec):
+    """set_raw of the API body and decoding it back, the snapshot path of monitor and bot"""
+    async def bench(scenario: Scenario) -> BenchmarkRun:
+        manager = WildberriesCacheManager(scenario.db_path, codecs={}, default_codec=codec)
+        await manager.initialize()
+        body = json.dumps(scenario.payload).encode()
+
+        async def run():
+            await manager.set_raw("supply_data", body)
+            decode(await manager.get_raw("supply_data"))
+        return run
+    return bench
+
+
+for codec_spec in ("json", "zlib", "zstd"):
+    try:
+        benchmark(f"cache.codec.{codec_spec}")(bench_cache_codec(Codec.parse(codec_spec)))
+    except ValueError:
+        # zstd is optional
+        pass
+
+
+@benchmark("bot.send_notifications")
+async def bench_send_notifications(scenario: Scenario) -> BenchmarkRun:
+    from app.bot import TelegramBot
+
+    chat_ids = list(range(1, scenario.chats + 1))
+    bot = TelegramBot(STUB_TELEGRAM_TOKEN, scenario.db_path, chat_ids)
+    bot.bot = StubBot()
+
+    await bot.cache_manager.initialize()
+    await bot.rule_manager.initialize()
+    await bot.cache_manager.set("supply_data", scenario.payload)
+    await bot.cache_manager.set("coefficient", 10)
+    await track_subscriptions(scenario)
+
+    async def run():
+        await bot.send_notifications()
+    return run
+
+
+@benchmark("rules.evaluate")
+async def bench_rules_evaluate(scenario: Scenario) -> BenchmarkRun:
+    """Decision table of scenario.subscriptions * 20 rules over the snapshot and its predecessor"""
+    from app.api_data_processor import evaluate_rules
+    from app.dto import Rule
+    from app.rules import decision_table
+
+    raw = json.dumps(scenario.payload)
+    warehouses = scenario.warehouses
+    box_types = [*scenario.box_types, None]
+    rules = [
+        Rule(
+            id=i,
+            warehouse_id=warehouses[i % len(warehouses)].id,
+            box_type=box_types[i % len(box_types)],
+            coefficient_less=i % 20,
+            drop_by=5 if i % 7 == 0 else None,
+        )
+        for i in range(scenario.subscriptions * 20)
+    ]
+    table = decision_table(rules)
+
+    async def run():
+        evaluate_rules(raw, table, scenario.dates[:7], raw)
+    return run
+
+
+@benchmark("keyboards.warehouses")
+async def bench_warehouses_keyboard(scenario: Scenario) -> BenchmarkRun:
+    warehouses = scenario.warehouses
+
+    async def run():
+        WarehousesKeyboard(warehouses).build()
+    return run
+
+
+@benchmark("keyboards.box_types")
+async def bench_box_types_keyboard(scenario: Scenario) -> BenchmarkRun:
+    box_types = scenario.box_types
+
+    async def run():
+        BoxTypesKeyboard(box_types).build()
+    return run
+
+
+@benchmark("keyboards.dates")
+async def bench_dates_keyboard(scenario: Scenario) -> BenchmarkRun:
+    today = RightDate(datetime.datetime(2024, 9, 9))
+    dates = [(date.display_date(), date) for date in (today + i for i in range(15))]
+
+    async def run():
+        DateKeyboard(dates).build()
+    return run
+
+
+@benchmark("search.warehouses")
+async def bench_search_warehouses(scenario: Scenario) -> BenchmarkRun:
+    from app.utils.search import WarehouseSearchIndex
+
+    index = WarehouseSearchIndex(scenario.warehouses)
+    queries = ["коледино", "koledino", "сц казань", "тихорецкая", "ека", "zzz"]
+
+    async def run():
+        for query in queries:
+            index.search(query)
+    return run
+
+
+@benchmark("db.warehouses.crud")
+async def bench_warehouses_crud(scenario: Scenario) -> BenchmarkRun:
+    manager = TrackedWarehouseManager(scenario.db_path)
+    await manager.initialize()
+    warehouses = scenario.warehouses[:scenario.subscriptions]
+
+    async def run():
+        for warehouse in warehouses:
+            await manager.add(warehouse)
+        await manager.get_all()
+        for warehouse in warehouses:
+            await manager.drop(warehouse.id)
+    return run
+
+
+@benchmark("db.box_types.crud")
+async def bench_box_types_crud(scenario: Scenario) -> BenchmarkRun:
+    manager = BoxTypeManager(scenario.db_path)
+    await manager.initialize()
+    box_types = scenario.box_types
+
+    async def run():
+        for box_type in box_types:
+            await manager.add(box_type)
+        await manager.get_all()
+        for box_type in box_types:
+            await manager.drop(box_type)
+    return run
+
+
+@benchmark("db.dates.crud")
+async def bench_dates_crud(scenario: Scenario) -> BenchmarkRun:
+    manager = DateManager(scenario.db_path)
+    await manager.initialize()
+    dates = scenario.dates
+
+    async def run():
+        for date in dates:
+            await manager.add(date)
+        await manager.get_all()
+        for date in dates:
+            await manager.drop(date)
+    return run
+
+
+def python_run(code: str, env: dict | None = None) -> BenchmarkRun:
+    async def run():
+        process = await asyncio.create_subprocess_exec(sys.executable, "-c", code, env=env)
+        if await process.wait() != 0:
+            raise RuntimeError(f"python -c {code!r} failed")
+    return run
+
+
+@benchmark("startup.import.main", sized=False)
+async def bench_import_main(scenario: Scenario) -> BenchmarkRun:
+    return python_run("import app.main")
+
+
+@benchmark("startup.import.monitor", sized=False)
+async def bench_import_monitor(scenario: Scenario) -> BenchmarkRun:
+    return python_run("import app.main, app.api_monitor")
+
+
+@benchmark("startup.import.bot", sized=False)
+async def bench_import_bot(scenario: Scenario) -> BenchmarkRun:
+    return python_run("import app.main, app.bot")
+
+
+@benchmark("startup.first_poll", sized=False)
+async def bench_first_poll(scenario: Scenario) -> BenchmarkRun:
+    """From spawning a monitor-only service to its first request reaching the (fake) API"""
+    api = FakeWildberriesAPI(FakeAPIConfig(rows=1000, requests_per_minute=10_000, latency_ms=0, latency_jitter_ms=0))
+    runner = web.AppRunner(api.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    scenario.cleanups.append(runner.cleanup)
+
+    env = {
+        **os.environ,
+        "SERVICE_MODE": "monitor",
+        "WB_SUPPLY_API_TOKEN": "benchmark",
+        "WB_SUPPLY_API_URL": f"http://{host}:{port}{COEFFICIENTS_PATH}",
+        "WB_WAREHOUSES_API_URL": f"http://{host}:{port}{WAREHOUSES_PATH}",
+        "WB_TARIFFS_API_URL": f"http://{host}:{port}{TARIFFS_PATH}",
+    }
+    runs = 0
+
+    async def run():
+        nonlocal runs
+        runs += 1
+        requests_before = api.stats["requests"]
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app.main",
+            # a fresh database each time, the lease of a terminated run is only freed after its ttl
+            env={**env, "DB_PATH": str(scenario.db_path.with_name(f"first_poll_{runs}.sqlite"))},
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            while api.stats["requests"] == requests_before:
+                if process.returncode is not None:
+                    raise RuntimeError("Monitor exited before polling")
+                await asyncio.sleep(0.002)
+        finally:
+            process.terminate()
+            await process.wait()
+    return run
+
+
+def summarize(timings: list[float]) -> dict:
+    ordered = sorted(timings)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+    }
+
+
+async def measure(run: BenchmarkRun, repeat: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        await run()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await run()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(args: argparse.Namespace) -> dict:
+    selected = [
+        name for name in BENCHMARKS
+        if not args.only or any(name.startswith(prefix) for prefix in args.only)
+    ]
+    results = []
+
+    runs = [(0, [name for name in selected if name in UNSIZED_BENCHMARKS])]
+    runs += [(rows, [name for name in selected if name not in UNSIZED_BENCHMARKS]) for rows in args.sizes]
+
+    for rows, names in runs:
+        payload = generate_coefficients(rows, seed=args.seed)
+        for name in names:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                scenario = Scenario(
+                    rows=rows,
+                    chats=args.chats,
+                    subscriptions=args.subscriptions,
+                    db_path=Path(tmp_dir) / "bench.sqlite",
+                    payload=payload,
+                )
+                run = await BENCHMARKS[name](scenario)
+                try:
+                    timings = await measure(run, args.repeat, args.warmup)
+                finally:
+                    for cleanup in scenario.cleanups:
+                        await cleanup()
+
+            stats = summarize(timings)
+            results.append({
+                "name": name,
+                "rows": rows,
+                "chats": args.chats,
+                "subscriptions": args.subscriptions,
+                "repeat": args.repeat,
+                "stats": stats,
+            })
+            print(f"{name:<28} rows={rows:<7} median={stats['median'] * 1000:10.3f} ms", file=sys.stderr)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the poll -> filter -> notify pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="payload sizes in rows")
+    parser.add_argument("--chats", type=int, default=10, help="number of chats receiving notifications")
+    parser.add_argument("--subscriptions", type=int, default=50, help="number of tracked warehouses")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="run only benchmarks whose name starts with one of these prefixes")
+    parser.add_argument("--output", type=Path, help="write JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmarks(args))
+    serialized = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(serialized, encoding="utf-8")
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()
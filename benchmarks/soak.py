@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from aiohttp import web
+
+from app.api_monitor import WildberriesSupplyAPIMonitor
+from app.config import configure_logging
+from benchmarks.fake_wb_api import COEFFICIENTS_PATH, FakeWildberriesAPI, parse_args as parse_api_args
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the peak, not the current value, but it is all macOS gives us
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def slot_key(row: dict) -> tuple:
+    return row["warehouseID"], row["boxTypeName"], row["date"]
+
+
+class DetectionTracker:
+    """Matches slots opened by the fake API with the first poll that saw them open"""
+
+    def __init__(self, api: FakeWildberriesAPI):
+        self.api = api
+        self.seen_until = time.time()
+        self.pending: list[dict] = []
+        self.latencies: list[float] = []
+        self.polls = 0
+
+    def observe(self, payload: list[dict], received_at: float) -> None:
+        self.polls += 1
+        self.pending.extend(
+            event for event in self.api.market.opened
+            if self.seen_until < event["opened_at"] <= received_at
+        )
+        self.seen_until = received_at
+
+        open_slots = {slot_key(row) for row in payload if row["coefficient"] != -1}
+        still_pending = []
+        for event in self.pending:
+            if slot_key(event) in open_slots:
+                self.latencies.append(received_at - event["opened_at"])
+            elif received_at - event["opened_at"] < 600:
+                still_pending.append(event)
+        self.pending = still_pending
+
+
+async def soak(args: argparse.Namespace, api: FakeWildberriesAPI) -> dict:
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+
+    tracker = DetectionTracker(api)
+    samples = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monitor = WildberriesSupplyAPIMonitor(
+            token="soak",
+            api_url=f"http://127.0.0.1:{args.port}{COEFFICIENTS_PATH}",
+            db_path=Path(tmp_dir) / "soak.sqlite",
+            requests_per_minute=args.requests_per_minute,
+        )
+        make_request = monitor.make_request
+
+        async def tracked_make_request() -> bytes:
+            body = await make_request()
+            tracker.observe(json.loads(body), time.time())
+            return body
+
+        monitor.make_request = tracked_make_request
+        monitor_task = asyncio.create_task(monitor.run())
+
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < args.duration:
+                await asyncio.sleep(args.sample_interval)
+                samples.append({
+                    "elapsed": time.monotonic() - started,
+                    "rss_bytes": current_rss_bytes(),
+                    "polls": tracker.polls,
+                })
+                print(
+                    f"t={samples[-1]['elapsed']:8.1f}s rss={samples[-1]['rss_bytes'] / 2 ** 20:8.1f} MiB "
+                    f"polls={tracker.polls} detected={len(tracker.latencies)}",
+                    file=sys.stderr,
+                )
+        finally:
+            monitor.stop()
+            await monitor_task
+            await runner.cleanup()
+
+    elapsed = time.monotonic() - started
+    latencies = sorted(tracker.latencies)
+    return {
+        "duration": elapsed,
+        "polls": tracker.polls,
+        "polls_per_minute": tracker.polls / elapsed * 60,
+        "api_stats": dict(api.stats),
+        "detection_latency": {
+            "count": len(latencies),
+            "undetected": len(tracker.pending),
+            "median": statistics.median(latencies) if latencies else None,
+            "p95": latencies[round(0.95 * (len(latencies) - 1))] if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "rss_growth_bytes": samples[-1]["rss_bytes"] - samples[0]["rss_bytes"] if samples else 0,
+        "samples": samples,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Run the monitor against the fake WB API and report soak metrics")
+    parser.add_argument("--duration", type=float, default=600, help="seconds to run")
+    parser.add_argument("--sample-interval", type=float, default=10)
+    parser.add_argument("--output", type=Path)
+    args, api_argv = parser.parse_known_args(argv)
+    api_args, api_config = parse_api_args(api_argv)
+    args.port = api_args.port
+    args.requests_per_minute = api_config.requests_per_minute
+
+    report = asyncio.run(soak(args, FakeWildberriesAPI(api_config)))
+    serialized = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(serialized, encoding="utf-8")
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()
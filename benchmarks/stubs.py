@@ -0,0 +1,15 @@
+class StubBot:
+    """Stands in for aiogram.Bot, records outgoing messages instead of sending"""
+
+    def __init__(self):
+        self.sent: list[tuple[int | str, str]] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def session_close(self):
+        ...
+
+
+# aiogram only validates the token format, it is never sent anywhere
+STUB_TELEGRAM_TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
@@ -0,0 +1,81 @@
+import datetime
+import math
+import random
+
+from app.dto import DATE_FORMAT, DeliveryType
+
+
+BOX_TYPE_IDS = {
+    DeliveryType.BOXES: 2,
+    DeliveryType.MONOPALLETS: 5,
+    DeliveryType.SUPERSAFE: 6,
+    DeliveryType.QR_DELIVERY_WITH_BOXES: None,
+}
+
+BASE_WAREHOUSE_NAMES = [
+    "Коледино", "Подольск", "Электросталь", "Казань", "Белые Столбы",
+    "Тула", "Новосибирск", "Екатеринбург - Испытателей 14г", "Краснодар (Тихорецкая)",
+    "Невинномысск", "Алматы Атакент", "Астана", "Минск", "Обухово",
+    "СЦ Абакан", "СЦ Барнаул", "СЦ Внуково", "СЦ Вологда", "СЦ Иркутск",
+    "СЦ Кемерово", "СЦ Курск", "СЦ Омск", "СЦ Псков", "СЦ Самара",
+]
+
+DAYS_AHEAD = 14
+
+# Roughly the distribution of a real coefficients payload: most slots are
+# closed (-1), a small share is free (0), the rest is spread up to 20.
+# Whatever is left after the weighted values falls into 2..19.
+COEFFICIENT_WEIGHTS = [(-1, 0.78), (0, 0.03), (1, 0.02), (5, 0.03), (10, 0.02), (20, 0.08)]
+
+
+def warehouse_names(count: int) -> list[str]:
+    names = []
+    for i in range(count):
+        base = BASE_WAREHOUSE_NAMES[i % len(BASE_WAREHOUSE_NAMES)]
+        suffix = i // len(BASE_WAREHOUSE_NAMES)
+        names.append(f"{base} {suffix + 1}" if suffix else base)
+    return names
+
+
+def random_coefficient(rng: random.Random) -> int:
+    roll = rng.random()
+    for value, weight in COEFFICIENT_WEIGHTS:
+        if roll < weight:
+            return value
+        roll -= weight
+    return rng.randint(2, 19)
+
+
+def generate_coefficients(
+    rows: int,
+    seed: int = 0,
+    start_date: datetime.datetime | None = None,
+) -> list[dict]:
+    """Builds a payload shaped like the WB acceptance coefficients response"""
+    rng = random.Random(seed)
+    start_date = start_date or datetime.datetime(2024, 9, 9)
+    dates = [
+        (start_date + datetime.timedelta(days=i)).strftime(DATE_FORMAT)
+        for i in range(DAYS_AHEAD)
+    ]
+    per_warehouse = len(dates) * len(BOX_TYPE_IDS)
+    names = warehouse_names(math.ceil(rows / per_warehouse))
+
+    payload = []
+    for index, name in enumerate(names):
+        warehouse_id = 100000 + index
+        for date in dates:
+            for box_type, box_type_id in BOX_TYPE_IDS.items():
+                row = {
+                    "date": date,
+                    "coefficient": random_coefficient(rng),
+                    "warehouseID": warehouse_id,
+                    "warehouseName": name,
+                    "boxTypeName": box_type.value,
+                }
+                if box_type_id is not None:
+                    row["boxTypeID"] = box_type_id
+                payload.append(row)
+                if len(payload) == rows:
+                    return payload
+    return payload
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import collections
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+
+from aiohttp import web
+
+from app.bot import TelegramBot
+from app.catalog import Catalog
+from app.config import configure_logging
+from app.db.db import CatalogManager
+from app.dto import DeliveryType
+from app.keyboards.keyboards import Buttons
+from app.metrics import DB_QUERY_SECONDS, HANDLER_SECONDS
+from benchmarks.fake_telegram_api import Call, FakeTelegramAPI
+from benchmarks.replay import percentile
+from benchmarks.stubs import STUB_TELEGRAM_TOKEN
+from benchmarks.synthetic import warehouse_names
+
+# weights of what a user does next once they saw the main menu
+ACTIONS = {"toggle": 0.6, "menu": 0.2, "coefficient": 0.15, "start": 0.05}
+LOADING_TEXT = "⏳ Loading..."
+
+
+def summarize(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else None,
+    }
+
+
+def sent_message(call: Call) -> bool:
+    return call[0] == "sendMessage" and call[2]["text"] != LOADING_TEXT
+
+
+def sent_warehouses_menu(call: Call) -> bool:
+    markup = call[0] == "sendMessage" and call[2].get("reply_markup")
+    return bool(markup) and markup["inline_keyboard"][0][0]["callback_data"].startswith("wh:")
+
+
+class SimulatedUser:
+    """Opens menus, toggles warehouses and sets the coefficient in a private chat, timing every answer"""
+
+    def __init__(self, api: FakeTelegramAPI, user_id: int, args: argparse.Namespace, results: dict[str, list]):
+        self.api = api
+        self.user_id = user_id
+        self.args = args
+        self.results = results
+        self.rng = random.Random(args.seed * 1_000_003 + user_id)
+        self.coefficient_button: str | None = None
+        self.menu: dict | None = None
+
+    async def request(self, action: str, send, predicate) -> Call | None:
+        """Sends an update and waits for the answer of the bot, None on a timeout"""
+        response = self.api.expect(self.user_id, predicate)
+        started = time.monotonic()
+        send()
+        try:
+            call = await asyncio.wait_for(response, self.args.response_timeout)
+        except asyncio.TimeoutError:
+            # usually the handler raised, see the log
+            self.results["timeouts"].append(action)
+            return None
+        self.results[action].append(time.monotonic() - started)
+        return call
+
+    def remember_keyboard(self, call: Call) -> None:
+        markup = call[1].get("reply_markup") or {}
+        for row in markup.get("keyboard", []):
+            for button in row:
+                if button["text"].startswith(Buttons.COEFFICIENT_F_REPLY.value.text.split("(")[0]):
+                    self.coefficient_button = button["text"]
+
+    async def start(self) -> None:
+        call = await self.request("start", lambda: self.api.send_text(self.user_id, "/start"), sent_message)
+        if call is not None:
+            self.remember_keyboard(call)
+
+    async def open_menu(self) -> None:
+        text = Buttons.ADD_WAREHOUSE_REPLY.value.text
+        call = await self.request("menu", lambda: self.api.send_text(self.user_id, text), sent_warehouses_menu)
+        if call is not None:
+            self.menu = call[2]
+
+    async def toggle(self) -> None:
+        if self.menu is None:
+            return await self.open_menu()
+        message_id = self.menu["message_id"]
+        message = self.api.messages.get((self.user_id, message_id))
+        if message is None:
+            # deleted when the user opened the menu again
+            self.menu = None
+            return await self.open_menu()
+        buttons = [button for row in message["reply_markup"]["inline_keyboard"] for button in row]
+        data = self.rng.choice(buttons)["callback_data"]
+        callback_id = None
+
+        def click():
+            nonlocal callback_id
+            callback_id = self.api.click(self.user_id, message_id, data)
+
+        await self.request(
+            "toggle", click,
+            lambda call: call[0] == "answerCallbackQuery" and call[1]["callback_query_id"] == callback_id,
+        )
+
+    async def set_coefficient(self) -> None:
+        if self.coefficient_button is None:
+            return await self.start()
+        button = self.coefficient_button
+        if await self.request("coefficient", lambda: self.api.send_text(self.user_id, button), sent_message) is None:
+            return
+        value = str(self.rng.randint(0, 20))
+        call = await self.request("coefficient", lambda: self.api.send_text(self.user_id, value), sent_message)
+        if call is not None:
+            self.remember_keyboard(call)
+
+    async def run(self, until: float) -> None:
+        await self.start()
+        actions = {
+            "toggle": self.toggle,
+            "menu": self.open_menu,
+            "coefficient": self.set_coefficient,
+            "start": self.start,
+        }
+        while time.monotonic() < until:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time))
+            if time.monotonic() >= until:
+                break
+            action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+            await actions[action]()
+
+
+async def drive(args: argparse.Namespace, api: FakeTelegramAPI, ready: threading.Event) -> dict:
+    """Serves the fake API and runs the users, in a thread and loop of its own"""
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    ready.set()
+    try:
+        await asyncio.wait_for(api.polling.wait(), 30)
+        # action -> latencies, "timeouts" -> actions not answered in time
+        results: dict[str, list] = collections.defaultdict(list)
+        started = time.monotonic()
+        until = started + args.ramp + args.duration
+
+        async def user(index: int) -> None:
+            await asyncio.sleep(args.ramp * index / args.users)
+            await SimulatedUser(api, 1_000_000 + index, args, results).run(until)
+
+        await asyncio.gather(*(user(index) for index in range(args.users)))
+        return {"elapsed": time.monotonic() - started, "results": results}
+    finally:
+        await runner.cleanup()
+
+
+def query_counts() -> dict[str, int]:
+    return {
+        ".".join(value for _, value in key): sum(counts)
+        for key, (counts, _) in DB_QUERY_SECONDS.values.items()
+    }
+
+
+async def sample_lag(samples: list[float], interval: float) -> None:
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.monotonic() - expected))
+
+
+async def seed(db_path: Path, warehouses: int) -> None:
+    catalog = Catalog(CatalogManager(db_path))
+    await catalog.initialize()
+    await catalog.merge_snapshot(
+        list(enumerate(warehouse_names(warehouses), start=1)),
+        {box_type.value: None for box_type in DeliveryType},
+    )
+
+
+async def load(args: argparse.Namespace) -> dict:
+    api = FakeTelegramAPI()
+    ready = threading.Event()
+    driven: dict = {}
+    driver = threading.Thread(
+        target=lambda: driven.update(asyncio.run(drive(args, api, ready))),
+        name="telegram-load",
+        daemon=True,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "load.sqlite"
+        await seed(db_path, args.warehouses)
+        bot = TelegramBot(STUB_TELEGRAM_TOKEN, db_path, [], api_url=f"http://127.0.0.1:{args.port}")
+
+        driver.start()
+        await asyncio.to_thread(ready.wait)
+        queries_before = query_counts()
+        lag: list[float] = []
+        sampler = asyncio.create_task(sample_lag(lag, args.lag_interval))
+        bot_task = asyncio.create_task(bot.run())
+        try:
+            await asyncio.to_thread(driver.join)
+        finally:
+            sampler.cancel()
+            bot.stop()
+            await bot_task
+
+    if "results" not in driven:
+        raise RuntimeError("Load driver failed, see the log")
+    results = driven["results"]
+    queries_after = query_counts()
+    updates = api.stats["updates_delivered"]
+    queries = {name: count - queries_before.get(name, 0) for name, count in queries_after.items()}
+    queries = {name: count for name, count in sorted(queries.items(), key=lambda item: -item[1]) if count}
+
+    return {
+        "users": args.users,
+        "seconds": driven["elapsed"],
+        "updates": updates,
+        "updates_per_second": updates / driven["elapsed"],
+        "timeouts": dict(collections.Counter(results["timeouts"])),
+        "latency": {action: summarize(results[action]) for action in ACTIONS},
+        "latency_all": summarize([value for action in ACTIONS for value in results[action]]),
+        "db_queries_per_update": sum(queries.values()) / updates if updates else None,
+        "db_queries": {name: count / updates for name, count in queries.items()} if updates else {},
+        "handler_mean_seconds": {
+            dict(key)["handler"]: total[0] / sum(counts)
+            for key, (counts, total) in HANDLER_SECONDS.values.items()
+        },
+        "event_loop_lag": summarize(lag),
+        "api_calls": dict(api.stats),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Drive the bot with simulated users through the fake Telegram Bot API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="seconds every user stays active after the ramp")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which users join")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between the actions of a user")
+    parser.add_argument("--warehouses", type=int, default=100, help="warehouses in the catalog, i.e. menu buttons")
+    parser.add_argument("--response-timeout", type=float, default=10, help="seconds until an update counts as unanswered")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="seconds between event loop lag samples")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(load(args))
+    serialized = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(serialized, encoding="utf-8")
+    else:
+        print(serialized)
+    if report["timeouts"]:
+        print(f"{sum(report['timeouts'].values())} updates were not answered within {args.response_timeout} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()